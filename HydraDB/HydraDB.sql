@@ -55,6 +55,17 @@ CREATE TABLE tRolePerm (
     FOREIGN KEY (role_id) REFERENCES tRole(role_id)
 );
 
+CREATE TABLE tUserToken (
+    token_id   INT          NOT NULL PRIMARY KEY AUTO_INCREMENT,
+    user_id    INT          NOT NULL,
+    token_hash VARCHAR(64)  NOT NULL,
+    token_name VARCHAR(60)  NOT NULL default '',
+    last_used  DATETIME,
+    cr_date    TIMESTAMP default localtimestamp,
+    UNIQUE (token_hash),
+    FOREIGN KEY (user_id) REFERENCES tUser(user_id)
+);
+
 /* Project network and scenearios */
 
 CREATE TABLE tProject (
@@ -132,8 +143,10 @@ CREATE TABLE tScenario (
     end_time             DECIMAL(30, 20) UNSIGNED,
     time_step            VARCHAR(60),
     locked               VARCHAR(1) default 'N' NOT NULL,
+    parent_id            INT,
     cr_date  TIMESTAMP default localtimestamp,
     FOREIGN KEY (network_id) REFERENCES tNetwork(network_id),
+    FOREIGN KEY (parent_id) REFERENCES tScenario(scenario_id),
     constraint chk_status check (status in ('A', 'X')),
     constraint chk_locked check (locked in ('Y', 'N')),
     UNIQUE (network_id, scenario_name)
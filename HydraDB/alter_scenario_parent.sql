@@ -0,0 +1,4 @@
+/* Child scenarios, which only store the data which differs from their parent scenario. */
+alter table tScenario add column parent_id INT;
+/* mysql only. sqlite cannot add a foreign key to an existing table. */
+alter table tScenario add foreign key (parent_id) references tScenario(scenario_id);
@@ -24,6 +24,8 @@ from copy import deepcopy
 from HydraLib.HydraException import HydraError
 
 import config
+import numpy as np
+import pandas as pd
 from lxml import etree
 import logging
 
@@ -48,6 +50,12 @@ class Units(object):
     static_dimensions = []
     unit_description = dict()
     unit_info = dict()
+    #unit -> dimension
+    unit_dimensions = dict()
+    #unit specification (such as '10^6 m^3') -> (unit, factor)
+    parsed_units = dict()
+    #(unit1, unit2) -> (ratio, offset, factor1, factor2). See get_conversion.
+    conversions = dict()
 
     def __init__(self):
         default_user_file_location = os.path.realpath(\
@@ -101,6 +109,7 @@ class Units(object):
                 self.dimensions.update({dimension: []})
             for unit in element:
                 self.dimensions[dimension].append(unit.get('abbr'))
+                self.unit_dimensions.setdefault(unit.get('abbr'), dimension)
                 self.units.update({unit.get('abbr'):
                                    (float(unit.get('lf')),
                                     float(unit.get('cf')))})
@@ -121,42 +130,67 @@ class Units(object):
         """
 
         unit, factor = self.parse_unit(unit)
-        for dim in self.dimensions.keys():
-            if unit in self.dimensions[dim]:
-                return dim
-        raise HydraError('Unit %s not found.'%(unit))
+        dimension = self.unit_dimensions.get(unit)
+        if dimension is None:
+            raise HydraError('Unit %s not found.'%(unit))
+        return dimension
+
+    def get_conversion(self, unit1, unit2):
+        """Get the factors needed to convert values from unit1 to unit2:
+        (ratio, offset, factor1, factor2), where a value v in unit1 is
+        (ratio * (factor1 * v) + offset) / factor2 in unit2.
+        """
+        conversion = self.conversions.get((unit1, unit2))
+        if conversion is None:
+            if self.get_dimension(unit1) != self.get_dimension(unit2):
+                raise HydraError("Unit conversion: dimensions are not consistent.")
+            abbr1, factor1 = self.parse_unit(unit1)
+            abbr2, factor2 = self.parse_unit(unit2)
+            conv_factor1 = self.units[abbr1]
+            conv_factor2 = self.units[abbr2]
+            conversion = (conv_factor1[0] / conv_factor2[0],
+                          (conv_factor1[1] - conv_factor2[1]) / conv_factor2[0],
+                          factor1,
+                          factor2)
+            self.conversions[(unit1, unit2)] = conversion
+        return conversion
 
     def convert(self, values, unit1, unit2):
         """Convert a value from one unit to another one. The two units must
-        represent the same physical dimension.
+        represent the same physical dimension. Values can be a number, a
+        list of numbers, a numpy array or a pandas series or dataframe,
+        which are converted as a whole and returned as the same type.
         """
-        if self.get_dimension(unit1) == self.get_dimension(unit2):
-            unit1, factor1 = self.parse_unit(unit1)
-            unit2, factor2 = self.parse_unit(unit2)
-            conv_factor1 = self.units[unit1]
-            conv_factor2 = self.units[unit2]
-
-            if isinstance(values, float):
-                return (conv_factor1[0] / conv_factor2[0] * (factor1 * values)
-                        + (conv_factor1[1] - conv_factor2[1])
-                        / conv_factor2[0]) / factor2
-            elif isinstance(values, list):
-                return [(conv_factor1[0] / conv_factor2[0] * (factor1 * value)
-                        + (conv_factor1[1] - conv_factor2[1])
-                        / conv_factor2[0]) / factor2 for value in values]
+        ratio, offset, factor1, factor2 = self.get_conversion(unit1, unit2)
+
+        if isinstance(values, (np.ndarray, pd.Series, pd.DataFrame)):
+            return (ratio * (factor1 * values) + offset) / factor2
+        elif isinstance(values, list):
+            values = np.asarray(values, dtype=float)
+            return ((ratio * (factor1 * values) + offset) / factor2).tolist()
         else:
-            raise HydraError("Unit conversion: dimensions are not consistent.")
+            return (ratio * (factor1 * float(values)) + offset) / factor2
 
     def parse_unit(self, unit):
         """Helper function that extracts constant factors from unit
         specifications. This allows to specify units similar to this: 10^6 m^3.
         """
-        try:
-            float(unit[0])
-            factor, unit = unit.split(' ', 1)
-            return unit, float(factor)
-        except ValueError:
-            return unit, 1.0
+        parsed = self.parsed_units.get(unit)
+        if parsed is None:
+            try:
+                float(unit[0])
+                factor, abbr = unit.split(' ', 1)
+                parsed = (abbr, float(factor))
+            except ValueError:
+                parsed = (unit, 1.0)
+            self.parsed_units[unit] = parsed
+        return parsed
+
+    def _units_changed(self):
+        """Forget the conversions worked out so far, as the
+        factors of a unit have changed.
+        """
+        self.conversions.clear()
 
     def get_dimensions(self):
         """Get a list of all dimenstions listed in one of the xml files.
@@ -203,6 +237,9 @@ class Units(object):
             del self.userdimensions[idx]
             if dimension not in self.static_dimensions:
                 del self.dimensions[dimension]
+                for unit, unit_dimension in self.unit_dimensions.items():
+                    if unit_dimension == dimension:
+                        del self.unit_dimensions[unit]
             # Delete dimension form XML tree
             for element in self.usertree:
                 if element.get('name') == dimension:
@@ -229,6 +266,8 @@ class Units(object):
             self.unit_description.update({unit['abbr']: unit['name']})
             self.userunits.append(unit['abbr'])
             self.unit_info.update({unit['abbr']: unit['info']})
+            self.unit_dimensions.setdefault(unit['abbr'], dimension)
+            self._units_changed()
             # Update XML tree
             element_index = None
             for i, element in enumerate(self.usertree):
@@ -263,6 +302,8 @@ class Units(object):
             self.units.update({unit['abbr']:
                                (float(unit['lf']), float(unit['cf']))})
             self.unit_description.update({unit['abbr']: unit['name']})
+            self.unit_dimensions[unit['abbr']] = dimension
+            self._units_changed()
             # Update XML tree
             if 'info' not in unit.keys() or unit['info'] is None:
                 unit['info'] = ''
@@ -293,6 +334,8 @@ class Units(object):
             self.dimensions[unit['dimension']].remove(unit['abbr'])
             del self.units[unit['abbr']]
             del self.unit_description[unit['abbr']]
+            self.unit_dimensions.pop(unit['abbr'], None)
+            self._units_changed()
             # Update XML tree
             element_index = None
             for i, element in enumerate(self.usertree):
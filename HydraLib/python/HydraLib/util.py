@@ -570,8 +570,9 @@ def validate_EQUALTIMESTEPS(value, restriction):
 
     if type(value) == pd.DataFrame:
         if str(value.index[0]).startswith('9999'):
-            tmp_val = value.to_json().replace('9999', '1900')
-            value = pd.read_json(tmp_val)
+            #Only the times are needed, so just move them out of the seasonal year.
+            seasonal_idx = [get_datetime(str(t).replace('9999', '1900', 1)) for t in value.index]
+            value = pd.DataFrame(index=pd.DatetimeIndex(seasonal_idx))
    
 
     #If the timeseries is not datetime-based, check for a consistent timestep
@@ -616,25 +617,205 @@ validation_func_map = dict(
     ISNULL         = validate_ISNULL,
 )
 
-def validate_value(restriction_dict, inval):
-    if len(restriction_dict) == 0:
-        return
+class _ValueArrays(object):
+    """
+        The numbers in a value (a list, numpy array or dataframe), flattened,
+        as they are needed by the numpy checks. Each is None if the value can't
+        be turned into such an array, in which case the validate_ functions are used.
+
+        raw: The values as they are, if they are all numbers.
+        converted: The values converted to floats, as _get_val does, so strings
+                   of numbers are accepted. None if there are any NaNs.
+    """
+    def __init__(self, value):
+        self.value = value
+        self._raw = self._converted = False
+
+    @property
+    def raw(self):
+        if self._raw is False:
+            self._raw = None
+            if isinstance(self.value, (list, np.ndarray, pd.DataFrame)):
+                try:
+                    if type(self.value) == pd.DataFrame:
+                        arr = self.value.values
+                    else:
+                        arr = np.asarray(self.value)
+                    if arr.dtype.kind in ('i', 'u', 'f', 'b') and arr.size > 0:
+                        self._raw = arr.ravel()
+                except Exception:
+                    pass
+        return self._raw
+
+    @property
+    def converted(self):
+        if self._converted is False:
+            self._converted = None
+            if self.raw is not None:
+                arr = self.raw.astype(np.float64)
+            elif isinstance(self.value, (list, np.ndarray, pd.DataFrame)):
+                try:
+                    if type(self.value) == pd.DataFrame:
+                        arr = self.value.values.astype(np.float64).ravel()
+                    else:
+                        arr = np.array(self.value, dtype=np.float64).ravel()
+                except Exception:
+                    arr = None
+            else:
+                arr = None
 
+            if arr is not None and arr.size > 0 and not np.isnan(arr).any():
+                self._converted = arr
+        return self._converted
+
+def _first(restriction):
+    #Sometimes restriction values can accidentally be put in the template <item>100</items>,
+    #Making them a list, not a number. Rather than blowing up, just get value 1 from the list.
+    if type(restriction) is list:
+        return restriction[0]
+    return restriction
+
+def _is_number(val):
+    return isinstance(val, (int, long, float)) and not isinstance(val, bool)
+
+def _compile_comparison(name, fails):
+    """
+        Make a numpy check for a rule which compares every value with a number.
+        fails(values, restriction) returns which values break the rule.
+    """
+    def compile_check(restriction):
+        restriction = _first(restriction)
+        if not _is_number(restriction):
+            return None
+        if name == 'MULTIPLEOF' and restriction == 0:
+            return None
+        def check(arrays):
+            values = arrays.converted
+            if values is None:
+                return False
+            if fails(values, restriction).any():
+                raise ValidationError("%s: %s"%(name, restriction))
+            return True
+        return check
+    return compile_check
+
+def _compile_VALUERANGE(restriction):
+    if type(restriction) is not list or len(restriction) != 2:
+        return None
     try:
+        min_val = Decimal(restriction[0])
+        max_val = Decimal(restriction[1])
+    except Exception:
+        return None
+    lower, upper = float(min_val), float(max_val)
+    def check(arrays):
+        values = arrays.converted
+        if values is None:
+            return False
+        if values.min() < lower or values.max() > upper:
+            raise ValidationError("VALUERANGE: %s, %s"%(min_val, max_val))
+        return True
+    return check
+
+def _compile_ENUM(restriction, message=None):
+    if type(restriction) is not list or not all(_is_number(r) for r in restriction):
+        return None
+    if message is None:
+        message = "ENUM : %s"%(restriction)
+    allowed = np.array(restriction, dtype=np.float64)
+    def check(arrays):
+        values = arrays.converted
+        if values is None:
+            return False
+        if not np.in1d(values, allowed).all():
+            raise ValidationError(message)
+        return True
+    return check
+
+def _compile_SUMTO(restriction):
+    restriction = _first(restriction)
+    def check(arrays):
+        values = arrays.raw
+        if values is None:
+            return False
+        #Add up in the same order as validate_SUMTO, so the result is identical.
+        if sum(values.tolist()) != restriction:
+            raise ValidationError("SUMTO: %s"%(restriction))
+        return True
+    return check
+
+def _compile_monotonic(name, fails):
+    def compile_check(restriction):
+        def check(arrays):
+            values = arrays.raw
+            if values is None:
+                return False
+            if fails(values[1:], values[:-1]).any():
+                raise ValidationError(name)
+            return True
+        return check
+    return compile_check
+
+#Rules which can be checked with numpy. Each function takes the restriction and
+#returns a check, or None if the restriction can't be checked this way. The
+#check takes a _ValueArrays and returns False if the value can't be checked
+#with numpy, so the validate_ function must be used.
+vector_compile_map = dict(
+    VALUERANGE    = _compile_VALUERANGE,
+    ENUM          = _compile_ENUM,
+    BOOL10        = lambda r: _compile_ENUM([1, 0], "BOOL10"),
+    EQUALTO       = _compile_comparison("EQUALTO", lambda v, r: v != r),
+    NOTEQUALTO    = _compile_comparison("NOTEQUALTO", lambda v, r: v == r),
+    LESSTHAN      = _compile_comparison("LESSTHAN", lambda v, r: v >= r),
+    LESSTHANEQ    = _compile_comparison("LESSTHANEQ", lambda v, r: v > r),
+    GREATERTHAN   = _compile_comparison("GREATERTHAN", lambda v, r: v <= r),
+    GREATERTHANEQ = _compile_comparison("GREATERTHANEQ", lambda v, r: v < r),
+    MULTIPLEOF    = _compile_comparison("MULTIPLEOF", lambda v, r: np.mod(v, r) != 0),
+    SUMTO         = _compile_SUMTO,
+    INCREASING    = _compile_monotonic("INCREASING", lambda v, prev: v < prev),
+    DECREASING    = _compile_monotonic("INCREASING", lambda v, prev: v > prev),
+)
+
+class CompiledRestriction(object):
+    """
+        A data restriction (a dictionary of rule type -> restriction), parsed
+        once so that it can be used to validate many values. Rules on numeric
+        arrays and timeseries are checked with numpy, others with the
+        validate_ functions.
+    """
+    def __init__(self, restriction_dict):
+        self.restriction_dict = restriction_dict
+        self.rules = []
         for restriction_type, restriction in restriction_dict.items():
             func = validation_func_map.get(restriction_type)
-            if func is None:
-                raise Exception("Validation type %s does not exist"%(restriction_type,))
-            func(inval, restriction)
-    except ValidationError, e:
-        log.exception(e)
-        err_val = re.sub('\s+', ' ', str(inval)).strip()
-        if len(err_val) > 60:
-            err_val = "%s..."%err_val[:60]
-        raise HydraError("Validation error (%s). Val %s does not conform with rule %s"%(restriction_type, err_val, e.message))
-    except Exception, e:
-        log.exception(e)
-        raise HydraError("An error occurred in validation. (%s)"%(e))
+            check = None
+            if restriction_type in vector_compile_map:
+                check = vector_compile_map[restriction_type](restriction)
+            self.rules.append((restriction_type, restriction, func, check))
+
+    def validate(self, inval):
+        if len(self.rules) == 0:
+            return
+
+        arrays = _ValueArrays(inval)
+        try:
+            for restriction_type, restriction, func, check in self.rules:
+                if func is None:
+                    raise Exception("Validation type %s does not exist"%(restriction_type,))
+                if check is None or check(arrays) is False:
+                    func(inval, restriction)
+        except ValidationError, e:
+            log.exception(e)
+            err_val = re.sub('\s+', ' ', str(inval)).strip()
+            if len(err_val) > 60:
+                err_val = "%s..."%err_val[:60]
+            raise HydraError("Validation error (%s). Val %s does not conform with rule %s"%(restriction_type, err_val, e.message))
+        except Exception, e:
+            log.exception(e)
+            raise HydraError("An error occurred in validation. (%s)"%(e))
+
+def validate_value(restriction_dict, inval):
+    CompiledRestriction(restriction_dict).validate(inval)
 
 def _flatten_value(value):
     """
@@ -14,7 +14,7 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 from sqlalchemy.orm import scoped_session
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, Table, Column, MetaData, BIGINT
 from HydraLib import config
 from zope.sqlalchemy import ZopeTransactionExtension
 
@@ -26,9 +26,46 @@ from sqlalchemy.ext.declarative import declarative_base
 global DeclarativeBase
 DeclarativeBase = declarative_base()
 
+def _make_engine(db_url):
+    """
+        Create the engine. Each thread serving requests uses its own
+        connection, so the connection pool is sized from the number of threads
+        the server runs, unless pool_size is set in the config.
+        sqlite connections can't be shared between threads, so sqlite
+        keeps its default pool.
+    """
+    if db_url.startswith('sqlite'):
+        return create_engine(db_url)
+
+    pool_size = config.getint('db', 'pool_size',
+                              config.getint('hydra_server', 'numthreads', 10))
+
+    return create_engine(db_url,
+                         pool_size=pool_size,
+                         max_overflow=config.getint('db', 'max_overflow', 10),
+                         pool_timeout=config.getint('db', 'pool_timeout', 30),
+                         pool_recycle=config.getint('db', 'pool_recycle', 3600))
+
 db_url = config.get('mysqld', 'url')
 log.info("Connecting to database: %s", db_url)
-engine = create_engine(db_url) 
+engine = _make_engine(db_url)
+
+#A table of data hashes, which is joined with tDataset to look up many
+#datasets by hash in one query, rather than in chunks of 'in' clauses.
+#Temporary tables belong to a connection, so it is created on each new
+#connection, outside of any transaction.
+tmp_hash_table = Table('tTmpDataHash', MetaData(),
+                       Column('data_hash', BIGINT(), primary_key=True),
+                       prefixes=['TEMPORARY'])
+
+@event.listens_for(engine, 'connect')
+def _create_tmp_tables(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS tTmpDataHash"
+                   " (data_hash BIGINT PRIMARY KEY)")
+    cursor.close()
+    dbapi_connection.commit()
+
 from sqlalchemy.orm import sessionmaker
 
 maker = sessionmaker(bind=engine, autoflush=False, autocommit=False,
@@ -46,3 +83,14 @@ def commit_transaction():
 
 def rollback_transaction():
     transaction.abort()
+
+def close_session():
+    """
+        Abort anything left in the current thread's transaction and remove
+        its session, so that the next request served by this thread
+        starts with a new one.
+    """
+    try:
+        transaction.abort()
+    finally:
+        DBSession.remove()
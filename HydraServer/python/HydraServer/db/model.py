@@ -33,7 +33,7 @@ from HydraLib.hydra_dateutil import ordinal_to_timestamp, get_datetime
 
 from HydraServer.db import DeclarativeBase as Base, DBSession
 
-from HydraServer.util import generate_data_hash, get_val
+from HydraServer.util import generate_data_hash, get_val, can_encode_timeseries, encode_timeseries
 
 from sqlalchemy.sql.expression import case
 from sqlalchemy import UniqueConstraint, and_
@@ -45,7 +45,7 @@ import zlib
 from HydraLib import config
 
 import logging
-import bcrypt
+from HydraServer.util.passwords import check_password
 log = logging.getLogger(__name__)
 
 def get_timestamp(ordinal):
@@ -149,15 +149,24 @@ class Dataset(Base):
                     test_vals.append(v)
 
                 timeseries_pd = pd.DataFrame(test_vals, index=pd.Series(test_val_keys))
-                #Epoch doesn't work here because dates before 1970 are not supported
-                #in read_json. Ridiculous.
-                json_value =  timeseries_pd.to_json(date_format='iso', date_unit='ns')
-                if len(json_value) > config.get('DATA', 'compression_threshold', 1000):
-                    self.value = zlib.compress(json_value)
-                else:
-                    self.value = json_value 
+            elif isinstance(val, pd.DataFrame):
+                timeseries_pd = val
             else:
                 self.value = val
+                return
+
+            if config.get('db', 'timeseries_format', 'binary') == 'binary'\
+               and can_encode_timeseries(timeseries_pd):
+                self.value = encode_timeseries(timeseries_pd)
+                return
+
+            #Epoch doesn't work here because dates before 1970 are not supported
+            #in read_json. Ridiculous.
+            json_value =  timeseries_pd.to_json(date_format='iso', date_unit='ns')
+            if len(json_value) > config.get('DATA', 'compression_threshold', 1000):
+                self.value = zlib.compress(json_value)
+            else:
+                self.value = json_value 
         else:
             raise HydraError("Invalid data type %s"%(data_type,))
 
@@ -1089,6 +1098,8 @@ class Scenario(Base):
     time_step = Column(String(60))
     cr_date = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
     created_by = Column(Integer(), ForeignKey('tUser.user_id'))
+    #A child scenario only stores the data which differs from its parent.
+    parent_id = Column(Integer(), ForeignKey('tScenario.scenario_id'), nullable=True)
 
     network = relationship('Network', backref=backref("scenarios", order_by=scenario_id))
 
@@ -1365,9 +1376,7 @@ class User(Base):
     roleusers = relationship('RoleUser', lazy='joined')
 
     def validate_password(self, password):
-        if bcrypt.hashpw(password.encode('utf-8'), self.password.encode('utf-8')) == self.password.encode('utf-8'):
-            return True
-        return False
+        return check_password(self.user_id, self.username, password, self.password)
 
     @property
     def permissions(self):
@@ -1385,6 +1394,23 @@ class User(Base):
             roles.append(ur.role)
         return set(roles)
 
+class UserToken(Base):
+    """
+        API tokens, which a user can log in with instead of a password.
+        Only the hash of the token is stored.
+    """
+
+    __tablename__='tUserToken'
+
+    token_id = Column(Integer(), primary_key=True, nullable=False)
+    user_id = Column(Integer(), ForeignKey('tUser.user_id'), nullable=False)
+    token_hash = Column(String(64),  nullable=False, unique=True, index=True)
+    token_name = Column(String(60),  nullable=False, server_default=text(u"''"))
+    last_used = Column(TIMESTAMP())
+    cr_date = Column(TIMESTAMP(),  nullable=False, server_default=text(u'CURRENT_TIMESTAMP'))
+
+    user = relationship('User', backref=backref('tokens', uselist=True, cascade="all, delete-orphan"))
+
 from HydraServer.db import engine
 Base.metadata.create_all(engine)
 
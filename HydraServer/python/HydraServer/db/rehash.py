@@ -0,0 +1,111 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Recalculate the data_hash of every dataset in the database.
+
+    This must be run once when upgrading from a version of Hydra which
+    used python's hash() to generate dataset hashes, as the hashes
+    of existing datasets will otherwise not match those of new ones.
+    It must also be run once on databases containing binary timeseries
+    hashed before their payloads were hashed decompressed.
+
+    Datasets are processed in batches, each batch being committed
+    separately, so the tool can be stopped and run again.
+
+    If two datasets turn out to have the same content, only the first
+    is given the new hash, as hashes must be unique. The others are
+    reported and left as they are.
+
+    Usage: python -m HydraServer.db.rehash [batch_size]
+"""
+import sys
+import logging
+import transaction
+
+from HydraServer.db import DBSession
+from HydraServer.db.model import Dataset, Metadata
+from HydraServer.util import generate_data_hash
+
+log = logging.getLogger(__name__)
+
+def _get_metadata(dataset_ids):
+    metadata = {}
+    for m in DBSession.query(Metadata).filter(Metadata.dataset_id.in_(dataset_ids)).all():
+        metadata.setdefault(m.dataset_id, {})[str(m.metadata_name)] = str(m.metadata_val)
+    return metadata
+
+def rehash_datasets(batch_size=500):
+    """
+        Rehash all the datasets. Returns the number of datasets updated
+        and a list of (dataset_id, duplicate_of) for the duplicates found.
+    """
+    new_hashes = {}
+    duplicates = []
+    updated = 0
+
+    last_dataset_id = 0
+    while True:
+        dataset_rs = DBSession.query(Dataset.dataset_id,
+                                     Dataset.data_name,
+                                     Dataset.data_units,
+                                     Dataset.data_dimen,
+                                     Dataset.data_type,
+                                     Dataset.value,
+                                     Dataset.data_hash).filter(
+                            Dataset.dataset_id > last_dataset_id).order_by(
+                            Dataset.dataset_id).limit(batch_size).all()
+
+        if len(dataset_rs) == 0:
+            break
+
+        metadata = _get_metadata([d.dataset_id for d in dataset_rs])
+
+        for d in dataset_rs:
+            new_hash = generate_data_hash(dict(data_name  = d.data_name,
+                                               data_units = d.data_units,
+                                               data_dimen = d.data_dimen,
+                                               data_type  = d.data_type,
+                                               value      = d.value,
+                                               metadata   = metadata.get(d.dataset_id, {})))
+
+            if new_hash in new_hashes:
+                log.warn("Dataset %s is a duplicate of dataset %s. Not rehashing it.",
+                         d.dataset_id, new_hashes[new_hash])
+                duplicates.append((d.dataset_id, new_hashes[new_hash]))
+                continue
+
+            new_hashes[new_hash] = d.dataset_id
+
+            if new_hash != d.data_hash:
+                DBSession.query(Dataset).filter(Dataset.dataset_id==d.dataset_id).update(
+                    {Dataset.data_hash : new_hash}, synchronize_session=False)
+                updated = updated + 1
+
+        last_dataset_id = dataset_rs[-1].dataset_id
+
+        transaction.commit()
+        log.info("Rehashed datasets up to %s (%s updated)", last_dataset_id, updated)
+
+    DBSession.remove()
+
+    return updated, duplicates
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO')
+    batch_size = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    updated, duplicates = rehash_datasets(batch_size)
+    log.info("Rehash complete. %s datasets updated, %s duplicates found.",
+             updated, len(duplicates))
@@ -29,6 +29,7 @@ from HydraServer.db.model import Attr,\
         ResourceScenario,\
         Dataset
 from HydraServer.db import DBSession
+from HydraServer.util.cache import network_cache
 from sqlalchemy.orm.exc import NoResultFound
 from HydraLib.HydraException import HydraError, ResourceNotFoundError
 from sqlalchemy import or_, and_
@@ -242,6 +243,8 @@ def update_resource_attribute(resource_attr_id, is_var, **kwargs):
 
     ra.is_var = is_var
 
+    network_cache.invalidate(ra.get_resource().network_id)
+
     return 'OK'
 
 def delete_resource_attribute(resource_attr_id, **kwargs):
@@ -255,6 +258,7 @@ def delete_resource_attribute(resource_attr_id, **kwargs):
         raise ResourceNotFoundError("Resource Attribute %s not found"%(resource_attr_id))
 
     ra.check_write_permission(user_id)
+    network_cache.invalidate(ra.get_resource().network_id)
     DBSession.delete(ra)
     DBSession.flush()
     return 'OK'
@@ -283,6 +287,7 @@ def add_resource_attribute(resource_type, resource_id, attr_id, is_var,**kwargs)
     attr_is_var = 'Y' if is_var else 'N'
 
     new_ra = resource_i.add_attribute(attr_id, attr_is_var)
+    network_cache.invalidate(resource_i.network_id)
     DBSession.flush()
 
     return new_ra
@@ -305,6 +310,7 @@ def add_resource_attrs_from_type(type_id, resource_type, resource_id,**kwargs):
             ra = resource_i.add_attribute(item.attr_id)
             new_resource_attrs.append(ra)
 
+    network_cache.invalidate(resource_i.network_id)
     DBSession.flush()
 
     return new_resource_attrs
@@ -19,25 +19,31 @@ from HydraLib.hydra_dateutil import get_datetime
 import logging
 from HydraServer.db.model import Dataset, Metadata, DatasetOwner, DatasetCollection,\
         DatasetCollectionItem, ResourceScenario, ResourceAttr, TypeAttr
-from HydraServer.util import generate_data_hash
+from HydraServer.util import generate_data_hash, decode_value, get_decoded_value,\
+        get_timeseries_positions
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import aliased, make_transient, joinedload_all
+from sqlalchemy.orm import aliased, make_transient, make_transient_to_detached, joinedload_all,\
+        load_only
 from sqlalchemy.sql.expression import case
 from sqlalchemy import func
 from sqlalchemy import null
-from HydraServer.db import DBSession
+from HydraServer.db import DBSession, engine, tmp_hash_table
+from HydraServer.util.cache import network_cache, value_cache
 from HydraLib import config
 
 import pandas as pd
+import numpy
+import math
+import base64
+from cStringIO import StringIO
 from HydraLib.HydraException import HydraError, PermissionError, ResourceNotFoundError
 from sqlalchemy import and_, or_
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql.expression import literal_column
-from sqlalchemy import distinct
+from sqlalchemy import distinct, bindparam
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 
-from decimal import Decimal
 import copy
 
 import json
@@ -161,34 +167,51 @@ def clone_dataset(dataset_id,**kwargs):
 
 def get_datasets(dataset_ids,**kwargs):
     """
-        Get a single dataset, by ID
+        Get a list of datasets, by ID.
+        The values of hidden datasets which the user does not own are not returned.
+        This is used to retrieve the values of a network retrieved without them,
+        so the datasets are retrieved in batches, along with their metadata.
     """
 
     user_id = int(kwargs.get('user_id'))
     datasets = []
     if len(dataset_ids) == 0:
         return []
-    try:
+
+    #Hidden datasets which the user does not own
+    is_forbidden = and_(Dataset.hidden=='Y', DatasetOwner.user_id == None)
+
+    for i in range(0, len(dataset_ids), qry_in_threshold):
+        id_chunk = dataset_ids[i:i+qry_in_threshold]
+
         dataset_rs = DBSession.query(Dataset.dataset_id,
                 Dataset.data_type,
                 Dataset.data_units,
                 Dataset.data_dimen,
                 Dataset.data_name,
+                Dataset.data_hash,
                 Dataset.hidden,
                 Dataset.cr_date,
                 Dataset.created_by,
                 DatasetOwner.user_id,
                 null().label('metadata'),
-                case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
+                case([(is_forbidden, None)],
                         else_=Dataset.start_time).label('start_time'),
-                case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
+                case([(is_forbidden, None)],
                         else_=Dataset.frequency).label('frequency'),
-                case([(and_(Dataset.hidden=='Y', DatasetOwner.user_id is not None), None)],
+                case([(is_forbidden, None)],
                         else_=Dataset.value).label('value')).filter(
-                Dataset.dataset_id.in_(dataset_ids)).outerjoin(DatasetOwner,
+                Dataset.dataset_id.in_(id_chunk)).outerjoin(DatasetOwner,
                                     and_(DatasetOwner.dataset_id==Dataset.dataset_id,
                                     DatasetOwner.user_id==user_id)).all()
 
+        metadata_dict = {}
+        visible_ids = [d.dataset_id for d in dataset_rs
+                       if d.hidden == 'N' or d.user_id is not None]
+        if len(visible_ids) > 0:
+            for m in DBSession.query(Metadata).filter(Metadata.dataset_id.in_(visible_ids)).all():
+                metadata_dict.setdefault(m.dataset_id, []).append(m)
+
         #convert the value row into a string as it is returned as a binary
         for dataset_row in dataset_rs:
             dataset_dict = dataset_row._asdict()
@@ -196,18 +219,10 @@ def get_datasets(dataset_ids,**kwargs):
             if dataset_row.value is not None:
                 dataset_dict['value'] = str(dataset_row.value)
 
-            if dataset_row.hidden == 'N' or (dataset_row.hidden == 'Y' and dataset_row.user_id is not None):
-                metadata = DBSession.query(Metadata).filter(Metadata.dataset_id == dataset_row.dataset_id).all()
-                dataset_dict['metadata'] = metadata
-            else:
-                dataset_dict['metadata'] = []
+            dataset_dict['metadata'] = metadata_dict.get(dataset_row.dataset_id, [])
 
             datasets.append(namedtuple('Dataset', dataset_dict.keys())(**dataset_dict))
 
-            
-    except NoResultFound:
-        raise ResourceNotFoundError("Datasets not found.")
-
     return datasets
 
 
@@ -491,6 +506,9 @@ def update_dataset(dataset_id, name, data_type, val, units, dimension, metadata=
             DBSession.delete(dataset)
             dataset = existing_dataset
 
+    #The dataset may be used in any number of networks.
+    network_cache.invalidate_all()
+
     return dataset
 
 
@@ -568,86 +586,230 @@ def _bulk_insert_data(bulk_data, user_id=None, source=None):
     new_data = _process_incoming_data(bulk_data, user_id, source)
     log.info("Incoming data processed in %s", (get_timing(start_time)))
 
-    existing_data = _get_existing_data(new_data.keys())
+    return _insert_processed_data(bulk_data, new_data, user_id)
+
+def _insert_processed_data(bulk_data, new_data, user_id=None):
+    """
+        Insert datasets which have already been through _process_incoming_data,
+        which returned new_data. Returns a Dataset for each of bulk_data,
+        or None for those whose value could not be parsed.
+    """
+    get_timing = lambda x: datetime.datetime.now() - x
+    start_time=datetime.datetime.now()
+
+    existing_data = _get_existing_data(new_data.keys(), user_id)
 
     log.info("Existing data retrieved.")
 
-    #The list of dataset IDS to be returned.
+    #The datasets to be returned, keyed on hash.
     hash_id_map = {}
-    new_datasets = []
+    #The datasets to be inserted, keyed on hash so that each is only inserted once.
+    new_datasets = OrderedDict()
     metadata         = {}
-    #This is what gets returned.
+    #Incoming datasets which the user is not allowed to use, mapped to
+    #the hash of the copy which is made for them.
+    replaced_hashes = {}
     for d in bulk_data:
-        dataset_dict = new_data[d.data_hash]
-        current_hash = d.data_hash
+        current_hash = getattr(d, 'data_hash', None)
+
+        if current_hash in hash_id_map or current_hash in new_datasets\
+           or current_hash in replaced_hashes or current_hash not in new_data:
+            continue
+
+        dataset_dict = new_data[current_hash]
 
         #if this piece of data is already in the DB, then
         #there is no need to insert it!
-        if  existing_data.get(current_hash) is not None:
-
-            dataset = existing_data.get(current_hash)
+        if current_hash in existing_data:
+            dataset, can_read = existing_data[current_hash]
             #Is this user allowed to use this dataset?
-            if dataset.check_user(user_id) == False:
+            if can_read is False:
                 new_dataset = _make_new_dataset(dataset_dict)
-                new_datasets.append(new_dataset)
+                new_datasets[new_dataset['data_hash']] = new_dataset
                 metadata[new_dataset['data_hash']] = dataset_dict['metadata']
+                replaced_hashes[current_hash] = new_dataset['data_hash']
             else:
-                hash_id_map[current_hash] = dataset#existing_data[current_hash]
-        elif current_hash in hash_id_map:
-            new_datasets.append(dataset_dict)
+                hash_id_map[current_hash] = dataset
         else:
-            #set a placeholder for a dataset_id we don't know yet.
-            #The placeholder is the hash, which is unique to this object and
-            #therefore easily identifiable.
-            new_datasets.append(dataset_dict)
-            hash_id_map[current_hash] = dataset_dict
+            new_datasets[current_hash] = dataset_dict
             metadata[current_hash] = dataset_dict['metadata']
 
     log.debug("Isolating new data %s", get_timing(start_time))
-    #Isolate only the new datasets and insert them
-    new_data_for_insert = []
-    #keep track of the datasets that are to be inserted to avoid duplicate
-    #inserts
-    new_data_hashes = []
-    for d in new_datasets:
-        if d['data_hash'] not in new_data_hashes:
-            new_data_for_insert.append(d)
-            new_data_hashes.append(d['data_hash'])
-
-    if len(new_data_for_insert) > 0:
-    	#If we're working with mysql, we have to lock the table..
-    	#For sqlite, this is not possible. Hence the try: except
-        try:
-            DBSession.execute("LOCK TABLES tDataset WRITE, tMetadata WRITE")
-        except OperationalError:
-            pass
 
-        log.debug("Inserting new data", get_timing(start_time))
-        DBSession.execute(Dataset.__table__.insert(), new_data_for_insert)
-        log.debug("New data Inserted", get_timing(start_time))
+    while len(new_datasets) > 0:
+        log.debug("Inserting new data %s", get_timing(start_time))
+        inserted_data, concurrent_data = _insert_datasets(new_datasets.values(), user_id)
+        log.debug("New data Inserted %s", get_timing(start_time))
+
+        hash_id_map.update(inserted_data)
+
+        _insert_metadata(dict((h, metadata[h]) for h in inserted_data), hash_id_map)
+        log.debug("Metadata inserted %s", get_timing(start_time))
+
+        #Data which another request inserted at the same time is used
+        #in the same way as data which was already in the DB.
+        retry_datasets = OrderedDict()
+        for data_hash, (dataset, can_read) in concurrent_data.items():
+            if can_read is False:
+                new_dataset = _make_new_dataset(new_datasets[data_hash])
+                retry_datasets[new_dataset['data_hash']] = new_dataset
+                metadata[new_dataset['data_hash']] = metadata[data_hash]
+                replaced_hashes[data_hash] = new_dataset['data_hash']
+            else:
+                hash_id_map[data_hash] = dataset
+        new_datasets = retry_datasets
+
+    returned_ids = []
+    for d in bulk_data:
+        current_hash = getattr(d, 'data_hash', None)
+        returned_ids.append(hash_id_map.get(replaced_hashes.get(current_hash, current_hash)))
+
+    log.info("Done bulk inserting data. %s datasets", len(returned_ids))
+
+    return returned_ids
+
+def _begin_savepoint():
+    """
+        Start a savepoint, so that a failed statement can be rolled back
+        without aborting the rest of the transaction. Returns None for
+        sqlite, where pysqlite's own transaction handling prevents the
+        use of savepoints. A failed statement in sqlite only undoes that
+        statement, so none is needed there.
+    """
+    if engine.dialect.name == 'sqlite':
+        return None
+    return DBSession.begin_nested()
+
+def _insert_datasets(dataset_dicts, user_id=None):
+    """
+        Insert new datasets without locking the dataset table.
+        Returns a dictionary of the inserted Dataset objects, keyed on hash,
+        and a dictionary of (dataset, can_read) for the datasets which
+        another request inserted at the same time, as _get_existing_data does.
+
+        If another request inserts some of the same data at the same time,
+        the insert fails on the unique data_hash. Each attempt is made in
+        a savepoint, so that the failure does not abort the transaction.
+        The datasets which now exist are found with a locking read, which
+        sees rows committed since this transaction started, and the
+        rest are inserted again.
+    """
+    hash_id_map = {}
+    concurrent_data = {}
+    to_insert = [dict((k, v) for k, v in d.items() if k != 'metadata')
+                 for d in dataset_dicts]
 
+    for attempt in range(3):
+        savepoint = _begin_savepoint()
         try:
-            DBSession.execute("UNLOCK TABLES")
-        except OperationalError:
-            pass
+            id_rows = _execute_dataset_insert(to_insert)
+            if savepoint is not None:
+                savepoint.commit()
+            break
+        except IntegrityError, e:
+            if savepoint is not None:
+                savepoint.rollback()
+
+            if attempt == 2:
+                raise HydraError("Unable to insert data: %s"%(e,))
+
+            log.info("Data was inserted by another request. Checking for existing data.")
+            existing_data = _get_existing_data([d['data_hash'] for d in to_insert],
+                                               user_id, lock=True)
+            concurrent_data.update(existing_data)
+            to_insert = [d for d in to_insert if d['data_hash'] not in existing_data]
+            if len(to_insert) == 0:
+                return hash_id_map, concurrent_data
+
+    #Make ORM objects for the new rows from the data which was inserted,
+    #rather than loading the rows (including their values) back from the DB.
+    insert_dicts = dict((d['data_hash'], d) for d in to_insert)
+    for row in id_rows:
+        dataset = Dataset(**insert_dicts[row.data_hash])
+        dataset.dataset_id = row.dataset_id
+        dataset.cr_date    = row.cr_date
+        dataset.hidden     = 'N'
+        make_transient_to_detached(dataset)
+        DBSession.add(dataset)
+        hash_id_map[row.data_hash] = dataset
+
+    return hash_id_map, concurrent_data
+
+def _update_datasets(dataset_dicts):
+    """
+        Replace the values and metadata of existing datasets in bulk.
+        dataset_dicts is a dictionary of dataset_id -> dataset dictionary,
+        as made by _process_incoming_data. The new hashes must not
+        already be in use.
+    """
+    if len(dataset_dicts) == 0:
+        return
 
+    dataset_table = Dataset.__table__
+    columns = ('data_type', 'data_name', 'data_units', 'data_dimen',
+               'value', 'data_hash', 'created_by', 'frequency', 'start_time')
 
-        new_data = _get_existing_data(new_data_hashes)
-        log.debug("New data retrieved", get_timing(start_time))
+    update = dataset_table.update().where(
+        dataset_table.c.dataset_id==bindparam('b_dataset_id')).values(
+            **dict((c, bindparam('b_%s'%c)) for c in columns))
 
-        for k, v in new_data.items():
-            hash_id_map[k] = v
+    update_params = []
+    for dataset_id, dataset_dict in dataset_dicts.items():
+        params = dict(('b_%s'%c, dataset_dict[c]) for c in columns)
+        params['b_dataset_id'] = dataset_id
+        update_params.append(params)
+    DBSession.execute(update, update_params)
 
-        _insert_metadata(metadata, hash_id_map)
-        log.debug("Metadata inserted", get_timing(start_time))
+    dataset_ids = dataset_dicts.keys()
+    for i in range(0, len(dataset_ids), qry_in_threshold):
+        DBSession.execute(Metadata.__table__.delete().where(
+            Metadata.__table__.c.dataset_id.in_(dataset_ids[i:i+qry_in_threshold])))
 
-    returned_ids = []
-    for d in bulk_data:
-        returned_ids.append(hash_id_map[d.data_hash])
+    metadata_list = []
+    for dataset_id, dataset_dict in dataset_dicts.items():
+        for k, v in dataset_dict['metadata'].items():
+            metadata_list.append(dict(metadata_name=k, metadata_val=v, dataset_id=dataset_id))
+    if len(metadata_list) > 0:
+        DBSession.execute(Metadata.__table__.insert(), metadata_list)
 
-    log.info("Done bulk inserting data. %s datasets", len(returned_ids))
+    #The datasets may be used in any number of networks.
+    network_cache.invalidate_all()
 
-    return returned_ids
+def _execute_dataset_insert(dataset_dicts):
+    """
+        Insert the datasets and return (dataset_id, data_hash, cr_date) for each.
+        Where the database can return the generated IDs from the insert
+        (postgresql) it does so. Otherwise they are retrieved with one
+        query, joining the hashes in tTmpDataHash with tDataset, which
+        returns only those columns.
+    """
+    id_cols = (Dataset.dataset_id, Dataset.data_hash, Dataset.cr_date)
+
+    if engine.dialect.name == 'postgresql':
+        id_rows = []
+        for i in range(0, len(dataset_dicts), qry_in_threshold):
+            chunk = dataset_dicts[i:i+qry_in_threshold]
+            id_rows.extend(DBSession.execute(
+                Dataset.__table__.insert().values(chunk).returning(*id_cols)).fetchall())
+        return id_rows
+
+    DBSession.execute(Dataset.__table__.insert(), dataset_dicts)
+
+    _fill_hash_table([d['data_hash'] for d in dataset_dicts])
+    id_rows = DBSession.query(*id_cols).select_from(Dataset).join(tmp_hash_table,
+                        tmp_hash_table.c.data_hash==Dataset.data_hash).all()
+    DBSession.execute(tmp_hash_table.delete())
+
+    return id_rows
+
+def _fill_hash_table(hashes):
+    """
+        Replace the contents of the temporary tTmpDataHash table
+        with the given hashes, so that they can be joined with tDataset.
+    """
+    DBSession.execute(tmp_hash_table.delete())
+    DBSession.execute(tmp_hash_table.insert(),
+                      [dict(data_hash=h) for h in set(hashes)])
 
 def _insert_metadata(metadata_hash_dict, dataset_id_hash_dict):
     if metadata_hash_dict is None or len(metadata_hash_dict) == 0:
@@ -750,32 +912,45 @@ def _get_metadata(dataset_ids):
 
     return metadata
 
-def _get_existing_data(hashes):
-
-    str_hashes = [str(h) for h in hashes]
+def _get_existing_data(hashes, user_id=None, lock=False):
+    """
+        Get the datasets with the given hashes, as a dictionary
+        of (dataset, can_read) keyed on hash, where can_read indicates whether
+        the user is allowed to use the dataset. The permission is checked in the
+        same query, rather than loading the owners of each dataset.
+
+        Only the ID, hash and hidden flag of each dataset are loaded, so
+        the values are not read just to find out which data exists. The other
+        columns are loaded if they are used. The hashes are joined with tDataset
+        through the temporary tTmpDataHash table, in a single query.
+
+        lock: Use a locking read (FOR SHARE), which sees datasets committed
+              by other requests since this transaction started, even where
+              plain reads use the transaction's snapshot (mysql).
+    """
+    if len(hashes) == 0:
+        return {}
 
-    hash_dict = {}
+    _fill_hash_table(hashes)
 
-    datasets = []
-    if len(str_hashes) > qry_in_threshold:
-        idx = 0
-        extent =qry_in_threshold
-        while idx < len(str_hashes):
-            log.info("Querying %s datasets", len(str_hashes[idx:extent]))
-            rs = DBSession.query(Dataset).filter(Dataset.data_hash.in_(str_hashes[idx:extent])).all()
-            datasets.extend(rs)
-            idx = idx + qry_in_threshold
+    can_read = case([(or_(Dataset.hidden == 'N', DatasetOwner.user_id != None), True)],
+                    else_=False).label('can_read')
 
-            if idx + qry_in_threshold > len(str_hashes):
-                extent = len(str_hashes)
-            else:
-                extent = extent + qry_in_threshold
-    else:
-        datasets = DBSession.query(Dataset).filter(Dataset.data_hash.in_(str_hashes))
+    log.info("Querying %s datasets", len(hashes))
+    qry = DBSession.query(Dataset, can_read).options(
+                    load_only('dataset_id', 'data_hash', 'hidden')).join(tmp_hash_table,
+                    tmp_hash_table.c.data_hash==Dataset.data_hash).outerjoin(DatasetOwner,
+                    and_(DatasetOwner.dataset_id==Dataset.dataset_id,
+                         DatasetOwner.user_id==user_id,
+                         DatasetOwner.view=='Y'))
+    if lock is True:
+        qry = qry.with_for_update(read=True, of=Dataset)
 
+    hash_dict = {}
+    for dataset, readable in qry.all():
+        hash_dict[dataset.data_hash] = (dataset, bool(readable))
 
-    for r in datasets:
-        hash_dict[r.data_hash] = r
+    DBSession.execute(tmp_hash_table.delete())
 
     log.info("Retrieved %s datasets", len(hash_dict))
 
@@ -993,6 +1168,57 @@ def get_val_at_time(dataset_id, timestamps,**kwargs):
 
     return dataset
 
+def _get_timeseries(dataset_ids):
+    """
+        Get the timeseries among a list of datasets, as dataframes with
+        sorted indices, using the value cache where possible.
+        Returns a dictionary of dataset_id -> dataframe.
+    """
+    hashes = {}
+    for idx in range(0, len(dataset_ids), qry_in_threshold):
+        rs = DBSession.query(Dataset.dataset_id, Dataset.data_hash).filter(
+                    Dataset.dataset_id.in_(dataset_ids[idx:idx+qry_in_threshold]),
+                    Dataset.data_type=='timeseries').all()
+        for d in rs:
+            hashes[d.dataset_id] = d.data_hash
+
+    timeseries = {}
+    missing = []
+    for dataset_id, data_hash in hashes.items():
+        ts = value_cache.get(dataset_id, data_hash)
+        if ts is None:
+            missing.append(dataset_id)
+        else:
+            timeseries[dataset_id] = ts
+
+    log.debug("%s timeseries found in cache. Parsing %s.", len(timeseries), len(missing))
+
+    for idx in range(0, len(missing), qry_in_threshold):
+        rs = DBSession.query(Dataset.dataset_id, Dataset.data_hash, Dataset.value).filter(
+                    Dataset.dataset_id.in_(missing[idx:idx+qry_in_threshold])).all()
+        for d in rs:
+            try:
+                ts = decode_value('timeseries', d.value)
+            except Exception, e:
+                log.critical("Unable to parse timeseries %s: %s", d.dataset_id, e)
+                continue
+            value_cache.set(d.dataset_id, d.data_hash, ts)
+            timeseries[d.dataset_id] = ts
+
+    #Relative timeseries can't be queried by time.
+    for dataset_id, ts in timeseries.items():
+        if type(ts.index) != pd.DatetimeIndex:
+            del(timeseries[dataset_id])
+
+    return timeseries
+
+def get_value_cache_stats(**kwargs):
+    """
+        Get the number of entries in the cache of decoded dataset values,
+        the memory they use (in bytes) and the numbers of hits, misses and evictions.
+    """
+    return value_cache.stats()
+
 def get_multiple_vals_at_time(dataset_ids, timestamps,**kwargs):
     """
     Given a timestamp (or list of timestamps) and a list of timeseries datasets,
@@ -1002,23 +1228,115 @@ def get_multiple_vals_at_time(dataset_ids, timestamps,**kwargs):
     None If the timestamp is after the end of the timeseries data, return
     the last value.  """
 
-    datasets = _get_datasets(dataset_ids)
-    datetimes = []
-    for time in timestamps:
-        datetimes.append(get_datetime(time))
+    datetimes = pd.DatetimeIndex([get_datetime(t) for t in timestamps])
+
+    timeseries = _get_timeseries(dataset_ids)
 
     return_vals = {}
-    for dataset_i in datasets.values():
-        data = dataset_i.get_val(timestamp=datetimes)
+    for dataset_id in dataset_ids:
         ret_data = {}
-        if type(data) is list:
-            for i, t in enumerate(timestamps):
-                ret_data[t] = data[i]
-        return_vals['dataset_%s'%dataset_i.dataset_id] = json.dumps(ret_data)
+        ts = timeseries.get(dataset_id)
+        if ts is not None and len(ts) > 0:
+            positions = get_timeseries_positions(ts, datetimes)
+
+            vals = ts.values.take(numpy.maximum(positions, 0), axis=0).astype(object)
+            missing = pd.isnull(vals)
+            missing[positions < 0] = True
+
+            if not missing.all():
+                vals[missing] = None
+                if vals.shape[1] == 1:
+                    vals = vals[:, 0]
+                for i, t in enumerate(timestamps):
+                    ret_data[t] = vals[i].tolist() if vals.ndim > 1 else vals[i]
+
+        return_vals['dataset_%s'%dataset_id] = json.dumps(ret_data)
 
     return return_vals
 
-def get_vals_between_times(dataset_id, start_time, end_time, timestep,increment,**kwargs):
+def get_vals_at_time_matrix(dataset_ids, timestamps,**kwargs):
+    """
+        Get the values of a list of timeseries datasets at a list of times,
+        as a float64 (dataset x timestamp) numpy array. Values are found in
+        the same way as get_multiple_vals_at_time. Times before the start of
+        a timeseries are NaN, as are the rows of datasets which are not
+        timeseries with a single numeric column.
+    """
+    datetimes = pd.DatetimeIndex([get_datetime(t) for t in timestamps])
+
+    timeseries = _get_timeseries(dataset_ids)
+
+    matrix = numpy.empty((len(dataset_ids), len(datetimes)), dtype=numpy.float64)
+    matrix.fill(numpy.nan)
+
+    for i, dataset_id in enumerate(dataset_ids):
+        ts = timeseries.get(dataset_id)
+        if ts is None or len(ts) == 0 or len(ts.columns) != 1 \
+           or ts.dtypes[0].kind not in ('i', 'f'):
+            continue
+
+        positions = get_timeseries_positions(ts, datetimes)
+        in_range = positions >= 0
+        matrix[i, in_range] = ts.iloc[:, 0].values[positions[in_range]]
+
+    return matrix
+
+def _get_time_axis(start_time, end_time, timestep, increment):
+    """
+        Make the list of times from start_time up to end_time, in steps of
+        'increment' 'timestep's (minutes, hours, months etc). As with
+        PluginLib's get_time_axis, the last time is the first one at or after
+        end_time, and steps of months or years are added one after the other
+        (so starting on the 31st of January gives the 28th of February,
+        then the 28th of March).
+
+        If the times are numbers rather than dates, timestep is ignored and
+        a numpy array of numbers is returned. Otherwise a DatetimeIndex is returned.
+    """
+    try:
+        server_start_time = get_datetime(start_time)
+        server_end_time   = get_datetime(end_time)
+    except ValueError:
+        try:
+            server_start_time = float(start_time)
+            server_end_time   = float(end_time)
+            increment         = float(increment)
+        except:
+            raise HydraError("Unable to get times. Please check to and from times.")
+
+        if increment <= 0:
+            raise HydraError("%s is not a valid increment for this search."%increment)
+
+        num_steps = max(0, int(math.ceil(round((server_end_time - server_start_time) / increment, 9))))
+        return server_start_time + numpy.arange(num_steps + 1) * increment
+
+    increment = int(increment)
+    if increment <= 0:
+        raise HydraError("%s is not a valid increment for this search."%increment)
+
+    if server_end_time <= server_start_time:
+        return pd.DatetimeIndex([server_start_time])
+
+    if timestep in ('months', 'years'):
+        offset = pd.DateOffset(**{timestep:increment})
+        times = pd.date_range(server_start_time, server_end_time, freq=offset)
+        if times[-1] < server_end_time:
+            times = times.append(pd.DatetimeIndex([times[-1] + offset]))
+        return times
+
+    try:
+        step = datetime.timedelta(**{timestep:increment})
+    except TypeError:
+        raise HydraError("%s is not a valid timestep."%timestep)
+    step = ((step.days * 86400 + step.seconds) * 10**6 + step.microseconds) * 1000
+
+    start_ns = pd.Timestamp(server_start_time).value
+    end_ns   = pd.Timestamp(server_end_time).value
+    num_steps = -(-(end_ns - start_ns) // step)
+
+    return pd.DatetimeIndex(start_ns + numpy.arange(num_steps + 1, dtype=numpy.int64) * step)
+
+def get_vals_between_times(dataset_id, start_time, end_time, timestep, increment, binary='N', **kwargs):
     """
         Retrive data between two specified times within a timeseries. The times
         need not be specified in the timeseries. This function will 'fill in the blanks'.
@@ -1034,46 +1352,66 @@ def get_vals_between_times(dataset_id, start_time, end_time, timestep,increment,
         must be decimal values. timestep is ignored and 'increment' represents the increment
         to be used between the start and end.
         Ex: start_time = 1, end_time = 5, increment = 1 will get times at 1, 2, 3, 4, 5
+
+        If binary is 'Y', the data is returned as a base64 encoded float64
+        (time x column) numpy (.npy) array, with a row for every time, and NaN
+        for times before the start of the timeseries.
     """
-    try:
-        server_start_time = get_datetime(start_time)
-        server_end_time   = get_datetime(end_time)
-        times = [server_start_time]
-
-        next_time = server_start_time
-        while next_time < server_end_time:
-            if int(increment) == 0:
-                raise HydraError("%s is not a valid increment for this search."%increment)
-            next_time = next_time  + datetime.timedelta(**{timestep:int(increment)})
-            times.append(next_time)
-    except ValueError:
-        try:
-            server_start_time = Decimal(start_time)
-            server_end_time   = Decimal(end_time)
-            times = [server_start_time]
-
-            next_time = server_start_time
-            while next_time < server_end_time:
-                next_time = next_time + increment
-                times.append(next_time)
-        except:
-            raise HydraError("Unable to get times. Please check to and from times.")
+    times = _get_time_axis(start_time, end_time, timestep, increment)
 
     td = DBSession.query(Dataset).filter(Dataset.dataset_id==dataset_id).one()
     log.debug("Number of times to fetch: %s", len(times))
-    data = td.get_val(timestamp=times)
-
-    data_to_return = []
-    if type(data) is list:
-        for d in data:
-            if d is not None:
-                data_to_return.append(list(d))
-    elif data is None:
-        data_to_return = []
+
+    if td.data_type != 'timeseries':
+        if binary == 'Y':
+            raise HydraError("Dataset %s is not a timeseries."%dataset_id)
+        return {'data' : json.dumps([td.get_val()])}
+
+    timeseries = get_decoded_value(td)
+
+    #Find the row of the timeseries which applies at each time.
+    #Dates can only be looked up in timestamp-based timeseries and
+    #numbers in relative ones.
+    if isinstance(times, pd.DatetimeIndex) == (type(timeseries.index) == pd.DatetimeIndex) \
+       and len(timeseries) > 0:
+        if isinstance(times, pd.DatetimeIndex):
+            positions = get_timeseries_positions(timeseries, times)
+        else:
+            positions = timeseries.index.values.searchsorted(times, side='right') - 1
+    else:
+        positions = numpy.empty(len(times), dtype=numpy.int64)
+        positions.fill(-1)
+
+    if binary == 'Y':
+        for dtype in timeseries.dtypes:
+            if dtype.kind not in ('i', 'f'):
+                raise HydraError("Only numeric timeseries can be returned in binary.")
+        values = numpy.empty((len(times), len(timeseries.columns)), dtype=numpy.float64)
+        values.fill(numpy.nan)
+        in_range = positions >= 0
+        values[in_range] = timeseries.values[positions[in_range]]
+
+        buf = StringIO()
+        numpy.save(buf, values)
+        return {'data' : base64.b64encode(buf.getvalue())}
+
+    #The positions only increase, so the rows needed are a
+    #slice of the timeseries, starting at the first time.
+    positions = positions[positions >= 0]
+    if len(positions) == 0:
+        return {'data' : json.dumps([])}
+
+    first = positions[0]
+    values = timeseries.values[first:positions[-1]+1].take(positions - first, axis=0)
+
+    if values.shape[1] == 1:
+        values = values[:, 0]
+        values = values[~pd.isnull(values)]
     else:
-        data_to_return.append(data)
+        values = values.astype(object)
+        values[pd.isnull(values)] = None
 
-    dataset = {'data' : json.dumps(data_to_return)}
+    dataset = {'data' : json.dumps(values.tolist())}
 
     return dataset
 
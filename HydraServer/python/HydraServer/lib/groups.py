@@ -17,6 +17,7 @@ from HydraLib.HydraException import HydraError, ResourceNotFoundError
 import scenario
 
 from HydraServer.db import DBSession
+from HydraServer.util.cache import network_cache
 from HydraServer.db.model import ResourceGroup, ResourceGroupItem, Node, Link
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -46,6 +47,7 @@ def add_resourcegroup(group, network_id,**kwargs):
     group_i.status            = group.status
     group_i.network_id        = network_id
     DBSession.add(group_i)
+    network_cache.invalidate(network_id)
     DBSession.flush()
     return group_i
 
@@ -56,6 +58,7 @@ def delete_resourcegroup(group_id,**kwargs):
     group_i = _get_group(group_id)
     #This should cascaded to delete all the group items.
     DBSession.delete(group_i)
+    network_cache.invalidate_all()
 
     return 'OK'
 
@@ -69,6 +72,7 @@ def update_resourcegroup(group,**kwargs):
     group_i.group_description = group.description
     group_i.status            = group.status
     
+    network_cache.invalidate_all()
     DBSession.flush()
 
     return group_i
@@ -111,6 +115,7 @@ def add_resourcegroupitem(group_item, scenario_id,**kwargs):
         
 
     DBSession.add(group_item_i)
+    scenario._invalidate_network_cache(scenario_id)
     DBSession.flush()
 
     return group_item_i
@@ -118,6 +123,7 @@ def add_resourcegroupitem(group_item, scenario_id,**kwargs):
 def delete_resourcegroupitem(item_id,**kwargs):
     group_item_i = _get_item(item_id) 
     scenario._check_can_edit_scenario(group_item_i.scenario_id, kwargs['user_id'])
+    scenario._invalidate_network_cache(group_item_i.scenario_id)
     DBSession.delete(group_item_i)
     DBSession.flush()
    
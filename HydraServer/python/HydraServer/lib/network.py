@@ -15,6 +15,7 @@
 #
 import logging
 from HydraLib.HydraException import HydraError, ResourceNotFoundError
+from HydraLib import config
 import scenario
 import datetime
 import data
@@ -27,18 +28,18 @@ from HydraServer.db.model import Project, Network, Scenario, Node, Link, Resourc
         ResourceScenario, TemplateType, TypeAttr, Template
 from sqlalchemy.orm import noload, joinedload, joinedload_all
 from HydraServer.db import DBSession
-from sqlalchemy import func, and_, or_, distinct
+from sqlalchemy import func, and_, or_
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.orm import aliased
 from HydraLib.hydra_dateutil import timestamp_to_ordinal
 from HydraServer.util.hdb import add_attributes, add_resource_types
+from HydraServer.util.cache import network_cache
 
-from sqlalchemy import case
+from sqlalchemy import case, literal, Integer
 from sqlalchemy.sql import null
 
 from collections import namedtuple
 
-import zlib
 
 log = logging.getLogger(__name__)
 
@@ -58,6 +59,100 @@ class dictobj(dict):
     def __setattr__(self, name, value):
         self[name] = value
 
+class _Record(object):
+    """
+        Base class for the compact objects used to assemble large networks.
+        Unlike dictobj, which is a dictionary per object, a record only stores
+        its values in the slots defined by its class. As with dictobj,
+        a field which has not been set is None.
+    """
+    __slots__ = ()
+
+    def __init__(self, *args, **kwargs):
+        for name, value in zip(self.__slots__, args):
+            setattr(self, name, value)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def from_row(cls, row, **extras):
+        """
+            Create a record from a database row (or anything else
+            which supports row[field_name]), ignoring any fields
+            not used by the record.
+        """
+        record = cls(*[row[name] for name in cls._row_fields])
+        for name, value in extras.items():
+            setattr(record, name, value)
+        return record
+
+    def __getattr__(self, name):
+        if name in self.__slots__:
+            return None
+        raise AttributeError(name)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def __setitem__(self, name, value):
+        setattr(self, name, value)
+
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(name, getattr(self, name)) for name in self.__slots__]
+
+    def __getstate__(self):
+        return self.items()
+
+    def __setstate__(self, state):
+        for name, value in state:
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return "%s(%s)"%(self.__class__.__name__,
+                         ", ".join(["%s=%r"%(k, v) for k, v in self.items()]))
+
+def _record_class(name, row_fields, extra_fields=()):
+    """
+        Define a record class with a slot for each of the row fields
+        (set by from_row) and each of the extra fields (set afterwards).
+    """
+    return type(name, (_Record,), {
+        '__slots__'   : tuple(row_fields) + tuple(extra_fields),
+        '_row_fields' : tuple(row_fields),
+    })
+
+NodeRecord  = _record_class('NodeRecord',  Node.__table__.columns.keys(),
+                            ('types', 'attributes'))
+LinkRecord  = _record_class('LinkRecord',  Link.__table__.columns.keys(),
+                            ('types', 'attributes'))
+GroupRecord = _record_class('GroupRecord', ResourceGroup.__table__.columns.keys(),
+                            ('types', 'attributes'))
+
+ResourceScenarioRecord = _record_class('ResourceScenarioRecord',
+                            ('resource_attr_id', 'scenario_id', 'dataset_id',
+                             'source', 'cr_date', 'attr_id'),
+                            ('resourceattr', 'dataset'))
+ResourceAttrRecord     = _record_class('ResourceAttrRecord', ('attr_id',))
+DatasetRecord          = _record_class('DatasetRecord',
+                            ('dataset_id', 'data_type', 'data_units', 'data_dimen',
+                             'data_name', 'data_hash', 'cr_date', 'created_by',
+                             'hidden', 'start_time', 'frequency', 'value'),
+                            ('metadata',))
+
+ResourceTypeRecord = _record_class('ResourceTypeRecord', ('type_id',), ('templatetype',))
+TemplateTypeRecord = _record_class('TemplateTypeRecord',
+                            ('type_id', 'type_name', 'layout', 'template_id',
+                             'template_name'),
+                            ('template',))
+TemplateRecord     = _record_class('TemplateRecord', ('template_name',))
+
 def _update_attributes(resource_i, attributes):
     if attributes is None:
         return dict()
@@ -617,6 +712,16 @@ def _get_all_resource_attributes(network_id, template_id=None):
     logging.info("Attributes processed in %s", time.time()-x)
     return all_attributes
 
+def _make_resourcetype(t):
+    """
+        Turn a row from a type query into a resource type object, with
+        its template type and template attached.
+    """
+    templatetype = TemplateTypeRecord.from_row(t,
+                                template=TemplateRecord(t.template_name))
+
+    return ResourceTypeRecord(t.type_id, templatetype)
+
 def _get_all_templates(network_id, template_id):
     """
         Get all the templates for the nodes, links and groups of a network.
@@ -671,10 +776,7 @@ def _get_all_templates(network_id, template_id):
 
     for t in all_types:
 
-        resourcetype = dictobj({'type_id':t.type_id})
-        resourcetype.templatetype = dictobj(t)
-        rttemplate = dictobj({'template_name':t.template_name})
-        resourcetype.templatetype.template =rttemplate 
+        resourcetype = _make_resourcetype(t)
 
         if t.ref_key == 'NODE':
             nodetype = node_type_dict.get(t.node_id, [])
@@ -705,15 +807,50 @@ def _get_all_templates(network_id, template_id):
     return all_types
 
 
-def _get_all_group_items(network_id):
+def _get_template_resource_attr_qry(network_id, template_id):
+    """
+        Get a query returning the IDS of all the resource attributes in a
+        network which are defined by a type in the specified template.
+        This is used to filter the data queries so that only data
+        relevant to the template is retrieved.
+    """
+    base_qry = DBSession.query(ResourceAttr.resource_attr_id.label('resource_attr_id')).filter(
+                                TemplateType.type_id==ResourceType.type_id,
+                                TemplateType.template_id==template_id,
+                                TypeAttr.type_id==TemplateType.type_id,
+                                TypeAttr.attr_id==ResourceAttr.attr_id)
+
+    node_qry = base_qry.filter(Node.node_id==ResourceAttr.node_id,
+                               Node.network_id==network_id,
+                               ResourceType.node_id==ResourceAttr.node_id)
+
+    link_qry = base_qry.filter(Link.link_id==ResourceAttr.link_id,
+                               Link.network_id==network_id,
+                               ResourceType.link_id==ResourceAttr.link_id)
+
+    group_qry = base_qry.filter(ResourceGroup.group_id==ResourceAttr.group_id,
+                                ResourceGroup.network_id==network_id,
+                                ResourceType.group_id==ResourceAttr.group_id)
+
+    network_qry = base_qry.filter(ResourceAttr.network_id==network_id,
+                                  ResourceType.network_id==ResourceAttr.network_id)
+
+    return node_qry.union(link_qry, group_qry, network_qry)
+
+def _get_all_group_items(network_id, scenario_ids=None):
     """
         Get all the resource group items in the network, across all scenarios
         returns a dictionary of dict objects, keyed on scenario_id
+        If scenario_ids is specified, only the items in those scenarios are
+        retrieved.
     """
     base_qry = DBSession.query(ResourceGroupItem) 
 
     item_qry = base_qry.join(Scenario).filter(Scenario.network_id==network_id)
 
+    if scenario_ids:
+        item_qry = item_qry.filter(ResourceGroupItem.scenario_id.in_(scenario_ids))
+
     x = time.time()
     logging.info("Getting all items")
     all_items = DBSession.execute(item_qry.statement).fetchall()
@@ -733,11 +870,17 @@ def _get_all_group_items(network_id):
 
     return item_dict
 
-def _get_all_resourcescenarios(network_id, user_id):
+def _get_resourcescenario_qry(network_id, user_id, scenario_ids=None, template_id=None, include_hidden=False, include_values=True):
     """
-        Get all the resource scenarios in a network, across all scenarios
-        returns a dictionary of dict objects, keyed on scenario_id
-    """ 
+        Build the query used to retrieve all the resource scenarios in a network.
+        Hidden datasets which the user does not own are excluded, unless
+        include_hidden is True.
+        If include_values is False, the dataset values are not retrieved.
+    """
+    if include_values is True:
+        value_col = Dataset.value
+    else:
+        value_col = null().label('value')
 
     rs_qry = DBSession.query(
                 Dataset.data_type,
@@ -750,19 +893,74 @@ def _get_all_resourcescenarios(network_id, user_id):
                 Dataset.hidden,
                 Dataset.start_time,
                 Dataset.frequency,
-                Dataset.value,
+                value_col,
                 ResourceScenario.dataset_id,
                 ResourceScenario.scenario_id,
                 ResourceScenario.resource_attr_id,
                 ResourceScenario.source,
                 ResourceAttr.attr_id,
-    ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id, DatasetOwner.user_id==user_id)).filter(
-                or_(Dataset.hidden=='N', DatasetOwner.user_id != None),
+    ).filter(
                 ResourceAttr.resource_attr_id == ResourceScenario.resource_attr_id,
                 Scenario.scenario_id==ResourceScenario.scenario_id,
                 Scenario.network_id==network_id,
                 Dataset.dataset_id==ResourceScenario.dataset_id)
 
+    if include_hidden is False:
+        rs_qry = rs_qry.outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id, DatasetOwner.user_id==user_id)).filter(
+                or_(Dataset.hidden=='N', DatasetOwner.user_id != None))
+
+    if scenario_ids:
+        rs_qry = rs_qry.filter(ResourceScenario.scenario_id.in_(scenario_ids))
+
+    if template_id is not None:
+        template_ra_qry = _get_template_resource_attr_qry(network_id, template_id)
+        rs_qry = rs_qry.filter(ResourceScenario.resource_attr_id.in_(template_ra_qry.statement))
+
+    return rs_qry
+
+def _make_resourcescenario(rs):
+    """
+        Turn a row from the resource scenario query into a resource scenario
+        object, with its dataset and resource attribute attached.
+        The dataset value is left compressed. It is only decompressed
+        when it is sent to the client.
+    """
+    rs_dataset = DatasetRecord(
+        dataset_id = rs.dataset_id,
+        data_type  = rs.data_type,
+        data_units = rs.data_units,
+        data_dimen = rs.data_dimen,
+        data_name  = rs.data_name,
+        data_hash  = rs.data_hash,
+        cr_date    = rs.cr_date,
+        created_by = rs.created_by,
+        hidden     = rs.hidden,
+        start_time = rs.start_time,
+        frequency  = rs.frequency,
+        value      = rs.value,
+        metadata   = [],
+    )
+
+    rs_obj = ResourceScenarioRecord.from_row(rs,
+                                    resourceattr=ResourceAttrRecord(rs.attr_id),
+                                    dataset=rs_dataset)
+
+    return rs_obj
+
+def _get_all_resourcescenarios(network_id, user_id, scenario_ids=None, template_id=None, include_hidden=False, include_values=True):
+    """
+        Get all the resource scenarios in a network, across all scenarios
+        returns a dictionary of dict objects, keyed on scenario_id
+        If scenario_ids is specified, only the data in those scenarios is retrieved.
+        If template_id is specified, only the data on attributes defined
+        by that template is retrieved.
+        If include_hidden is True, hidden datasets are returned regardless
+        of whether the user can see them.
+        If include_values is False, the datasets are returned without their values.
+    """ 
+
+    rs_qry = _get_resourcescenario_qry(network_id, user_id, scenario_ids, template_id, include_hidden, include_values)
+
     x = time.time()
     logging.info("Getting all resource scenarios")
     all_rs = DBSession.execute(rs_qry.statement).fetchall()
@@ -773,32 +971,7 @@ def _get_all_resourcescenarios(network_id, user_id):
     x = time.time()
     rs_dict = dict() 
     for rs in all_rs:
-        rs_obj = dictobj(rs)
-        rs_attr = dictobj({'attr_id':rs.attr_id})
-
-        value = rs.value
-        try:
-            value = zlib.decompress(value)
-        except:
-            pass
-
-        rs_dataset = dictobj({
-            'dataset_id':rs.dataset_id,
-            'data_type' : rs.data_type,
-            'data_units':rs.data_units,
-            'data_dimen':rs.data_dimen,
-            'data_name':rs.data_name,
-            'data_hash':rs.data_hash,
-            'cr_date':rs.cr_date,
-            'created_by':rs.created_by,
-            'hidden':rs.hidden,
-            'start_date':rs.start_time,
-            'frequency':rs.frequency,
-            'value':value,
-            'metadata':[],
-        })
-        rs_obj.resourceattr = rs_attr
-        rs_obj.dataset = rs_dataset
+        rs_obj = _make_resourcescenario(rs)
 
         scenario_rs = rs_dict.get(rs.scenario_id, [])
         scenario_rs.append(rs_obj)
@@ -809,19 +982,33 @@ def _get_all_resourcescenarios(network_id, user_id):
     return rs_dict
 
 
-def _get_metadata(network_id, user_id):
+def _get_metadata(network_id, user_id, scenario_ids=None, template_id=None, include_hidden=False):
     """
         Get all the metadata in a network, across all scenarios
         returns a dictionary of dict objects, keyed on dataset ID 
+        scenario_ids, template_id and include_hidden filter the datasets
+        in the same way as in _get_all_resourcescenarios
     """
     
     dataset_qry = DBSession.query(
-                Dataset
-    ).outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id, DatasetOwner.user_id==user_id)).filter(
-                or_(Dataset.hidden=='N', DatasetOwner.user_id != None),
+                Dataset.dataset_id
+    ).filter(
                 Scenario.scenario_id==ResourceScenario.scenario_id,
                 Scenario.network_id==network_id,
-                Dataset.dataset_id==ResourceScenario.dataset_id).distinct().subquery()
+                Dataset.dataset_id==ResourceScenario.dataset_id)
+
+    if include_hidden is False:
+        dataset_qry = dataset_qry.outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id, DatasetOwner.user_id==user_id)).filter(
+                or_(Dataset.hidden=='N', DatasetOwner.user_id != None))
+
+    if scenario_ids:
+        dataset_qry = dataset_qry.filter(ResourceScenario.scenario_id.in_(scenario_ids))
+
+    if template_id is not None:
+        template_ra_qry = _get_template_resource_attr_qry(network_id, template_id)
+        dataset_qry = dataset_qry.filter(ResourceScenario.resource_attr_id.in_(template_ra_qry.statement))
+
+    dataset_qry = dataset_qry.distinct().subquery()
 
     rs_qry = DBSession.query(
                 Metadata
@@ -844,64 +1031,104 @@ def _get_metadata(network_id, user_id):
 
     return metadata_dict
 
-def _get_nodes(network_id, template_id=None):
+def _get_nodes_qry(network_id, template_id=None):
     """
-        Get all the nodes in a network
+        Build the query used to retrieve all the nodes in a network
     """
-    extras = {'types':[], 'attributes':[]}
-
     node_qry = DBSession.query(Node).filter(
                         Node.network_id==network_id,
                         Node.status=='A').options(noload('network'))
     if template_id is not None:
         node_qry = node_qry.filter(ResourceType.node_id==Node.node_id, TemplateType.type_id==ResourceType.type_id, TemplateType.template_id==template_id)
+
+    return node_qry
+
+def _get_nodes(network_id, template_id=None):
+    """
+        Get all the nodes in a network
+    """
+    node_qry = _get_nodes_qry(network_id, template_id)
     node_res = DBSession.execute(node_qry.statement).fetchall()
     
     nodes = []
     for n in node_res:
-        nodes.append(dictobj(n, extras))
+        nodes.append(NodeRecord.from_row(n, types=[], attributes=[]))
 
     return nodes
 
-def _get_links(network_id, template_id=None):
+def _get_links_qry(network_id, template_id=None):
     """
-        Get all the links in a network
+        Build the query used to retrieve all the links in a network
     """
-    extras = {'types':[], 'attributes':[]}
     link_qry = DBSession.query(Link).filter(
                                         Link.network_id==network_id,
                                         Link.status=='A').options(noload('network'))
     if template_id is not None:
         link_qry = link_qry.filter(ResourceType.link_id==Link.link_id, TemplateType.type_id==ResourceType.type_id, TemplateType.template_id==template_id)
 
+    return link_qry
+
+def _get_links(network_id, template_id=None):
+    """
+        Get all the links in a network
+    """
+    link_qry = _get_links_qry(network_id, template_id)
     link_res = DBSession.execute(link_qry.statement).fetchall()
 
     links = []
     for l in link_res:
-        links.append(dictobj(l, extras))
+        links.append(LinkRecord.from_row(l, types=[], attributes=[]))
 
     return links
-    
-def _get_groups(network_id, template_id=None):
+
+def _get_groups_qry(network_id, template_id=None):
     """
-        Get all the resource groups in a network
+        Build the query used to retrieve all the resource groups in a network
     """
-    extras = {'types':[], 'attributes':[]}
     group_qry = DBSession.query(ResourceGroup).filter(
                                         ResourceGroup.network_id==network_id,
                                         ResourceGroup.status=='A').options(noload('network'))
     if template_id is not None:
         group_qry = group_qry.filter(ResourceType.group_id==ResourceGroup.group_id, TemplateType.type_id==ResourceType.type_id, TemplateType.template_id==template_id)
 
+    return group_qry
+
+def _get_groups(network_id, template_id=None):
+    """
+        Get all the resource groups in a network
+    """
+    group_qry = _get_groups_qry(network_id, template_id)
     group_res = DBSession.execute(group_qry.statement).fetchall()
     groups = []
     for g in group_res:
-        groups.append(dictobj(g, extras))
+        groups.append(GroupRecord.from_row(g, types=[], attributes=[]))
 
     return groups
 
 
-def _get_scenarios(network_id, include_data, user_id, scenario_ids=None):
+def _resolve_resourcescenarios(all_rs, ancestors):
+    """
+        Get the data of a child scenario from the data of it and its ancestors,
+        as returned by _get_all_resourcescenarios. For each resource attribute,
+        the data of the nearest scenario in ancestors is used.
+    """
+    resolved = {}
+    for ancestor_id in reversed(ancestors):
+        for rs in all_rs.get(ancestor_id, []):
+            resolved[rs.resource_attr_id] = rs
+
+    child_id = ancestors[0]
+    scenario_rs = []
+    for ra_id in sorted(resolved):
+        rs = resolved[ra_id]
+        if rs.scenario_id != child_id:
+            inherited = dict(rs.items())
+            inherited['scenario_id'] = child_id
+            rs = ResourceScenarioRecord(**inherited)
+        scenario_rs.append(rs)
+    return scenario_rs
+
+def _get_scenarios(network_id, include_data, user_id, scenario_ids=None, template_id=None, include_hidden=False, include_values=True):
     """
         Get all the scenarios in a network
     """
@@ -916,11 +1143,28 @@ def _get_scenarios(network_id, include_data, user_id, scenario_ids=None):
     extras = {'resourcescenarios': [], 'resourcegroupitems': []}
     scens = [dictobj(s,extras) for s in DBSession.execute(scen_qry.statement).fetchall()]
     
-    all_resource_group_items = _get_all_group_items(network_id)
+    all_resource_group_items = _get_all_group_items(network_id, scenario_ids)
 
     if include_data == 'Y':
-        all_rs = _get_all_resourcescenarios(network_id, user_id)
-        metadata = _get_metadata(network_id, user_id)
+        #Child scenarios need the data of their ancestors too.
+        data_scenario_ids = scenario_ids
+        ancestors = {}
+        for s in scens:
+            if s.parent_id is not None:
+                ancestors[s.scenario_id] = scenario._get_scenario_ancestors(s.scenario_id)
+        if scenario_ids and len(ancestors) > 0:
+            data_scenario_ids = set(scenario_ids)
+            for scenario_ancestors in ancestors.values():
+                data_scenario_ids.update(scenario_ancestors)
+            data_scenario_ids = list(data_scenario_ids)
+
+        all_rs = _get_all_resourcescenarios(network_id, user_id, data_scenario_ids, template_id, include_hidden, include_values)
+        metadata = _get_metadata(network_id, user_id, data_scenario_ids, template_id, include_hidden)
+
+        resolved_rs = {}
+        for scenario_id, scenario_ancestors in ancestors.items():
+            resolved_rs[scenario_id] = _resolve_resourcescenarios(all_rs, scenario_ancestors)
+        all_rs.update(resolved_rs)
 
     for s in scens:
         s.resourcegroupitems = all_resource_group_items.get(s.scenario_id, [])
@@ -933,7 +1177,7 @@ def _get_scenarios(network_id, include_data, user_id, scenario_ids=None):
 
     return scens
 
-def get_network(network_id, summary=False, include_data='N', scenario_ids=None, template_id=None, **kwargs):
+def get_network(network_id, summary=False, include_data='N', scenario_ids=None, template_id=None, include_values='Y', **kwargs):
     """
         Return a whole network as a dictionary.
         network_id: ID of the network to retrieve
@@ -945,6 +1189,12 @@ def get_network(network_id, summary=False, include_data='N', scenario_ids=None,
                       will speed up this function call.
         template_id:  Return the network with only attributes associated with this
                       template on the network, groups, nodes and links.
+        include_values: 'Y' or 'N'. If 'N', datasets are returned with their IDS
+                      and hashes, but without their values. The values can then
+                      be retrieved as needed, in batches, using data.get_datasets.
+
+        Assembled networks are cached (see util.cache), so the returned
+        network may be shared with other requests and must not be modified.
     """
     log.debug("getting network %s"%network_id)
     user_id = kwargs.get('user_id')
@@ -961,47 +1211,358 @@ def get_network(network_id, summary=False, include_data='N', scenario_ids=None,
                                 noload('resourcegroups')).one()
         
         net_i.check_read_permission(user_id)
-        
-        net = dictobj(net_i.__dict__)
-
-        net.nodes          = _get_nodes(network_id, template_id=template_id)
-        net.links          = _get_links(network_id, template_id=template_id) 
-        net.resourcegroups = _get_groups(network_id, template_id=template_id)
-
-        if summary is False:
-            all_attributes = _get_all_resource_attributes(network_id, template_id)
-            log.info("Setting attributes")
-            net.attributes = all_attributes['NETWORK'].get(network_id, [])
-            for node in net.nodes:
-                node.attributes = all_attributes['NODE'].get(node.node_id, [])
-            log.info("Node attributes set")
-            for link in net.links:
-                link.attributes = all_attributes['LINK'].get(link.link_id, [])
-            log.info("Link attributes set")
-            for group in net.resourcegroups:
-                group.attributes = all_attributes['GROUP'].get(group.group_id, [])
-            log.info("Group attributes set")
-    
+    except NoResultFound:
+        raise ResourceNotFoundError("Network (network_id=%s) not found." %
+                                  network_id)
+
+    if scenario_ids:
+        scenario_ids = sorted(set(scenario_ids))
+
+    include_values = include_values != 'N'
+
+    cache_key = (summary, include_data,
+                 tuple(scenario_ids) if scenario_ids else None,
+                 template_id, include_values)
+
+    #Get the version before assembling the network, so a change
+    #made while assembling it stops it from being used later.
+    version = network_cache.get_version(network_id)
+    net = network_cache.get(network_id, cache_key, version)
+
+    if net is None:
+        net = _assemble_network(net_i, summary, include_data, scenario_ids, template_id, include_values, user_id)
+        network_cache.set(network_id, cache_key, version, net)
+    else:
+        log.info("Network %s retrieved from cache", network_id)
+
+    if include_data == 'Y':
+        net = _apply_dataset_permissions(net, user_id)
+
+    return net
+
+def _assemble_network(net_i, summary, include_data, scenario_ids, template_id, include_values, user_id):
+    """
+        Build the network dictionary returned by get_network.
+        All hidden datasets are included, so that the result can be
+        shared between users. _apply_dataset_permissions must be called
+        before it is returned to a user.
+    """
+    network_id = net_i.network_id
+
+    net = dictobj(dict((k, v) for k, v in net_i.__dict__.items()
+                                            if not k.startswith('_')))
 
-        log.info("Setting types")
-        all_types = _get_all_templates(network_id, template_id)
-        net.types = all_types['NETWORK'].get(network_id, [])
+    net.nodes          = _get_nodes(network_id, template_id=template_id)
+    net.links          = _get_links(network_id, template_id=template_id) 
+    net.resourcegroups = _get_groups(network_id, template_id=template_id)
+
+    if summary is False:
+        all_attributes = _get_all_resource_attributes(network_id, template_id)
+        log.info("Setting attributes")
+        net.attributes = all_attributes['NETWORK'].get(network_id, [])
         for node in net.nodes:
-            node.types = all_types['NODE'].get(node.node_id, [])
+            node.attributes = all_attributes['NODE'].get(node.node_id, [])
+        log.info("Node attributes set")
         for link in net.links:
-            link.types = all_types['LINK'].get(link.link_id, [])
+            link.attributes = all_attributes['LINK'].get(link.link_id, [])
+        log.info("Link attributes set")
         for group in net.resourcegroups:
-            group.types = all_types['GROUP'].get(group.group_id, [])
+            group.attributes = all_attributes['GROUP'].get(group.group_id, [])
+        log.info("Group attributes set")
+
+
+    log.info("Setting types")
+    all_types = _get_all_templates(network_id, template_id)
+    net.types = all_types['NETWORK'].get(network_id, [])
+    for node in net.nodes:
+        node.types = all_types['NODE'].get(node.node_id, [])
+    for link in net.links:
+        link.types = all_types['LINK'].get(link.link_id, [])
+    for group in net.resourcegroups:
+        group.types = all_types['GROUP'].get(group.group_id, [])
+
+    log.info("Getting scenarios")
+
+    net.scenarios = _get_scenarios(network_id, include_data, user_id, scenario_ids, template_id,
+                                   include_hidden=True,
+                                   include_values=include_values)
+
+    return net
+
+def _apply_dataset_permissions(net, user_id):
+    """
+        Remove the hidden datasets which the user does not own from
+        an assembled network. The network itself is not modified, as it may be
+        in the cache. If there is nothing to remove, it is returned as it is.
+    """
+    hidden_ids = set()
+    for s in net.scenarios:
+        for rs in s.resourcescenarios:
+            if rs.dataset.hidden == 'Y':
+                hidden_ids.add(rs.dataset_id)
+
+    if len(hidden_ids) == 0:
+        return net
+
+    hidden_ids = list(hidden_ids)
+    owned_ids = set()
+    for i in range(0, len(hidden_ids), data.qry_in_threshold):
+        id_chunk = hidden_ids[i:i+data.qry_in_threshold]
+        owned = DBSession.query(DatasetOwner.dataset_id).filter(
+                                DatasetOwner.dataset_id.in_(id_chunk),
+                                DatasetOwner.user_id==user_id).all()
+        owned_ids.update([o.dataset_id for o in owned])
+
+    forbidden_ids = set(hidden_ids) - owned_ids
+
+    if len(forbidden_ids) == 0:
+        return net
 
-        log.info("Getting scenarios")
+    user_net = dictobj(net)
+    user_net.scenarios = []
+    for s in net.scenarios:
+        user_scenario = dictobj(s)
+        user_scenario.resourcescenarios = [rs for rs in s.resourcescenarios
+                                           if rs.dataset_id not in forbidden_ids]
+        user_net.scenarios.append(user_scenario)
 
-        net.scenarios = _get_scenarios(network_id, include_data, user_id, scenario_ids)
+    return user_net
 
+_resource_ref_cols = {
+    'NODE'    : (ResourceAttr.node_id,    ResourceType.node_id),
+    'LINK'    : (ResourceAttr.link_id,    ResourceType.link_id),
+    'GROUP'   : (ResourceAttr.group_id,   ResourceType.group_id),
+    'NETWORK' : (ResourceAttr.network_id, ResourceType.network_id),
+}
+
+def _get_resource_attributes(ref_key, ref_ids, template_id=None):
+    """
+        Get the attributes for a list of resources of the same type (NODE, LINK etc).
+        Return these attributes as a dictionary, keyed on the ID of the resource.
+        ref_ids should be shorter than qry_in_threshold.
+    """
+    ra_col, rt_col = _resource_ref_cols[ref_key]
+
+    attr_qry = DBSession.query(ResourceAttr.resource_attr_id.label('resource_attr_id'),
+                               ResourceAttr.ref_key.label('ref_key'),
+                               ResourceAttr.cr_date.label('cr_date'),
+                               ResourceAttr.attr_is_var.label('attr_is_var'),
+                               ResourceAttr.node_id.label('node_id'),
+                               ResourceAttr.link_id.label('link_id'),
+                               ResourceAttr.group_id.label('group_id'),
+                               ResourceAttr.network_id.label('network_id'),
+                               ResourceAttr.attr_id.label('attr_id'),
+                               Attr.attr_name.label('attr_name'),
+                              ).filter(Attr.attr_id==ResourceAttr.attr_id,
+                                       ra_col.in_(ref_ids))
+
+    if template_id is not None:
+        attr_qry = attr_qry.filter(rt_col==ra_col,
+                                   TemplateType.type_id==ResourceType.type_id,
+                                   TemplateType.template_id==template_id,
+                                   TypeAttr.type_id==TemplateType.type_id,
+                                   TypeAttr.attr_id==ResourceAttr.attr_id).distinct()
+
+    attr_dict = dict()
+    for attr in DBSession.execute(attr_qry.statement).fetchall():
+        resource_attrs = attr_dict.get(attr[ra_col.name], [])
+        resource_attrs.append(attr)
+        attr_dict[attr[ra_col.name]] = resource_attrs
+
+    return attr_dict
+
+def _get_resource_types(ref_key, ref_ids, template_id=None):
+    """
+        Get the types for a list of resources of the same type (NODE, LINK etc).
+        Return these types as a dictionary, keyed on the ID of the resource.
+        ref_ids should be shorter than qry_in_threshold.
+    """
+    ra_col, rt_col = _resource_ref_cols[ref_key]
+
+    type_qry = DBSession.query(
+                               ResourceType.ref_key.label('ref_key'),
+                               ResourceType.node_id.label('node_id'),
+                               ResourceType.link_id.label('link_id'),
+                               ResourceType.group_id.label('group_id'),
+                               ResourceType.network_id.label('network_id'),
+                               Template.template_name.label('template_name'),
+                               Template.template_id.label('template_id'),
+                               TemplateType.type_id.label('type_id'),
+                               TemplateType.layout.label('layout'),
+                               TemplateType.type_name.label('type_name'),
+                              ).filter(TemplateType.type_id==ResourceType.type_id,
+                                       Template.template_id==TemplateType.template_id,
+                                       rt_col.in_(ref_ids))
+
+    #As in _get_all_templates, the network's types are not filtered by template.
+    if template_id is not None and ref_key != 'NETWORK':
+        type_qry = type_qry.filter(Template.template_id==template_id)
+
+    type_dict = dict()
+    for t in DBSession.execute(type_qry.statement).fetchall():
+        resource_types = type_dict.get(t[rt_col.name], [])
+        resource_types.append(_make_resourcetype(t))
+        type_dict[t[rt_col.name]] = resource_types
+
+    return type_dict
+
+def _stream_rows(qry, key_cols, chunk_size):
+    """
+        Execute a query and yield the results in lists of at most chunk_size rows.
+
+        The rows are read a page at a time, in the order of key_cols, which
+        must identify each row. Each page starts after the last row of the
+        previous one, as in _generate_resource_data, so only one page is held
+        in memory whatever the database and driver, and no cursor is left open
+        on the request's connection while the pages are used.
+    """
+    last_row = None
+    while True:
+        page_qry = qry.order_by(*key_cols)
+        if last_row is not None:
+            page_qry = page_qry.filter(_after_row(key_cols, last_row))
+        rows = DBSession.execute(page_qry.limit(chunk_size).statement).fetchall()
+
+        if len(rows) == 0:
+            break
+
+        yield rows
+
+        if len(rows) < chunk_size:
+            break
+        last_row = rows[-1]
+
+def _after_row(key_cols, row):
+    """
+        Build a condition which selects the rows after row, in the order of key_cols.
+    """
+    col = key_cols[0]
+    value = row[col.key]
+    if len(key_cols) == 1:
+        return col > value
+    return or_(col > value, and_(col == value, _after_row(key_cols[1:], row)))
+
+def get_network_chunks(network_id, include_data='N', scenario_ids=None, template_id=None, chunk_size=None, **kwargs):
+    """
+        Return a network as a sequence of chunks rather than as one object.
+        This allows very large networks to be exported without building the
+        whole network in memory, and allows clients to start processing
+        the network before it has all been retrieved.
+
+        The first chunk contains the network itself (with its attributes
+        and types). This is followed by chunks of nodes, links, groups and
+        scenarios (without data). If include_data is 'Y', these are followed
+        by chunks of resource scenarios, each belonging to a single scenario.
+
+        chunk_size: The maximum number of items in each chunk.
+                    Defaults to the 'stream_chunk_size' setting in the config.
+
+        Permissions are checked when this function is called, but the data is
+        only retrieved as the returned generator is consumed.
+    """
+    user_id = kwargs.get('user_id')
+
+    try:
+        net_i = DBSession.query(Network).filter(
+                                Network.network_id == network_id).options(
+                                noload('scenarios')).options(
+                                noload('nodes')).options(
+                                noload('links')).options(
+                                noload('types')).options(
+                                noload('attributes')).options(
+                                noload('resourcegroups')).one()
     except NoResultFound:
         raise ResourceNotFoundError("Network (network_id=%s) not found." %
                                   network_id)
 
-    return net
+    net_i.check_read_permission(user_id)
+
+    if chunk_size is None:
+        chunk_size = config.getint('db', 'stream_chunk_size', 500)
+
+    if chunk_size < 1:
+        raise HydraError("%s is not a valid chunk size."%chunk_size)
+
+    #The IDS in each chunk are used in 'in' queries, so the chunk
+    #size is limited to what the database will accept.
+    chunk_size = min(chunk_size, data.qry_in_threshold)
+
+    net = dictobj(net_i.__dict__)
+    net.attributes = _get_resource_attributes('NETWORK', [network_id], template_id).get(network_id, [])
+    net.types      = _get_resource_types('NETWORK', [network_id], template_id).get(network_id, [])
+    net.nodes          = []
+    net.links          = []
+    net.resourcegroups = []
+    net.scenarios      = []
+
+    return _generate_network_chunks(net, include_data, scenario_ids, template_id, chunk_size, user_id)
+
+def _generate_network_chunks(net, include_data, scenario_ids, template_id, chunk_size, user_id):
+    """
+        Generator which does the work for get_network_chunks
+    """
+    network_id = net.network_id
+
+    yield dictobj({'chunk_type':'NETWORK', 'network':net})
+
+    resource_qrys = (
+        ('NODE',  Node.node_id,           'nodes',          _get_nodes_qry,  NodeRecord),
+        ('LINK',  Link.link_id,           'links',          _get_links_qry,  LinkRecord),
+        ('GROUP', ResourceGroup.group_id, 'resourcegroups', _get_groups_qry, GroupRecord),
+    )
+
+    for ref_key, key_col, chunk_key, get_qry, record_class in resource_qrys:
+        id_col = key_col.key
+        t0 = time.time()
+        num_resources = 0
+        for rows in _stream_rows(get_qry(network_id, template_id), [key_col], chunk_size):
+            resources = [record_class.from_row(r) for r in rows]
+            ref_ids = [r[id_col] for r in resources]
+
+            resource_attrs = _get_resource_attributes(ref_key, ref_ids, template_id)
+            resource_types = _get_resource_types(ref_key, ref_ids, template_id)
+            for r in resources:
+                r.attributes = resource_attrs.get(r[id_col], [])
+                r.types      = resource_types.get(r[id_col], [])
+
+            num_resources = num_resources + len(resources)
+            yield dictobj({'chunk_type':ref_key, chunk_key:resources})
+        log.info("%s %ss streamed in %s", num_resources, ref_key.lower(), time.time()-t0)
+
+    scenarios = _get_scenarios(network_id, 'N', user_id, scenario_ids)
+    yield dictobj({'chunk_type':'SCENARIO', 'scenarios':scenarios})
+
+    if include_data != 'Y':
+        return
+
+    t0 = time.time()
+    num_rs = 0
+    for s in scenarios:
+        #As in get_network, a child scenario includes the data it
+        #inherits from its ancestors, so each scenario is read separately.
+        rs_qry = _get_resourcescenario_qry(network_id, user_id, None, template_id).filter(
+                                scenario._get_resolved_rs_filter(s.scenario_id))
+        for rows in _stream_rows(rs_qry, [ResourceScenario.resource_attr_id], chunk_size):
+            dataset_ids = list(set([rs.dataset_id for rs in rows]))
+            metadata = {}
+            for m in DBSession.query(Metadata).filter(Metadata.dataset_id.in_(dataset_ids)):
+                dataset_metadata = metadata.get(m.dataset_id, [])
+                dataset_metadata.append(m)
+                metadata[m.dataset_id] = dataset_metadata
+
+            scenario_rs = []
+            for rs in rows:
+                rs_obj = _make_resourcescenario(rs)
+                rs_obj.scenario_id = s.scenario_id
+                rs_obj.dataset.metadata = metadata.get(rs.dataset_id, [])
+                scenario_rs.append(rs_obj)
+
+            yield dictobj({'chunk_type':'RESOURCESCENARIO',
+                           'scenario_id':s.scenario_id,
+                           'resourcescenarios':scenario_rs})
+
+            num_rs = num_rs + len(rows)
+    log.info("%s resource scenarios streamed in %s", num_rs, time.time()-t0)
 
 def get_node(node_id,**kwargs):
     try:
@@ -1189,6 +1750,7 @@ def update_network(network,
                 log.info("Adding new scenario %s to network", s.name)
                 scenario.add_scenario(network.id, s, **kwargs)
 
+    network_cache.invalidate(network.id)
     DBSession.flush()
 
     updated_net = get_network(network.id, summary=True, **kwargs)
@@ -1206,6 +1768,7 @@ def set_network_status(network_id,status,**kwargs):
         net_i.status = status
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
+    network_cache.invalidate(network_id)
     DBSession.flush()
     return 'OK'
 
@@ -1263,6 +1826,7 @@ def add_nodes(network_id, nodes,**kwargs):
     _add_nodes_to_database(net_i, nodes)
 
     net_i.project_id=net_i.project_id
+    network_cache.invalidate(network_id)
     DBSession.flush()
 
     node_s =  DBSession.query(Node).filter(Node.network_id==network_id).all()
@@ -1306,6 +1870,7 @@ def add_links(network_id, links,**kwargs):
     _add_links_to_database(net_i, links, node_id_map)
 
     net_i.project_id=net_i.project_id
+    network_cache.invalidate(network_id)
     DBSession.flush()
     link_s =  DBSession.query(Link).filter(Link.network_id==network_id).all()
     iface_links = {}
@@ -1334,6 +1899,7 @@ def add_node(network_id, node,**kwargs):
 
     add_attributes(new_node, node.attributes)
 
+    network_cache.invalidate(network_id)
     DBSession.flush()
     
     if node.types is not None and len(node.types) > 0:
@@ -1379,6 +1945,7 @@ def update_node(node,**kwargs):
     _update_attributes(node_i, node.attributes)
 
     add_resource_types(node_i, node.types)
+    network_cache.invalidate(node_i.network_id)
     DBSession.flush()
 
     return node_i
@@ -1402,6 +1969,7 @@ def set_node_status(node_id, status, **kwargs):
     for link in node_i.links_from:
         link.status = status
 
+    network_cache.invalidate(node_i.network_id)
     DBSession.flush()
 
     return node_i
@@ -1445,6 +2013,7 @@ def purge_network(network_id, purge_data,**kwargs):
 
     net_i.check_write_permission(user_id)
     DBSession.delete(net_i)
+    network_cache.invalidate(network_id)
     DBSession.flush()
     return 'OK'
 
@@ -1488,6 +2057,7 @@ def delete_node(node_id, purge_data,**kwargs):
 
     node_i.network.check_write_permission(user_id)
     DBSession.delete(node_i)
+    network_cache.invalidate(node_i.network_id)
     DBSession.flush()
     return 'OK'
 
@@ -1514,6 +2084,7 @@ def add_link(network_id, link,**kwargs):
 
     add_attributes(link_i, link.attributes)
 
+    network_cache.invalidate(network_id)
     DBSession.flush()
 
     if link.types is not None and len(link.types) > 0:
@@ -1555,6 +2126,7 @@ def update_link(link,**kwargs):
 
     add_attributes(link_i, link.attributes)
     add_resource_types(link_i, link.types)
+    network_cache.invalidate(link_i.network_id)
     DBSession.flush()
     return link_i
 
@@ -1572,6 +2144,7 @@ def set_link_status(link_id, status, **kwargs):
     link_i.network.check_write_permission(user_id)
 
     link_i.status = status
+    network_cache.invalidate(link_i.network_id)
     DBSession.flush()
 
 def delete_link(link_id, purge_data,**kwargs):
@@ -1614,6 +2187,7 @@ def delete_link(link_id, purge_data,**kwargs):
 
     link_i.network.check_write_permission(user_id)
     DBSession.delete(link_i)
+    network_cache.invalidate(link_i.network_id)
     DBSession.flush()
 
 def add_group(network_id, group,**kwargs):
@@ -1632,6 +2206,7 @@ def add_group(network_id, group,**kwargs):
 
     add_attributes(res_grp_i, group.attributes)
 
+    network_cache.invalidate(network_id)
     DBSession.flush()
 
 
@@ -1667,6 +2242,7 @@ def set_group_status(group_id, status, **kwargs):
 
     group_i.status = status
 
+    network_cache.invalidate(group_i.network_id)
     DBSession.flush()
 
     return group_i
@@ -1711,6 +2287,7 @@ def delete_group(group_id, purge_data,**kwargs):
 
     group_i.network.check_write_permission(user_id)
     DBSession.delete(group_i)
+    network_cache.invalidate(group_i.network_id)
     DBSession.flush()
 
 def get_scenarios(network_id,**kwargs):
@@ -1806,6 +2383,7 @@ def clean_up_network(network_id, **kwargs):
 
     except NoResultFound:
         raise ResourceNotFoundError("Network %s not found"%(network_id))
+    network_cache.invalidate(network_id)
     DBSession.flush()
     return 'OK'
 
@@ -1911,10 +2489,14 @@ def get_attributes_for_resource(network_id, scenario_id, ref_key, ref_ids=None,
 
     return resource_scenarios
 
-def get_all_resource_data(scenario_id, include_metadata='N', page_start=None, page_end=None, **kwargs):
+def _get_resource_data_qry(scenario_id, user_id):
     """
-        A function which returns the data for all resources in a network.
+        Build the query used to retrieve all the resource data in a scenario,
+        ordered by resource attribute. The values of hidden datasets which
+        the user does not own are returned as None.
     """
+    #Hidden datasets which the user cannot view
+    is_forbidden = and_(Dataset.hidden=='Y', DatasetOwner.user_id == None)
 
     rs_qry = DBSession.query(
                ResourceAttr.attr_id,
@@ -1927,17 +2509,18 @@ def get_all_resource_data(scenario_id, include_metadata='N', page_start=None, pa
                ResourceAttr.group_id,
                ResourceAttr.project_id,
                ResourceAttr.attr_is_var,
-               ResourceScenario.scenario_id,
+               literal(scenario_id, Integer).label('scenario_id'),
                ResourceScenario.source,
                Dataset.dataset_id,
                Dataset.data_name,
-               Dataset.value,
+               case([(is_forbidden, None)], else_=Dataset.value).label('value'),
                Dataset.data_dimen,
                Dataset.data_units,
-               Dataset.frequency,
+               case([(is_forbidden, None)], else_=Dataset.frequency).label('frequency'),
                Dataset.hidden,
                Dataset.data_type,
                null().label('metadata'),
+               case([(is_forbidden, 'N')], else_='Y').label('can_read'),
                case([
                     (ResourceAttr.node_id != None, Node.node_name),
                     (ResourceAttr.link_id != None, Link.link_name),
@@ -1951,56 +2534,136 @@ def get_all_resource_data(scenario_id, include_metadata='N', page_start=None, pa
                 outerjoin(Link, ResourceAttr.link_id==Link.link_id).\
                 outerjoin(ResourceGroup, ResourceAttr.group_id==ResourceGroup.group_id).\
                 outerjoin(Network, ResourceAttr.network_id==Network.network_id).\
-            filter(ResourceScenario.scenario_id==scenario_id)
+                outerjoin(DatasetOwner, and_(DatasetOwner.dataset_id==Dataset.dataset_id,
+                                             DatasetOwner.user_id==user_id,
+                                             DatasetOwner.view=='Y')).\
+            filter(scenario._get_resolved_rs_filter(scenario_id)).\
+            order_by(ResourceAttr.resource_attr_id)
 
-    all_resource_data = rs_qry.all()
+    return rs_qry
 
-    if page_start is not None and page_end is None:
-        all_resource_data = all_resource_data[page_start:]
-    elif page_start is not None and page_end is not None:
-        all_resource_data = all_resource_data[page_start:page_end]
+def _get_dataset_metadata(dataset_ids):
+    """
+        Get the metadata of a list of datasets, as a dictionary keyed on dataset ID.
+    """
+    metadata_dict = {}
+    dataset_ids = list(set(dataset_ids))
+    for i in range(0, len(dataset_ids), data.qry_in_threshold):
+        id_chunk = dataset_ids[i:i+data.qry_in_threshold]
+        metadata_qry = DBSession.query(Metadata.dataset_id,
+                                       Metadata.metadata_name,
+                                       Metadata.metadata_val).filter(
+                                            Metadata.dataset_id.in_(id_chunk))
+        for m in metadata_qry.all():
+            metadata_dict.setdefault(m.dataset_id, []).append(m)
 
-    log.info("%s datasets retrieved", len(all_resource_data))
+    return metadata_dict
 
+def _make_resource_data(rows, include_metadata):
+    """
+        Turn rows from the resource data query into ResourceData tuples,
+        adding the metadata if requested.
+    """
     if include_metadata == 'Y':
-        metadata_qry = DBSession.query(distinct(Metadata.dataset_id).label('dataset_id'),
-                                      Metadata.metadata_name,
-                                      Metadata.metadata_val).filter(
-                            ResourceScenario.resource_attr_id==ResourceAttr.resource_attr_id,
-                            ResourceScenario.scenario_id==scenario_id,
-                            Dataset.dataset_id==ResourceScenario.dataset_id,
-                            Metadata.dataset_id==Dataset.dataset_id)
-
-        log.info("Querying node metadata")
-        metadata = metadata_qry.all()
-        log.info("%s metadata items retrieved", len(metadata))
-
-        metadata_dict = {}
-        for m in metadata:
-            if metadata_dict.get(m.dataset_id):
-                metadata_dict[m.dataset_id].append(m)
-            else:
-                metadata_dict[m.dataset_id] = [m]
+        metadata_dict = _get_dataset_metadata([ra.dataset_id for ra in rows
+                                               if ra.can_read == 'Y'])
 
     return_data = []
-    for ra in all_resource_data:
+    resource_data_tuple = None
+    for ra in rows:
         ra_dict = ra._asdict()
-        if ra.hidden == 'Y':
-           try:
-                d = DBSession.query(Dataset).filter(
-                        Dataset.dataset_id==ra.dataset_id
-                    ).options(noload('metadata')).one()
-                d.check_read_permission(kwargs.get('user_id'))
-           except:
-               ra_dict['value']     = None
-               ra_dict['frequency'] = None
-               ra_dict['metadata']  = []
+        del(ra_dict['can_read'])
+        if ra.can_read == 'Y' and include_metadata == 'Y':
+            ra_dict['metadata'] = metadata_dict.get(ra.dataset_id, [])
         else:
-            if include_metadata == 'Y':
-                ra_dict['metadata'] = metadata_dict.get(ra.dataset_id, [])
+            ra_dict['metadata'] = []
 
-        return_data.append(namedtuple('ResourceData', ra_dict.keys())(**ra_dict))
+        if resource_data_tuple is None:
+            resource_data_tuple = namedtuple('ResourceData', ra_dict.keys())
+        return_data.append(resource_data_tuple(**ra_dict))
+
+    return return_data
+
+def get_all_resource_data(scenario_id, include_metadata='N', page_start=None, page_end=None,
+                          last_resource_attr_id=None, page_size=None, **kwargs):
+    """
+        A function which returns the data for all resources in a network.
+        The data is ordered by resource attribute ID.
+
+        There are two ways of retrieving the data a page at a time:
+        page_start, page_end: The positions of the first and last (exclusive) items to return.
+        last_resource_attr_id, page_size: Return page_size items, starting after
+                      the given resource attribute. Pass the resource_attr_id of
+                      the last item in a page to get the next page. This is faster
+                      than page_start for large scenarios, as the items before the
+                      page are not scanned.
+    """
+
+    rs_qry = _get_resource_data_qry(scenario_id, kwargs.get('user_id'))
+
+    if last_resource_attr_id is not None:
+        rs_qry = rs_qry.filter(ResourceAttr.resource_attr_id > last_resource_attr_id)
+
+    if page_start is not None:
+        rs_qry = rs_qry.offset(page_start)
+
+    if page_end is not None:
+        #A page which ends before it starts is empty. A negative limit
+        #would mean no limit in some databases.
+        rs_qry = rs_qry.limit(max(0, page_end - (page_start or 0)))
+    elif page_size is not None:
+        rs_qry = rs_qry.limit(page_size)
+
+    all_resource_data = rs_qry.all()
+
+    log.info("%s datasets retrieved", len(all_resource_data))
+
+    return_data = _make_resource_data(all_resource_data, include_metadata)
 
     log.info("Returning %s datasets", len(return_data))
 
     return return_data 
+
+def get_all_resource_data_stream(scenario_id, include_metadata='N', chunk_size=None, **kwargs):
+    """
+        Return a generator of all the data for all resources in a network, as
+        returned by get_all_resource_data. The data is retrieved one page at a time,
+        so a scenario of any size can be exported in constant memory.
+
+        chunk_size: The number of items in each page.
+                    Defaults to the 'stream_chunk_size' setting in the config.
+    """
+    if chunk_size is None:
+        chunk_size = config.getint('db', 'stream_chunk_size', 500)
+
+    if chunk_size < 1:
+        raise HydraError("%s is not a valid chunk size."%chunk_size)
+
+    return _generate_resource_data(scenario_id, include_metadata, chunk_size, kwargs.get('user_id'))
+
+def _generate_resource_data(scenario_id, include_metadata, chunk_size, user_id):
+    """
+        Generator which does the work for get_all_resource_data_stream
+    """
+    t0 = time.time()
+    num_rows = 0
+    last_resource_attr_id = None
+    while True:
+        rs_qry = _get_resource_data_qry(scenario_id, user_id)
+        if last_resource_attr_id is not None:
+            rs_qry = rs_qry.filter(ResourceAttr.resource_attr_id > last_resource_attr_id)
+        rows = rs_qry.limit(chunk_size).all()
+
+        if len(rows) == 0:
+            break
+
+        for ra in _make_resource_data(rows, include_metadata):
+            yield ra
+
+        num_rows = num_rows + len(rows)
+        last_resource_attr_id = rows[-1].resource_attr_id
+
+        if len(rows) < chunk_size:
+            break
+
+    log.info("%s datasets streamed in %s", num_rows, time.time()-t0)
@@ -21,6 +21,7 @@ from HydraServer.db.model import Scenario,\
         ResourceScenario,\
         TypeAttr,\
         ResourceAttr,\
+        ResourceType,\
         NetworkOwner,\
         Dataset,\
         Attr,\
@@ -29,13 +30,16 @@ from HydraServer.db.model import Scenario,\
 import units as hydra_units
 
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy import or_, and_
+from sqlalchemy import or_, and_, func, bindparam, select, literal, exists, null, distinct, Integer
 from sqlalchemy.orm import joinedload_all, joinedload, aliased
+from sqlalchemy.sql.expression import case
 import data
+from HydraServer.util.cache import network_cache
+from HydraServer.util import decompress_value
 from HydraLib.hydra_dateutil import timestamp_to_ordinal
-from collections import namedtuple
-from copy import deepcopy
-import zlib
+from HydraLib import config
+from collections import OrderedDict
+import datetime
 
 log = logging.getLogger(__name__)
 
@@ -56,6 +60,14 @@ def _get_scenario(scenario_id):
     except NoResultFound:
         raise ResourceNotFoundError("Scenario %s does not exist."%(scenario_id))
 
+def _invalidate_network_cache(scenario_id):
+    """
+        Indicate that the network containing a scenario has changed.
+    """
+    network_id = DBSession.query(Scenario.network_id).filter(
+                                Scenario.scenario_id==scenario_id).scalar()
+    network_cache.invalidate(network_id)
+
 def set_rs_dataset(resource_attr_id, scenario_id, dataset_id, **kwargs):
     rs = DBSession.query(ResourceScenario).filter(
         ResourceScenario.resource_attr_id==resource_attr_id,
@@ -71,6 +83,7 @@ def set_rs_dataset(resource_attr_id, scenario_id, dataset_id, **kwargs):
 
     rs.dataset_id=dataset_id
 
+    _invalidate_network_cache(scenario_id)
     DBSession.flush()
 
     rs = DBSession.query(ResourceScenario).filter(
@@ -112,6 +125,7 @@ def copy_data_from_scenario(resource_attrs, source_scenario_id, target_scenario_
             target_rs.resource_attr_id = source_rs.resource_attr_id
             DBSession.add(target_rs)
     
+    _invalidate_network_cache(target_scenario_id)
     DBSession.flush()
 
     return target_resourcescenarios
@@ -192,6 +206,7 @@ def add_scenario(network_id, scenario,**kwargs):
                 group_item_i.subgroup_id  = group_item.ref_id
             scen.resourcegroupitems.append(group_item_i)
     DBSession.add(scen)
+    network_cache.invalidate(network_id)
     DBSession.flush()
     return scen
 
@@ -255,6 +270,7 @@ def update_scenario(scenario,update_data=True,update_groups=True,**kwargs):
 
             if group_item.id is None or group_item.id < 0:
                 scen.resourcegroupitems.append(group_item_i)
+    network_cache.invalidate(scen.network_id)
     DBSession.flush()
     return scen
 
@@ -267,6 +283,7 @@ def set_scenario_status(scenario_id, status, **kwargs):
     scenario_i = _get_scenario(scenario_id)
 
     scenario_i.status = status
+    network_cache.invalidate(scenario_i.network_id)
     DBSession.flush()
     return 'OK' 
 
@@ -277,23 +294,187 @@ def purge_scenario(scenario_id, **kwargs):
 
     _check_can_edit_scenario(scenario_id, kwargs['user_id'])
     scenario_i = _get_scenario(scenario_id)
+
+    num_children = DBSession.query(func.count(Scenario.scenario_id)).filter(
+                                    Scenario.parent_id==scenario_id).scalar()
+    if num_children > 0:
+        raise HydraError("Cannot delete scenario %s as it is the parent of %s other scenarios."
+                         %(scenario_id, num_children))
+
+    network_cache.invalidate(scenario_i.network_id)
     DBSession.delete(scenario_i)
     DBSession.flush()
     return 'OK' 
 
 def clone_scenario(scenario_id,**kwargs):
+    """
+        Copy a scenario, with all its data and resource group items.
+        The data is shared with the original scenario, not copied.
+    """
+    return _clone_scenario(scenario_id, **kwargs)
+
+def clone_scenario_subset(scenario_id, attr_ids=None, type_ids=None,
+                          node_ids=None, link_ids=None, group_ids=None, **kwargs):
+    """
+        Copy a scenario, with only some of its data:
+          attr_ids:  only the data of these attributes.
+          type_ids:  only the data of resources which have one of these types.
+          node_ids, link_ids, group_ids: only the data of these resources.
+                     If any of these are specified, network data is not copied.
+        The filters which are specified are combined, so data is only copied
+        if it matches all of them. Resource group items are all copied.
+    """
+    return _clone_scenario(scenario_id,
+                           attr_ids=attr_ids,
+                           type_ids=type_ids,
+                           node_ids=node_ids,
+                           link_ids=link_ids,
+                           group_ids=group_ids,
+                           **kwargs)
+
+def _get_resource_attr_filter(attr_ids=None, type_ids=None, node_ids=None, link_ids=None, group_ids=None):
+    """
+        Get the conditions on tResourceAttr which select a subset of
+        the data of a scenario.
+    """
+    ra = ResourceAttr.__table__
+    conditions = []
+
+    if attr_ids is not None:
+        conditions.append(ra.c.attr_id.in_(attr_ids))
+
+    resource_conditions = []
+    if node_ids is not None:
+        resource_conditions.append(ra.c.node_id.in_(node_ids))
+    if link_ids is not None:
+        resource_conditions.append(ra.c.link_id.in_(link_ids))
+    if group_ids is not None:
+        resource_conditions.append(ra.c.group_id.in_(group_ids))
+    if len(resource_conditions) > 0:
+        conditions.append(or_(*resource_conditions))
+
+    if type_ids is not None:
+        rt = ResourceType.__table__
+        type_resource = or_(
+            and_(ra.c.ref_key=='NETWORK', rt.c.network_id==ra.c.network_id),
+            and_(ra.c.ref_key=='NODE',    rt.c.node_id==ra.c.node_id),
+            and_(ra.c.ref_key=='LINK',    rt.c.link_id==ra.c.link_id),
+            and_(ra.c.ref_key=='GROUP',   rt.c.group_id==ra.c.group_id),
+        )
+        conditions.append(exists().where(and_(rt.c.type_id.in_(type_ids),
+                                              rt.c.ref_key==ra.c.ref_key,
+                                              type_resource)))
+
+    return conditions
+
+def _copy_resourcegroupitems(source_scenario_id, target_scenario_id):
+    rgi = ResourceGroupItem.__table__
+    rgi_select = select([literal(target_scenario_id),
+                         rgi.c.ref_key,
+                         rgi.c.node_id,
+                         rgi.c.link_id,
+                         rgi.c.subgroup_id,
+                         rgi.c.group_id]).where(rgi.c.scenario_id==source_scenario_id)
+    DBSession.execute(rgi.insert().from_select(
+                ['scenario_id', 'ref_key', 'node_id', 'link_id', 'subgroup_id', 'group_id'], rgi_select))
+
+def add_child_scenario(scenario_id, name=None, description=None, **kwargs):
+    """
+        Create a scenario which inherits the data of another. The new
+        scenario starts with no data of its own. Data set on it
+        overrides the data of the parent; all other data is read from
+        the parent (and its parent, and so on). The resource group items
+        are copied from the parent.
+    """
+    user_id = kwargs.get('user_id')
+
+    _check_can_edit_scenario(scenario_id, user_id)
+    parent_i = _get_scenario(scenario_id)
 
+    if name is None:
+        name = "%s (child)"%(parent_i.scenario_name)
+        num_children = DBSession.query(func.count(Scenario.scenario_id)).filter(
+                                    Scenario.parent_id==scenario_id).scalar()
+        if num_children > 0:
+            name = name + " %s"%(num_children)
+
+    existing_scen = DBSession.query(Scenario.scenario_id).filter(Scenario.scenario_name==name,
+                                         Scenario.network_id==parent_i.network_id).first()
+    if existing_scen is not None:
+        raise HydraError("Scenario with name %s already exists in network %s"%(name, parent_i.network_id))
+
+    child_i = Scenario()
+    child_i.network_id           = parent_i.network_id
+    child_i.parent_id            = parent_i.scenario_id
+    child_i.scenario_name        = name
+    child_i.scenario_description = description if description is not None else parent_i.scenario_description
+    child_i.created_by           = user_id
+    child_i.start_time           = parent_i.start_time
+    child_i.end_time             = parent_i.end_time
+    child_i.time_step            = parent_i.time_step
+
+    DBSession.add(child_i)
+    DBSession.flush()
+
+    _copy_resourcegroupitems(scenario_id, child_i.scenario_id)
+
+    network_cache.invalidate(parent_i.network_id)
+
+    return child_i
+
+def _get_scenario_ancestors(scenario_id):
+    """
+        Get the IDs of a scenario, its parent, its parent's parent and so on.
+    """
+    ancestors = [scenario_id]
+    parent_id = DBSession.query(Scenario.parent_id).filter(Scenario.scenario_id==scenario_id).scalar()
+    while parent_id is not None:
+        if parent_id in ancestors:
+            raise HydraError("Scenario %s is its own ancestor."%(parent_id,))
+        ancestors.append(parent_id)
+        parent_id = DBSession.query(Scenario.parent_id).filter(Scenario.scenario_id==parent_id).scalar()
+    return ancestors
+
+def _get_resolved_rs_filter(scenario_id, rs_entity=ResourceScenario):
+    """
+        Get a condition on tResourceScenario (or an alias of it) which selects
+        the data of a scenario. For a child scenario, this is the data of the
+        scenario itself and, for each resource attribute it does not have
+        data for, the data of the nearest ancestor which does. The condition
+        selects the rows directly, so the data is found in the same query.
+    """
+    ancestors = _get_scenario_ancestors(scenario_id)
+    if len(ancestors) == 1:
+        return rs_entity.scenario_id==scenario_id
+
+    #How far up the chain of parents each scenario is.
+    depths = dict((s_id, i) for i, s_id in enumerate(ancestors))
+    other_rs = aliased(ResourceScenario)
+
+    #Exclude rows for which a nearer scenario has data for the same resource attribute.
+    overridden = exists().where(and_(
+                    other_rs.resource_attr_id==rs_entity.resource_attr_id,
+                    other_rs.scenario_id.in_(ancestors),
+                    case(depths, value=other_rs.scenario_id) < case(depths, value=rs_entity.scenario_id)))
+
+    return and_(rs_entity.scenario_id.in_(ancestors), ~overridden)
+
+def _clone_scenario(scenario_id, attr_ids=None, type_ids=None,
+                    node_ids=None, link_ids=None, group_ids=None, **kwargs):
+    """
+        Create the new scenario and copy the resource scenarios and resource
+        group items into it with INSERT ... SELECT statements, so that
+        the rows are copied by the database without being loaded.
+    """
     scen_i = _get_scenario(scenario_id)
 
     log.info("cloning scenario %s", scen_i.scenario_name)
 
     cloned_name = "%s (clone)"%(scen_i.scenario_name)
 
-    existing_scenarios = DBSession.query(Scenario).filter(Scenario.network_id==scen_i.network_id).all()
-    num_cloned_scenarios = 0
-    for existing_sceanrio in existing_scenarios:
-        if existing_sceanrio.scenario_name.find('clone') >= 0:
-            num_cloned_scenarios = num_cloned_scenarios + 1
+    num_cloned_scenarios = DBSession.query(func.count(Scenario.scenario_id)).filter(
+                                Scenario.network_id==scen_i.network_id,
+                                Scenario.scenario_name.contains('clone')).scalar()
 
     if num_cloned_scenarios > 0:
         cloned_name = cloned_name + " %s"%(num_cloned_scenarios)
@@ -310,77 +491,118 @@ def clone_scenario(scenario_id,**kwargs):
     cloned_scen.end_time             = scen_i.end_time
     cloned_scen.time_step            = scen_i.time_step
 
+    DBSession.add(cloned_scen)
+    DBSession.flush()
+
     log.info("New scenario created")
 
-    for rs in scen_i.resourcescenarios:
-        new_rs = ResourceScenario()
-        new_rs.resource_attr_id = rs.resource_attr_id
-        new_rs.dataset_id       = rs.dataset_id
-        
-        if kwargs.get('app_name') is None:
-            new_rs.source           = rs.source
-        else:
-            new_rs.source = kwargs['app_name']
+    rs = ResourceScenario.__table__
+    ra = ResourceAttr.__table__
+
+    if kwargs.get('app_name') is None:
+        source = rs.c.source
+    else:
+        source = literal(kwargs['app_name'])
+
+    #A child scenario is cloned with the data it inherits, so the
+    #clone does not depend on the child's ancestors.
+    rs_select = select([literal(cloned_scen.scenario_id),
+                        rs.c.resource_attr_id,
+                        rs.c.dataset_id,
+                        source]).where(_get_resolved_rs_filter(scenario_id))
+
+    conditions = _get_resource_attr_filter(attr_ids, type_ids, node_ids, link_ids, group_ids)
+    if len(conditions) > 0:
+        rs_select = rs_select.where(and_(ra.c.resource_attr_id==rs.c.resource_attr_id, *conditions))
 
-        cloned_scen.resourcescenarios.append(new_rs)
+    result = DBSession.execute(rs.insert().from_select(
+                ['scenario_id', 'resource_attr_id', 'dataset_id', 'source'], rs_select))
 
-    log.info("ResourceScenarios cloned")
+    log.info("%s ResourceScenarios cloned", result.rowcount)
+
+    _copy_resourcegroupitems(scenario_id, cloned_scen.scenario_id)
 
-    for resourcegroupitem_i in scen_i.resourcegroupitems:
-        new_resourcegroupitem_i = ResourceGroupItem()
-        new_resourcegroupitem_i.ref_key     = resourcegroupitem_i.ref_key
-        new_resourcegroupitem_i.link_id      = resourcegroupitem_i.link_id
-        new_resourcegroupitem_i.node_id      = resourcegroupitem_i.node_id
-        new_resourcegroupitem_i.subgroup_id      = resourcegroupitem_i.subgroup_id
-        new_resourcegroupitem_i.group_id    = resourcegroupitem_i.group_id
-        cloned_scen.resourcegroupitems.append(new_resourcegroupitem_i)
     log.info("Resource group items cloned.")
 
-    DBSession.add(cloned_scen)
-    DBSession.flush()
+    network_cache.invalidate(scen_i.network_id)
 
     log.info("Cloning finished.")
 
     return cloned_scen
 
-def _get_dataset_as_dict(rs, user_id):
-    if rs.dataset is None:
-        return None
-    
-    dataset = deepcopy(rs.dataset.__dict__)
+def _get_diff_qry(scenario_id_1, scenario_id_2):
+    """
+        Build the query which finds the data which differs between two
+        scenarios, as (resource_attr_id, dataset_id_1, dataset_id_2) ordered
+        by resource attribute. dataset_id_1 or dataset_id_2 is None where
+        only one of the scenarios has data for the resource attribute.
+
+        This is a full outer join of the data of the two scenarios on
+        resource_attr_id. Not all databases support full outer joins, so it
+        is done as the union of a left outer join with the data which is
+        only in scenario 2.
+    """
+    rs_1 = aliased(ResourceScenario)
+    rs_2 = aliased(ResourceScenario)
+    rs_3 = aliased(ResourceScenario)
 
+    in_scenario_2 = _get_resolved_rs_filter(scenario_id_2, rs_2)
 
-    del dataset['_sa_instance_state']
-    
-    try:
-        rs.dataset.check_read_permission(user_id)
-    except PermissionError:
-           dataset['value']      = None
-           dataset['frequency']  = None
-           dataset['start_time'] = None
-           dataset['metadata'] = []
-    
-    dataset['metadata'] = [_get_as_obj(m.__dict__, 'Metadata') for m in rs.dataset.metadata]
-    
-    return dataset
+    changed_qry = DBSession.query(rs_1.resource_attr_id.label('resource_attr_id'),
+                                  rs_1.dataset_id.label('dataset_id_1'),
+                                  rs_2.dataset_id.label('dataset_id_2')).outerjoin(rs_2,
+                                and_(rs_2.resource_attr_id==rs_1.resource_attr_id,
+                                     in_scenario_2)).filter(
+                                _get_resolved_rs_filter(scenario_id_1, rs_1),
+                                or_(rs_2.dataset_id==None,
+                                    rs_2.dataset_id!=rs_1.dataset_id))
+
+    in_scenario_1 = exists().where(and_(rs_3.resource_attr_id==rs_2.resource_attr_id,
+                                        _get_resolved_rs_filter(scenario_id_1, rs_3)))
+
+    only_2_qry = DBSession.query(rs_2.resource_attr_id.label('resource_attr_id'),
+                                 null().label('dataset_id_1'),
+                                 rs_2.dataset_id.label('dataset_id_2')).filter(
+                                in_scenario_2,
+                                ~in_scenario_1)
+
+    diff_qry = changed_qry.union_all(only_2_qry)
 
-def _get_as_obj(obj_dict, name):
+    return diff_qry, rs_1.resource_attr_id
+
+def _make_resourcescenario_diffs(diff_rows, summary, user_id):
     """
-        Turn a dictionary into a named tuple so it can be
-        passed into the constructor of a complex model generator.
+        Turn rows of the diff query into resource scenario diffs. Unless
+        only a summary is wanted, the datasets are retrieved together, and
+        only for the data which differs.
     """
-    if obj_dict.get('_sa_instance_state'):
-        del obj_dict['_sa_instance_state']
-    obj = namedtuple(name, tuple(obj_dict.keys()))
-    for k, v in obj_dict.items():
-        setattr(obj, k, v)
-        log.info("%s = %s",k,getattr(obj,k))
-    return obj
-
+    datasets = {}
+    if summary != 'Y':
+        dataset_ids = set()
+        for row in diff_rows:
+            dataset_ids.add(row.dataset_id_1)
+            dataset_ids.add(row.dataset_id_2)
+        dataset_ids.discard(None)
 
-def compare_scenarios(scenario_id_1, scenario_id_2,**kwargs):
-    user_id = kwargs.get('user_id')
+        for d in data.get_datasets(list(dataset_ids), user_id=user_id):
+            datasets[d.dataset_id] = d
 
+    resource_diffs = []
+    for row in diff_rows:
+        resource_diffs.append(dict(
+            resource_attr_id      = row.resource_attr_id,
+            scenario_1_dataset_id = row.dataset_id_1,
+            scenario_2_dataset_id = row.dataset_id_2,
+            scenario_1_dataset    = datasets.get(row.dataset_id_1),
+            scenario_2_dataset    = datasets.get(row.dataset_id_2),
+        ))
+    return resource_diffs
+
+def _check_comparable(scenario_id_1, scenario_id_2, user_id):
+    """
+        Check that two scenarios are in the same network,
+        and that the user can read it.
+    """
     scenario_1 = _get_scenario(scenario_id_1)
     scenario_2 = _get_scenario(scenario_id_2)
 
@@ -388,77 +610,68 @@ def compare_scenarios(scenario_id_1, scenario_id_2,**kwargs):
         raise HydraError("Cannot compare scenarios that are not"
                          " in the same network!")
 
+    scenario_1.network.check_read_permission(user_id)
+
+def _get_group_items(scenario_id):
+    return DBSession.query(ResourceGroupItem.group_id,
+                           ResourceGroupItem.ref_key,
+                           ResourceGroupItem.node_id,
+                           ResourceGroupItem.link_id,
+                           ResourceGroupItem.subgroup_id).filter(
+                        ResourceGroupItem.scenario_id==scenario_id).all()
+
+def compare_scenarios(scenario_id_1, scenario_id_2, summary='N',
+                      last_resource_attr_id=None, page_size=None, **kwargs):
+    """
+        Compare the data and the resource group items of two scenarios
+        in the same network. The data is compared in the database, and
+        only the datasets which differ are retrieved.
+
+        summary: If 'Y', only the IDs of the datasets which differ are
+                 returned, not the datasets themselves.
+        last_resource_attr_id, page_size: Return page_size differences, starting
+                 after the given resource attribute, as get_all_resource_data does.
+
+        When the differences are summarised or paged, num_resourcescenarios
+        is the total number of differences.
+    """
+    user_id = kwargs.get('user_id')
+
+    _check_comparable(scenario_id_1, scenario_id_2, user_id)
+
     scenariodiff = dict(
        object_type = 'ScenarioDiff' 
     ) 
-    resource_diffs = []
 
-    #Make a list of all the resource scenarios (aka data) that are unique
-    #to scenario 1 and that are in both scenarios, but are not the same.
-
-    #For efficiency, build a dictionary of the data in scenarios and refer
-    #them rather than nesting for loops.
-    r_scen_1_dict = dict()
-    r_scen_2_dict = dict()
-    for s1_rs in scenario_1.resourcescenarios:
-        r_scen_1_dict[s1_rs.resource_attr_id] = s1_rs
-    for s2_rs in scenario_2.resourcescenarios:
-        r_scen_2_dict[s2_rs.resource_attr_id] = s2_rs
-
-    rscen_1_dataset_ids = set([r_scen.dataset_id for r_scen in scenario_1.resourcescenarios])
-    rscen_2_dataset_ids = set([r_scen.dataset_id for r_scen in scenario_2.resourcescenarios])
-
-    log.info("Datasets In 1 not in 2: %s"%(rscen_1_dataset_ids - rscen_2_dataset_ids))
-    log.info("Datasets In 2 not in 1: %s"%(rscen_2_dataset_ids - rscen_1_dataset_ids))
-
-    for ra_id, s1_rs in r_scen_1_dict.items():
-        s2_rs = r_scen_2_dict.get(ra_id)
-        if s2_rs is not None:
-            log.debug("Is %s == %s?"%(s1_rs.dataset_id, s2_rs.dataset_id))
-            if s1_rs.dataset_id != s2_rs.dataset_id:
-                resource_diff = dict( 
-                    resource_attr_id = s1_rs.resource_attr_id,
-                    scenario_1_dataset = _get_as_obj(_get_dataset_as_dict(s1_rs, user_id), 'Dataset'),
-                    scenario_2_dataset = _get_as_obj(_get_dataset_as_dict(s2_rs, user_id), 'Dataset'),
-                )
-                resource_diffs.append(resource_diff)
+    diff_qry, ra_id_col = _get_diff_qry(scenario_id_1, scenario_id_2)
 
-            continue
-        else:
-            resource_diff = dict( 
-                resource_attr_id = s1_rs.resource_attr_id,
-                scenario_1_dataset = _get_as_obj(_get_dataset_as_dict(s1_rs, user_id), 'Dataset'),
-                scenario_2_dataset = None,
-            )
-            resource_diffs.append(resource_diff)
-
-    #make a list of all the resource scenarios (aka data) that are unique
-    #in scenario 2.
-    for ra_id, s2_rs in r_scen_2_dict.items():
-        s1_rs = r_scen_1_dict.get(ra_id)
-        if s1_rs is None:
-            resource_diff = dict( 
-                resource_attr_id = s1_rs.resource_attr_id,
-                scenario_1_dataset = None,
-                scenario_2_dataset = _get_as_obj(_get_dataset_as_dict(s2_rs, user_id), 'Dataset'),
-            )
-            resource_diffs.append(resource_diff)
+    if summary == 'Y' or page_size is not None:
+        scenariodiff['num_resourcescenarios'] = diff_qry.count()
+
+    if last_resource_attr_id is not None:
+        diff_qry = diff_qry.filter(ra_id_col > last_resource_attr_id)
+
+    diff_qry = diff_qry.order_by(ra_id_col)
+
+    if page_size is not None:
+        diff_qry = diff_qry.limit(page_size)
+
+    diff_rows = diff_qry.all()
 
-    scenariodiff['resourcescenarios'] = resource_diffs
+    log.info("%s differences found between scenarios %s and %s",
+             len(diff_rows), scenario_id_1, scenario_id_2)
+
+    scenariodiff['resourcescenarios'] = _make_resourcescenario_diffs(diff_rows, summary, user_id)
 
     #Now compare groups.
     #Return list of group items in scenario 1 not in scenario 2 and vice versa
-    s1_items = []
-    for s1_item in scenario_1.resourcegroupitems:
-        s1_items.append((s1_item.group_id, s1_item.ref_key, s1_item.node_id, s1_item.link_id, s1_item.subgroup_id))
-    s2_items = []
-    for s2_item in scenario_2.resourcegroupitems:
-        s2_items.append((s2_item.group_id, s2_item.ref_key, s2_item.node_id, s2_item.link_id, s2_item.subgroup_id))
+    s1_items = set(_get_group_items(scenario_id_1))
+    s2_items = set(_get_group_items(scenario_id_2))
 
     groupdiff = dict()
     scenario_1_items = []
     scenario_2_items = []
-    for s1_only_item in set(s1_items) - set(s2_items):
+    for s1_only_item in s1_items - s2_items:
         
         item = ResourceGroupItem(
             group_id = s1_only_item[0],
@@ -468,7 +681,7 @@ def compare_scenarios(scenario_id_1, scenario_id_2,**kwargs):
             subgroup_id   = s1_only_item[4],
         )
         scenario_1_items.append(item)
-    for s2_only_item in set(s2_items) - set(s1_items):
+    for s2_only_item in s2_items - s1_items:
         item = ResourceGroupItem(
             group_id = s2_only_item[0],
             ref_key  = s2_only_item[1],
@@ -484,6 +697,166 @@ def compare_scenarios(scenario_id_1, scenario_id_2,**kwargs):
 
     return scenariodiff
 
+def compare_scenarios_stream(scenario_id_1, scenario_id_2, summary='N', chunk_size=None, **kwargs):
+    """
+        Return a generator of the differences between the data of two
+        scenarios, as returned by compare_scenarios. The differences are
+        found a page at a time, so scenarios of any size can be compared
+        in constant memory.
+
+        chunk_size: The number of differences in each page.
+                    Defaults to the 'stream_chunk_size' setting in the config.
+    """
+    if chunk_size is None:
+        chunk_size = config.getint('db', 'stream_chunk_size', 500)
+
+    if chunk_size < 1:
+        raise HydraError("%s is not a valid chunk size."%chunk_size)
+
+    _check_comparable(scenario_id_1, scenario_id_2, kwargs.get('user_id'))
+
+    return _generate_resourcescenario_diffs(scenario_id_1, scenario_id_2, summary,
+                                            chunk_size, kwargs.get('user_id'))
+
+def _generate_resourcescenario_diffs(scenario_id_1, scenario_id_2, summary, chunk_size, user_id):
+    """
+        Generator which does the work for compare_scenarios_stream
+    """
+    num_rows = 0
+    last_resource_attr_id = None
+    while True:
+        diff_qry, ra_id_col = _get_diff_qry(scenario_id_1, scenario_id_2)
+        if last_resource_attr_id is not None:
+            diff_qry = diff_qry.filter(ra_id_col > last_resource_attr_id)
+        rows = diff_qry.order_by(ra_id_col).limit(chunk_size).all()
+
+        if len(rows) == 0:
+            break
+
+        for resource_diff in _make_resourcescenario_diffs(rows, summary, user_id):
+            yield resource_diff
+
+        num_rows = num_rows + len(rows)
+        last_resource_attr_id = rows[-1].resource_attr_id
+
+        if len(rows) < chunk_size:
+            break
+
+    log.info("%s differences streamed between scenarios %s and %s",
+             num_rows, scenario_id_1, scenario_id_2)
+
+def _get_scenario_matrix_qry(scenarios, attr_ids=None, type_ids=None):
+    """
+        Build the query of (resource_attr_id, attr_id, scenario_id, dataset_id)
+        for the data of several scenarios, ordered by resource attribute.
+        Scenarios without a parent are selected together. The data of a child
+        scenario is resolved from its ancestors, so each child needs a separate
+        branch of a union.
+    """
+    conditions = _get_resource_attr_filter(attr_ids, type_ids)
+
+    branches = []
+
+    root_ids = [s.scenario_id for s in scenarios if s.parent_id is None]
+    if len(root_ids) > 0:
+        branches.append(DBSession.query(ResourceScenario.resource_attr_id.label('resource_attr_id'),
+                                        ResourceAttr.attr_id.label('attr_id'),
+                                        ResourceScenario.scenario_id.label('scenario_id'),
+                                        ResourceScenario.dataset_id.label('dataset_id')).join(
+                        ResourceAttr, ResourceAttr.resource_attr_id==ResourceScenario.resource_attr_id).filter(
+                        ResourceScenario.scenario_id.in_(root_ids), *conditions))
+
+    for s in scenarios:
+        if s.parent_id is None:
+            continue
+        rs = aliased(ResourceScenario)
+        branches.append(DBSession.query(rs.resource_attr_id.label('resource_attr_id'),
+                                        ResourceAttr.attr_id.label('attr_id'),
+                                        literal(s.scenario_id, Integer).label('scenario_id'),
+                                        rs.dataset_id.label('dataset_id')).join(
+                        ResourceAttr, ResourceAttr.resource_attr_id==rs.resource_attr_id).filter(
+                        _get_resolved_rs_filter(s.scenario_id, rs), *conditions))
+
+    if len(branches) == 1:
+        return branches[0].subquery()
+    return branches[0].union_all(*branches[1:]).subquery()
+
+def get_scenario_matrix(scenario_ids, attr_ids=None, type_ids=None, only_differences='N', **kwargs):
+    """
+        Compare the data of several scenarios in the same network at once.
+        For each resource attribute, return the dataset it has in each scenario,
+        in the same order as scenario_ids (None where it has no data in a
+        scenario), and the distinct datasets it has in all of them.
+
+          attr_ids:  only compare the data of these attributes.
+          type_ids:  only compare the data of resources which have one of these types.
+          only_differences: If 'Y', only return the resource attributes which
+                     do not have the same dataset in all the scenarios.
+    """
+    if scenario_ids is None or len(scenario_ids) == 0:
+        raise HydraError("No scenarios specified.")
+
+    #Ignore repeated scenarios, keeping the order.
+    scenario_ids = OrderedDict.fromkeys(scenario_ids).keys()
+
+    scenarios = DBSession.query(Scenario.scenario_id,
+                                Scenario.network_id,
+                                Scenario.parent_id).filter(
+                        Scenario.scenario_id.in_(scenario_ids)).all()
+
+    missing_ids = set(scenario_ids) - set([s.scenario_id for s in scenarios])
+    if len(missing_ids) > 0:
+        raise ResourceNotFoundError("Scenarios %s not found"%(sorted(missing_ids),))
+
+    if len(set([s.network_id for s in scenarios])) > 1:
+        raise HydraError("Cannot compare scenarios that are not"
+                         " in the same network!")
+
+    _get_scenario(scenarios[0].scenario_id).network.check_read_permission(kwargs.get('user_id'))
+
+    data_sq = _get_scenario_matrix_qry(scenarios, attr_ids, type_ids)
+
+    matrix_qry = DBSession.query(data_sq.c.resource_attr_id,
+                                 data_sq.c.attr_id,
+                                 data_sq.c.scenario_id,
+                                 data_sq.c.dataset_id)
+
+    if only_differences == 'Y':
+        #Resource attributes which have more than one dataset,
+        #or which do not have data in every scenario.
+        different_qry = DBSession.query(data_sq.c.resource_attr_id).group_by(
+                            data_sq.c.resource_attr_id).having(or_(
+                            func.count(distinct(data_sq.c.dataset_id)) > 1,
+                            func.count(data_sq.c.scenario_id) < len(scenario_ids)))
+        matrix_qry = matrix_qry.filter(data_sq.c.resource_attr_id.in_(different_qry.subquery()))
+
+    matrix_qry = matrix_qry.order_by(data_sq.c.resource_attr_id)
+
+    positions = dict((scenario_id, i) for i, scenario_id in enumerate(scenario_ids))
+
+    matrix_rows = []
+    row = None
+    for rs in matrix_qry.all():
+        if row is None or row['resource_attr_id'] != rs.resource_attr_id:
+            row = dict(
+                resource_attr_id = rs.resource_attr_id,
+                attr_id          = rs.attr_id,
+                dataset_ids      = [None] * len(scenario_ids),
+            )
+            matrix_rows.append(row)
+        row['dataset_ids'][positions[rs.scenario_id]] = rs.dataset_id
+
+    for row in matrix_rows:
+        row['distinct_dataset_ids'] = sorted(set([d for d in row['dataset_ids'] if d is not None]))
+
+    log.info("Compared %s resource attributes in %s scenarios",
+             len(matrix_rows), len(scenario_ids))
+
+    return dict(
+        scenario_ids = scenario_ids,
+        rows         = matrix_rows,
+    )
+
 def _check_network_owner(network, user_id):
     for owner in network.owners:
         if owner.user_id == int(user_id):
@@ -503,6 +876,7 @@ def lock_scenario(scenario_id, **kwargs):
         scenario_i.locked = 'Y'
     else:
         raise PermissionError('User %s cannot lock scenario %s' % (kwargs['user_id'], scenario_id))
+    network_cache.invalidate(scenario_i.network_id)
     DBSession.flush()
     return 'OK'
 
@@ -516,6 +890,7 @@ def unlock_scenario(scenario_id, **kwargs):
         scenario_i.locked = 'N'
     else:
         raise PermissionError('User %s cannot unlock scenario %s' % (kwargs['user_id'], scenario_id))
+    network_cache.invalidate(scenario_i.network_id)
     DBSession.flush()
     return 'OK'
 
@@ -551,19 +926,17 @@ def bulk_update_resourcedata(scenario_ids, resource_scenarios,**kwargs):
     if len(set(net_ids)) != 1:
         raise HydraError("Scenario IDS are not in the same network")
 
+    network_cache.invalidate(net_ids[0].network_id)
+
     for scenario_id in scenario_ids:
         _check_can_edit_scenario(scenario_id, kwargs['user_id'])
 
-        scen_i = _get_scenario(scenario_id)
-        res[scenario_id] = []
-        for rs in resource_scenarios:
-            if rs.value is not None:
-                updated_rs = _update_resourcescenario(scen_i, rs, user_id=user_id, source=kwargs.get('app_name'))
-                res[scenario_id].append(updated_rs)
-            else:
-                _delete_resourcescenario(scenario_id, rs)
+    res = _bulk_update_resourcescenarios(scenario_ids,
+                                         resource_scenarios,
+                                         user_id=user_id,
+                                         source=kwargs.get('app_name'))
 
-        DBSession.flush()
+    DBSession.flush()
 
     return res
 
@@ -591,15 +964,185 @@ def update_resourcedata(scenario_id, resource_scenarios,**kwargs):
 
     scen_i = _get_scenario(scenario_id)
     
-    res = []
+    res = _bulk_update_resourcescenarios([scenario_id],
+                                         resource_scenarios,
+                                         user_id=user_id,
+                                         source=kwargs.get('app_name'))
+
+    network_cache.invalidate(scen_i.network_id)
+    DBSession.flush()
+
+    return res[scenario_id]
+
+def _get_existing_resourcescenarios(scenario_ids, resource_attr_ids):
+    """
+        Get the dataset_id and data_hash of the resource scenarios of
+        the given resource attributes in the given scenarios, keyed on
+        (scenario_id, resource_attr_id).
+    """
+    existing = {}
+    for i in range(0, len(resource_attr_ids), data.qry_in_threshold):
+        rs_qry = DBSession.query(ResourceScenario.scenario_id,
+                                 ResourceScenario.resource_attr_id,
+                                 ResourceScenario.dataset_id,
+                                 Dataset.data_hash).filter(
+                        ResourceScenario.scenario_id.in_(scenario_ids),
+                        ResourceScenario.resource_attr_id.in_(resource_attr_ids[i:i+data.qry_in_threshold]),
+                        Dataset.dataset_id==ResourceScenario.dataset_id)
+        for rs in rs_qry.all():
+            existing[(rs.scenario_id, rs.resource_attr_id)] = (rs.dataset_id, rs.data_hash)
+    return existing
+
+def _get_dataset_ref_counts(dataset_ids):
+    """
+        Get the number of resource scenarios using each of the given datasets.
+    """
+    ref_counts = {}
+    dataset_ids = list(dataset_ids)
+    for i in range(0, len(dataset_ids), data.qry_in_threshold):
+        count_qry = DBSession.query(ResourceScenario.dataset_id,
+                                    func.count(ResourceScenario.resource_attr_id)).filter(
+                        ResourceScenario.dataset_id.in_(dataset_ids[i:i+data.qry_in_threshold])).group_by(
+                        ResourceScenario.dataset_id)
+        for dataset_id, count in count_qry.all():
+            ref_counts[dataset_id] = count
+    return ref_counts
+
+def _get_existing_hashes(data_hashes):
+    existing_hashes = set()
+    data_hashes = list(data_hashes)
+    for i in range(0, len(data_hashes), data.qry_in_threshold):
+        for d in DBSession.query(Dataset.data_hash).filter(
+                        Dataset.data_hash.in_(data_hashes[i:i+data.qry_in_threshold])).all():
+            existing_hashes.add(d.data_hash)
+    return existing_hashes
+
+def _bulk_update_resourcescenarios(scenario_ids, resource_scenarios, user_id=None, source=None):
+    """
+        Set the data of resource attributes in one or more scenarios using a
+        fixed number of queries, rather than several for each resource scenario.
+
+        This follows the same rules as _update_resourcescenario and
+        assign_value: resource scenarios with a value of None are deleted;
+        unchanged values are left alone; a dataset used only by the resource
+        scenario being updated is updated in place and all other values are
+        added with the bulk insert in data, which reuses existing datasets.
+
+        Returns a dictionary of scenario_id -> list of ResourceScenarios, in
+        the order they were passed in, with None for values which could not be parsed.
+    """
+    get_timing = lambda x: datetime.datetime.now() - x
+    start_time = datetime.datetime.now()
+
+    #If a resource attribute is given more than once, the last value is used.
+    incoming = OrderedDict()
     for rs in resource_scenarios:
-        if rs.value is not None:
-            updated_rs = _update_resourcescenario(scen_i, rs, user_id=user_id, source=kwargs.get('app_name'))
-            res.append(updated_rs)
+        incoming[rs.resource_attr_id] = rs
+
+    to_delete = [ra_id for ra_id, rs in incoming.items() if rs.value is None]
+    to_set    = [rs for rs in incoming.values() if rs.value is not None]
+
+    existing = _get_existing_resourcescenarios(scenario_ids, incoming.keys())
+
+    for scenario_id in scenario_ids:
+        for ra_id in to_delete:
+            if (scenario_id, ra_id) not in existing:
+                raise HydraError("ResourceAttr %s does not exist in scenario %s."%(ra_id, scenario_id))
+
+    new_data = data._process_incoming_data([rs.value for rs in to_set], user_id, source)
+    parsed = set([rs.resource_attr_id for rs in to_set
+                  if getattr(rs.value, 'data_hash', None) in new_data])
+
+    ref_counts = _get_dataset_ref_counts(set([dataset_id for dataset_id, data_hash in existing.values()]))
+    used_hashes = _get_existing_hashes(new_data.keys())
+
+    log.info("Existing data retrieved in %s", get_timing(start_time))
+
+    #dataset_id -> new dataset dictionary, for datasets updated in place.
+    in_place = {}
+    #((scenario_id, resource_attr_id), incoming dataset) for values to be inserted.
+    to_insert = []
+    for scenario_id in scenario_ids:
+        for rs in to_set:
+            if rs.resource_attr_id not in parsed:
+                log.info("Cannot set data on resource attribute %s", rs.resource_attr_id)
+                continue
+            data_hash = rs.value.data_hash
+            key = (scenario_id, rs.resource_attr_id)
+
+            if key in existing:
+                dataset_id, current_hash = existing[key]
+                if current_hash == data_hash:
+                    continue
+                #Only this resource scenario uses the dataset, so it can be changed
+                #without affecting anything else.
+                if ref_counts.get(dataset_id) == 1 and dataset_id not in in_place\
+                   and data_hash not in used_hashes:
+                    in_place[dataset_id] = new_data[data_hash]
+                    used_hashes.add(data_hash)
+                    continue
+
+            to_insert.append((key, rs.value))
+
+    data._update_datasets(in_place)
+
+    datasets = data._insert_processed_data([d for _, d in to_insert], new_data, user_id)
+
+    log.info("%s datasets updated and %s inserted in %s",
+             len(in_place), len(to_insert), get_timing(start_time))
+
+    rs_table = ResourceScenario.__table__
+    rs_updates = []
+    rs_inserts = []
+    for (key, d), dataset in zip(to_insert, datasets):
+        scenario_id, ra_id = key
+        if key in existing:
+            rs_updates.append(dict(b_scenario_id      = scenario_id,
+                                   b_resource_attr_id = ra_id,
+                                   b_dataset_id       = dataset.dataset_id,
+                                   b_source           = source))
         else:
-            _delete_resourcescenario(scenario_id, rs)
+            rs_inserts.append(dict(scenario_id      = scenario_id,
+                                   resource_attr_id = ra_id,
+                                   dataset_id       = dataset.dataset_id,
+                                   source           = source))
+
+    if len(rs_updates) > 0:
+        DBSession.execute(rs_table.update().where(and_(
+                    rs_table.c.scenario_id==bindparam('b_scenario_id'),
+                    rs_table.c.resource_attr_id==bindparam('b_resource_attr_id'))).values(
+                    dataset_id=bindparam('b_dataset_id'),
+                    source=bindparam('b_source')), rs_updates)
+
+    if len(rs_inserts) > 0:
+        DBSession.execute(rs_table.insert(), rs_inserts)
+
+    for i in range(0, len(to_delete), data.qry_in_threshold):
+        DBSession.execute(rs_table.delete().where(and_(
+                    rs_table.c.scenario_id.in_(scenario_ids),
+                    rs_table.c.resource_attr_id.in_(to_delete[i:i+data.qry_in_threshold]))))
+
+    log.info("%s resource scenarios updated, %s inserted and %s deleted in %s",
+             len(rs_updates), len(rs_inserts), len(to_delete)*len(scenario_ids),
+             get_timing(start_time))
+
+    #Load the resource scenarios to return them, replacing any old
+    #versions which are already in the session.
+    updated_rs = {}
+    parsed_ids = list(parsed)
+    for i in range(0, len(parsed_ids), data.qry_in_threshold):
+        rs_qry = DBSession.query(ResourceScenario).options(
+                        joinedload('dataset'), joinedload('resourceattr')).filter(
+                        ResourceScenario.scenario_id.in_(scenario_ids),
+                        ResourceScenario.resource_attr_id.in_(parsed_ids[i:i+data.qry_in_threshold])
+                        ).populate_existing()
+        for rs_i in rs_qry.all():
+            updated_rs[(rs_i.scenario_id, rs_i.resource_attr_id)] = rs_i
 
-    DBSession.flush()
+    res = {}
+    for scenario_id in scenario_ids:
+        res[scenario_id] = [updated_rs.get((scenario_id, rs.resource_attr_id))
+                            for rs in resource_scenarios if rs.value is not None]
 
     return res
 
@@ -612,6 +1155,8 @@ def delete_resourcedata(scenario_id, resource_scenario,**kwargs):
 
     _delete_resourcescenario(scenario_id, resource_scenario)
 
+    _invalidate_network_cache(scenario_id)
+
 
 def _delete_resourcescenario(scenario_id, resource_scenario):
 
@@ -797,6 +1342,7 @@ def add_data_to_attribute(scenario_id, resource_attr_id, dataset,**kwargs):
     assign_value(r_scen_i, data_type, value, dataset.unit, dataset.name, dataset.dimension,
                           metadata=dataset_metadata, data_hash=data_hash, user_id=user_id)
 
+    network_cache.invalidate(scenario_i.network_id)
     DBSession.flush()
     return r_scen_i
 
@@ -807,7 +1353,7 @@ def get_scenario_data(scenario_id,**kwargs):
     """
     user_id = kwargs.get('user_id')
 
-    scenario_data = DBSession.query(Dataset).filter(Dataset.dataset_id==ResourceScenario.dataset_id, ResourceScenario.scenario_id==scenario_id).options(joinedload_all('metadata')).distinct().all()
+    scenario_data = DBSession.query(Dataset).filter(Dataset.dataset_id==ResourceScenario.dataset_id, _get_resolved_rs_filter(scenario_id)).options(joinedload_all('metadata')).distinct().all()
     
     for sd in scenario_data:
        if sd.hidden == 'Y':
@@ -887,10 +1433,7 @@ def get_resource_data(ref_key, ref_id, scenario_id, type_id,**kwargs):
     resource_data = resource_data_qry.all()
 
     for rs in resource_data:
-        try:
-            rs.dataset.value = zlib.decompress(rs.dataset.value)
-        except:
-            pass
+        rs.dataset.value = decompress_value(rs.dataset.value)
 
         if rs.dataset.hidden == 'Y':
            try:
@@ -999,6 +1542,7 @@ def update_value_from_mapping(source_resource_attr_id, target_resource_attr_id,
         if rs2 is not None:
             DBSession.delete(rs2)
 
+    network_cache.invalidate(s2.network_id)
     DBSession.flush()
     return return_value
 
@@ -17,6 +17,7 @@ from HydraLib.HydraException import HydraError, ResourceNotFoundError
 import logging
 log = logging.getLogger(__name__)
 from HydraServer.db import DBSession
+from HydraServer.util.cache import network_cache
 from HydraServer.db.model import Network, Project, User, Dataset
 from sqlalchemy.orm.exc import NoResultFound
 
@@ -222,6 +223,7 @@ def hide_dataset(dataset_id, exceptions, read, write, share,**kwargs):
         for username in exceptions:
             user_i = _get_user(username)
             dataset_i.set_owner(user_i.user_id, read=read, write=write, share=share)
+    network_cache.invalidate_all()
     DBSession.flush()
 
 def unhide_dataset(dataset_id,**kwargs):
@@ -243,4 +245,5 @@ def unhide_dataset(dataset_id,**kwargs):
                         %(user_id, dataset_i.data_name))
 
     dataset_i.hidden = 'N'
+    network_cache.invalidate_all()
     DBSession.flush()
@@ -14,8 +14,10 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 from HydraServer.db import DBSession
-from HydraServer.db.model import Template, TemplateType, TypeAttr, Attr, Network, Node, Link, ResourceGroup, ResourceType, ResourceAttr, ResourceScenario, Scenario
+from HydraServer.db.model import Template, TemplateType, TypeAttr, Attr, Network, Node, Link, ResourceGroup, ResourceType, ResourceAttr, ResourceScenario, Scenario, Dataset
 from data import add_dataset
+from HydraServer.util.cache import network_cache
+from HydraServer.util import validation
 
 from HydraLib.HydraException import HydraError, ResourceNotFoundError
 from HydraLib import config, util
@@ -23,9 +25,11 @@ from lxml import etree
 from decimal import Decimal
 import logging
 from sqlalchemy.orm.exc import NoResultFound
-from sqlalchemy.orm import joinedload_all, noload
+from sqlalchemy.orm import joinedload_all
 from sqlalchemy import or_, and_
 import re
+import time
+from collections import OrderedDict
 import units
 log = logging.getLogger(__name__)
 
@@ -319,6 +323,8 @@ def upload_template_xml(template_xml,**kwargs):
         for attribute in resource.findall('attribute'):
             parse_typeattr(type_i, attribute)
 
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.flush()
 
     return tmpl_i
@@ -330,6 +336,7 @@ def apply_template_to_network(template_id, network_id, **kwargs):
     """
 
     net_i = DBSession.query(Network).filter(Network.network_id==network_id).one()
+    network_cache.invalidate(network_id)
     #There should only ever be one matching type, but if there are more,
     #all we can do is pick the first one.
     try: 
@@ -375,6 +382,8 @@ def remove_template_from_network(network_id, template_id, remove_attrs, **kwargs
     except NoResultFound:
         raise HydraError("Template %s not found"%template_id)
 
+    network_cache.invalidate(network_id)
+
     type_ids = [tmpltype.type_id for tmpltype in template.templatetypes] 
     
     node_ids = [n.node_id for n in network.nodes]
@@ -506,6 +515,8 @@ def assign_types_to_resources(resource_types,**kwargs):
         elif ref_key == 'GROUP':
             resource = groups[ref_id]
 
+        network_cache.invalidate(resource.network_id)
+
         ra, rt = set_resource_type(resource, type_id, types)
         if rt is not None:
             res_types.append(rt)
@@ -694,6 +705,8 @@ def assign_type_to_resource(type_id, resource_type, resource_id,**kwargs):
         resource = DBSession.query(ResourceGroup).filter(ResourceGroup.group_id==resource_id).one()
     res_attrs, res_type = set_resource_type(resource, type_id, **kwargs)
 
+    network_cache.invalidate(resource.network_id)
+
     type_i = DBSession.query(TemplateType).filter(TemplateType.type_id==type_id).one()
     if resource_type != type_i.resource_type:
         raise HydraError("Cannot assign a %s type to a %s"%
@@ -795,6 +808,7 @@ def remove_type_from_resource( type_id, resource_type, resource_id,**kwargs):
     ResourceType.link_id == link_id,
     ResourceType.group_id == group_id).one() 
 
+    network_cache.invalidate_all()
     DBSession.delete(resourcetype) 
 
 def _parse_data_restriction(restriction_dict):
@@ -859,6 +873,8 @@ def update_template(template,**kwargs):
             else:
                 _update_templatetype(templatetype)
 
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.flush()
  
     return tmpl
@@ -871,6 +887,8 @@ def delete_template(template_id,**kwargs):
         tmpl = DBSession.query(Template).filter(Template.template_id==template_id).one()
     except NoResultFound:
         raise ResourceNotFoundError("Template %s not found"%(template_id,))
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.delete(tmpl)
     return tmpl
 
@@ -890,6 +908,8 @@ def remove_attr_from_type(type_id, attr_id,**kwargs):
     """
     typeattr_i = DBSession.query(TypeAttr).filter(TypeAttr.type_id==type_id,
                                                   TypeAttr.attr_id==attr_id).one()
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.delete(typeattr_i)
 
 def get_template(template_id,**kwargs):
@@ -934,6 +954,8 @@ def update_templatetype(templatetype,**kwargs):
 
     _update_templatetype(templatetype, tmpltype_i)
 
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.flush()
 
     return tmpltype_i
@@ -1043,6 +1065,8 @@ def delete_templatetype(type_id,**kwargs):
         tmpltype = DBSession.query(TemplateType).filter(TemplateType.type_id == type_id).one()
     except NoResultFound:
         raise ResourceNotFoundError("Template Type %s not found"%(type_id,))
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.delete(tmpltype)
     DBSession.flush()
 
@@ -1073,6 +1097,8 @@ def add_typeattr(typeattr,**kwargs):
     
     ta = _set_typeattr(typeattr)
     
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.flush()
 
     updated_template_type = DBSession.query(TemplateType).filter(TemplateType.type_id==ta.type_id).one()
@@ -1086,143 +1112,297 @@ def delete_typeattr(typeattr,**kwargs):
     """
     ta = DBSession.query(TypeAttr).filter(TypeAttr.type_id == typeattr.type_id,
                                           TypeAttr.attr_id == typeattr.attr_id).one()
+    network_cache.invalidate_all()
+    _validators.clear()
     DBSession.delete(ta)
 
     return 'OK'
 
-def validate_attr(resource_attr_id, scenario_id, template_id=None):
-    """
-        Check that a resource attribute satisfies the requirements of all the types of the 
-        resource.
-    """
-    rs = DBSession.query(ResourceScenario).\
-                        filter(ResourceScenario.resource_attr_id==resource_attr_id, 
-        ResourceScenario.scenario_id==scenario_id).options(
-        joinedload_all("resourceattr")).options(
-        joinedload_all("dataset")
-        ).one()
-
-    error = None
-    
-    try:
-        _do_validate_resourcescenario(rs, template_id)
-    except HydraError, e:
-
-        error = dict(
-                 ref_key = rs.resourceattr.ref_key,
-                 ref_id  = rs.resourceattr.get_resource_id(),
-                 ref_name = rs.resourceattr.get_resource().get_name(),
-                 resource_attr_id = rs.resource_attr_id,
-                 attr_id          = rs.resourceattr.attr.attr_id,
-                 attr_name        = rs.resourceattr.attr.attr_name,
-                 dataset_id       = rs.dataset_id,
-                 scenario_id=scenario_id,
-                 template_id=template_id,
-                 error_text=e.message)
-    return error
+#Compiled data restrictions, keyed on (type_id, attr_id). Each is kept with the
+#restriction it was compiled from, so a restriction changed in another server
+#process is recompiled rather than used.
+_validators = {}
 
-def validate_attrs(resource_attr_ids, scenario_id, template_id=None):
+def _get_validator(typeattr):
     """
-        Check that multiple resource attribute satisfy the requirements of the types of resources to
-        which the they are attached.
+        Get the compiled data restriction of a type attribute.
     """
-    multi_rs = DBSession.query(ResourceScenario).\
-                            filter(ResourceScenario.resource_attr_id.in_(resource_attr_ids),\
-                                   ResourceScenario.scenario_id==scenario_id).\
-                                   options(joinedload_all("resourceattr")).\
-                                   options(joinedload_all("dataset")).all()
-        
-    errors = []
-    for rs in multi_rs:
-        try:
-            _do_validate_resourcescenario(rs, template_id)
-        except HydraError, e:
+    key = (typeattr.type_id, typeattr.attr_id)
+    entry = _validators.get(key)
+    if entry is None or entry[0] != typeattr.data_restriction:
+        log.info("Compiling data restriction %s", typeattr.data_restriction)
+        validator = util.CompiledRestriction(eval(typeattr.data_restriction))
+        entry = (typeattr.data_restriction, validator)
+        _validators[key] = entry
+    return entry[1]
 
-            error = dict(
-                     ref_key = rs.resourceattr.ref_key,
-                     ref_id  = rs.resourceattr.get_resource_id(),
-                     ref_name = rs.resourceattr.get_resource().get_name(),
-                     resource_attr_id = rs.resource_attr_id,
-                     attr_id          = rs.resourceattr.attr.attr_id,
-                     attr_name        = rs.resourceattr.attr.attr_name,
-                     dataset_id       = rs.dataset_id,
-                     scenario_id=scenario_id,
-                     template_id=template_id,
-                     error_text=e.message)
-            errors.append(error)
-                    
+#The column of each kind of resource in tResourceAttr and tResourceType
+_ref_columns = dict(NETWORK='network_id', NODE='node_id', LINK='link_id', GROUP='group_id')
+
+def _get_resource_id(row):
+    column = _ref_columns.get(row.ref_key)
+    if column is None:
+        return None
+    return getattr(row, column)
+
+def _query_network_resources(qry, resource_cls, network_id):
+    """
+        Split a query on tResourceAttr or tResourceType into
+        one query for each kind of resource in a network.
+    """
+    return [
+        qry.filter(resource_cls.ref_key=='NETWORK', resource_cls.network_id==network_id),
+        qry.filter(resource_cls.ref_key=='NODE', Node.node_id==resource_cls.node_id,
+                   Node.network_id==network_id),
+        qry.filter(resource_cls.ref_key=='LINK', Link.link_id==resource_cls.link_id,
+                   Link.network_id==network_id),
+        qry.filter(resource_cls.ref_key=='GROUP', ResourceGroup.group_id==resource_cls.group_id,
+                   ResourceGroup.network_id==network_id),
+    ]
+
+def _get_network_resource_types(network_id):
+    """
+        Get the types of all the resources in a network.
+        Returns a dictionary of (ref_key, resource_id) -> [type_id, ...]
+    """
+    qry = DBSession.query(ResourceType.ref_key,
+                          ResourceType.network_id,
+                          ResourceType.node_id,
+                          ResourceType.link_id,
+                          ResourceType.group_id,
+                          ResourceType.type_id).order_by(ResourceType.resource_type_id)
+
+    resource_types = {}
+    for resource_qry in _query_network_resources(qry, ResourceType, network_id):
+        for rt in resource_qry.all():
+            resource_types.setdefault((rt.ref_key, _get_resource_id(rt)), []).append(rt.type_id)
+    return resource_types
+
+def _get_network_resource_attrs(network_id):
+    """
+        Get the attributes of all the resources in a network.
+        Returns a dictionary of (ref_key, resource_id) -> [(resource_attr_id, attr_id), ...]
+    """
+    qry = DBSession.query(ResourceAttr.ref_key,
+                          ResourceAttr.network_id,
+                          ResourceAttr.node_id,
+                          ResourceAttr.link_id,
+                          ResourceAttr.group_id,
+                          ResourceAttr.resource_attr_id,
+                          ResourceAttr.attr_id)
+
+    resource_attrs = {}
+    for resource_qry in _query_network_resources(qry, ResourceAttr, network_id):
+        for ra in resource_qry.all():
+            resource_attrs.setdefault((ra.ref_key, _get_resource_id(ra)), []).append(
+                                                    (ra.resource_attr_id, ra.attr_id))
+    return resource_attrs
+
+def _get_network_resource_names(network_id):
+    """
+        Get the names of the network and of all its nodes, links and groups.
+        Returns a dictionary of ref_key -> {resource_id : name}, sorted by ID.
+    """
+    names = dict(NETWORK=OrderedDict(), NODE=OrderedDict(), LINK=OrderedDict(), GROUP=OrderedDict())
+
+    for n in DBSession.query(Network.network_id, Network.network_name).filter(
+                                    Network.network_id==network_id).all():
+        names['NETWORK'][n.network_id] = n.network_name
+    for n in DBSession.query(Node.node_id, Node.node_name).filter(
+                                    Node.network_id==network_id).order_by(Node.node_id).all():
+        names['NODE'][n.node_id] = n.node_name
+    for l in DBSession.query(Link.link_id, Link.link_name).filter(
+                                    Link.network_id==network_id).order_by(Link.link_id).all():
+        names['LINK'][l.link_id] = l.link_name
+    for g in DBSession.query(ResourceGroup.group_id, ResourceGroup.group_name).filter(
+                    ResourceGroup.network_id==network_id).order_by(ResourceGroup.group_id).all():
+        names['GROUP'][g.group_id] = g.group_name
+
+    return names
+
+def _get_datasets_by_id(dataset_ids):
+    datasets = {}
+    dataset_ids = list(dataset_ids)
+    for idx in range(0, len(dataset_ids), 999):
+        for d in DBSession.query(Dataset).filter(Dataset.dataset_id.in_(dataset_ids[idx:idx+999])).all():
+            datasets[d.dataset_id] = d
+    return datasets
+
+def _validate_datasets(datasets, dataset_restrictions):
+    """
+        Check datasets against the data restrictions of type attributes.
+        dataset_restrictions is a dictionary of
+        dataset_id -> {(type_id, attr_id) : type attribute}.
+
+        Returns a dictionary of (dataset_id, (type_id, attr_id)) -> error text
+        for the checks which fail. Large numbers of datasets are checked in the
+        validation worker pool, if there is one.
+    """
+    if validation.use_pool(len(dataset_restrictions)):
+        checks = []
+        for dataset_id, tas in dataset_restrictions.items():
+            d = datasets[dataset_id]
+            checks.append((dataset_id, d.data_type, d.value, d.data_hash,
+                           [(key, ta.data_restriction) for key, ta in tas.items()]))
+        return validation.check_datasets_in_pool(checks)
+
+    errors = {}
+    for dataset_id, tas in dataset_restrictions.items():
+        value = datasets[dataset_id].get_val()
+        for key, ta in tas.items():
+            try:
+                _get_validator(ta).validate(value)
+            except HydraError, e:
+                errors[(dataset_id, key)] = e.message
     return errors
 
-def validate_scenario(scenario_id, template_id=None):
-    """
-        Check that the requirements of the types of resources in a scenario are
-        correct, based on the templates in a network. If a template is specified,
-        only that template will be checked.
-    """
-    scenario_rs = DBSession.query(ResourceScenario).filter(
-                ResourceScenario.scenario_id==scenario_id)\
-                .options(joinedload_all("resourceattr"))\
-                .options(joinedload_all("dataset")).all()
+def _validate_resourcescenarios(scenario_id, template_id=None, resource_attr_ids=None):
+    """
+        Check the data in a scenario against the data restrictions of the
+        types of the resources it belongs to. If a template is specified,
+        only the types in that template are used. If resource_attr_ids are
+        specified, only the data for those resource attributes is checked.
+
+        All the information needed is loaded with a few queries up front,
+        rather than by following relationships for each resource scenario.
+    """
+    start = time.time()
+
+    scenario = DBSession.query(Scenario.scenario_id,
+                               Scenario.scenario_name,
+                               Scenario.network_id).filter(
+                                    Scenario.scenario_id==scenario_id).first()
+    if scenario is None:
+        raise ResourceNotFoundError("Scenario %s not found"%(scenario_id,))
+
+    rs_qry = DBSession.query(ResourceScenario.resource_attr_id,
+                             ResourceScenario.dataset_id,
+                             ResourceAttr.attr_id,
+                             ResourceAttr.ref_key,
+                             ResourceAttr.network_id,
+                             ResourceAttr.node_id,
+                             ResourceAttr.link_id,
+                             ResourceAttr.group_id,
+                             Attr.attr_name).filter(
+                                ResourceScenario.scenario_id==scenario_id,
+                                ResourceAttr.resource_attr_id==ResourceScenario.resource_attr_id,
+                                Attr.attr_id==ResourceAttr.attr_id)
+    if resource_attr_ids is not None:
+        rs_qry = rs_qry.filter(ResourceScenario.resource_attr_id.in_(resource_attr_ids))
+    rs_rows = rs_qry.all()
+
+    resource_types = _get_network_resource_types(scenario.network_id)
+
+    type_ids = set()
+    for types in resource_types.values():
+        type_ids.update(types)
+
+    template_ids = {}
+    restrictions = {}
+    if len(type_ids) > 0:
+        for tt in DBSession.query(TemplateType.type_id, TemplateType.template_id).filter(
+                                            TemplateType.type_id.in_(type_ids)).all():
+            template_ids[tt.type_id] = tt.template_id
+
+        for ta in DBSession.query(TypeAttr.type_id,
+                                  TypeAttr.attr_id,
+                                  TypeAttr.data_restriction).filter(
+                                            TypeAttr.type_id.in_(type_ids),
+                                            TypeAttr.data_restriction != None).all():
+            if ta.data_restriction:
+                restrictions[(ta.type_id, ta.attr_id)] = ta
+
+    #Find the restrictions which apply to each resource scenario
+    failures = []
+    to_validate = []
+    for rs in rs_rows:
+        types = resource_types.get((rs.ref_key, _get_resource_id(rs)), [])
+        if len(types) == 0:
+            continue
 
-    errors = []
-    for rs in scenario_rs:
-        try:
-            _do_validate_resourcescenario(rs, template_id)
-        except HydraError, e:
+        if template_id is not None:
+            if template_id not in [template_ids.get(t) for t in types]:
+                failures.append((rs, "Template %s is not used for resource attribute %s in scenario %s"%\
+                                 (template_id, rs.attr_name, scenario.scenario_name)))
+                continue
+            types = [t for t in types if template_ids.get(t) == template_id]
+
+        rs_restrictions = [restrictions[(t, rs.attr_id)] for t in types
+                           if (t, rs.attr_id) in restrictions]
+        if len(rs_restrictions) > 0:
+            to_validate.append((rs, rs_restrictions))
+
+    #Each dataset only needs to be checked once against each restriction,
+    #however many resource scenarios use it.
+    dataset_restrictions = OrderedDict()
+    for rs, rs_restrictions in to_validate:
+        tas = dataset_restrictions.setdefault(rs.dataset_id, OrderedDict())
+        for ta in rs_restrictions:
+            tas[(ta.type_id, ta.attr_id)] = ta
+
+    datasets = _get_datasets_by_id(dataset_restrictions.keys())
+
+    load_time = time.time()
+
+    dataset_errors = _validate_datasets(datasets, dataset_restrictions)
+
+    for rs, rs_restrictions in to_validate:
+        for ta in rs_restrictions:
+            error_text = dataset_errors.get((rs.dataset_id, (ta.type_id, ta.attr_id)))
+            if error_text is not None:
+                failures.append((rs, error_text))
+                break
 
-            error = dict(
-                     ref_key = rs.resourceattr.ref_key,
-                     ref_id  = rs.resourceattr.get_resource_id(),
-                     ref_name = rs.resourceattr.get_resource().get_name(),
+    validate_time = time.time()
+
+    errors = []
+    if len(failures) > 0:
+        names = _get_network_resource_names(scenario.network_id)
+        for rs, error_text in failures:
+            resource_id = _get_resource_id(rs)
+            errors.append(dict(
+                     ref_key = rs.ref_key,
+                     ref_id  = resource_id,
+                     ref_name = names.get(rs.ref_key, {}).get(resource_id),
                      resource_attr_id = rs.resource_attr_id,
-                     attr_id          = rs.resourceattr.attr.attr_id,
-                     attr_name        = rs.resourceattr.attr.attr_name,
+                     attr_id          = rs.attr_id,
+                     attr_name        = rs.attr_name,
                      dataset_id       = rs.dataset_id,
                      scenario_id=scenario_id,
                      template_id=template_id,
-                     error_text=e.message)
-            errors.append(error)
-                    
-    return errors
+                     error_text=error_text))
 
+    log.info("Validated %s of %s resource scenarios (%s datasets) in scenario %s (%s errors). "
+             "Loading: %.3fs, validation: %.3fs, errors: %.3fs",
+             len(to_validate), len(rs_rows), len(dataset_restrictions), scenario_id, len(errors),
+             load_time - start, validate_time - load_time, time.time() - validate_time)
+
+    return errors
 
-def _do_validate_resourcescenario(resourcescenario, template_id=None):
+def validate_attr(resource_attr_id, scenario_id, template_id=None):
     """
-        Perform a check to ensure a resource scenario's datasets are correct given what the
-        definition of that resource (its type) specifies.
+        Check that a resource attribute satisfies the requirements of all the types of the 
+        resource.
     """
-    res = resourcescenario.resourceattr.get_resource()
-
-    types = res.types
-
-    dataset = resourcescenario.dataset
+    errors = _validate_resourcescenarios(scenario_id, template_id, [resource_attr_id])
+    if len(errors) > 0:
+        return errors[0]
+    return None
 
-    if len(types) == 0:
-        return
+def validate_attrs(resource_attr_ids, scenario_id, template_id=None):
+    """
+        Check that multiple resource attribute satisfy the requirements of the types of resources to
+        which the they are attached.
+    """
+    return _validate_resourcescenarios(scenario_id, template_id, resource_attr_ids)
 
-    if template_id is not None:
-        if template_id not in [r.templatetype.template_id for r in res.types]:
-            raise HydraError("Template %s is not used for resource attribute %s in scenario %s"%\
-                             (template_id, resourcescenario.resourceattr.attr.attr_name,
-                             resourcescenario.scenario.scenario_name))
-
-    #Validate against all the types for the resource
-    for resourcetype in types:
-        #If a specific type has been specified, then only validate
-        #against that type and ignore all the others
-        if template_id is not None:
-            if resourcetype.templatetype.template_id != template_id:
-                continue
-        #Identify the template types for the template
-        tmpltype = resourcetype.templatetype
-        for ta in tmpltype.typeattrs:
-            #If we find a template type which mactches the current attribute.
-            #we can do some validation.
-            if ta.attr_id == resourcescenario.resourceattr.attr_id:
-                if ta.data_restriction:
-                    log.info("Validating against %s", ta.data_restriction)
-                    validation_dict = eval(ta.data_restriction)
-                    util.validate_value(validation_dict, dataset.get_val())
+def validate_scenario(scenario_id, template_id=None):
+    """
+        Check that the requirements of the types of resources in a scenario are
+        correct, based on the templates in a network. If a template is specified,
+        only that template will be checked.
+    """
+    return _validate_resourcescenarios(scenario_id, template_id)
 
 def validate_network(network_id, template_id, scenario_id=None):
     """
@@ -1232,23 +1412,28 @@ def validate_network(network_id, template_id, scenario_id=None):
         This validation will not fail if a resource has more than the required type, but will fail if 
         it has fewer or if any attribute has a conflicting dimension or unit.
     """
+    start = time.time()
 
-    network = DBSession.query(Network).filter(Network.network_id==network_id).options(noload('scenarios')).first()
+    network = DBSession.query(Network.network_id).filter(Network.network_id==network_id).first()
 
     if network is None:
         raise HydraError("Could not find network %s"%(network_id))
 
     resource_scenario_dict = {}
     if scenario_id is not None:
-        scenario = DBSession.query(Scenario).filter(Scenario.scenario_id==scenario_id).first()
+        scenario = DBSession.query(Scenario.scenario_id).filter(Scenario.scenario_id==scenario_id).first()
 
         if scenario is None:
             raise HydraError("Could not find scenario %s"%(scenario_id,))
 
-        for rs in scenario.resourcescenarios:
+        for rs in DBSession.query(ResourceScenario.resource_attr_id,
+                                  Dataset.data_units,
+                                  Dataset.data_dimen).filter(
+                                    ResourceScenario.scenario_id==scenario_id,
+                                    Dataset.dataset_id==ResourceScenario.dataset_id).all():
             resource_scenario_dict[rs.resource_attr_id] = rs
 
-    template = DBSession.query(Template).filter(Template.template_id == template_id).options(joinedload_all('templatetypes')).first()
+    template = DBSession.query(Template.template_id).filter(Template.template_id == template_id).first()
 
     if template is None:
         raise HydraError("Could not find template %s"%(template_id,))
@@ -1259,86 +1444,104 @@ def validate_network(network_id, template_id, scenario_id=None):
         'LINK'    : {},
         'GROUP'   : {},
     }
-    for ta in template.templatetypes:
-        resource_type_defs[ta.resource_type][ta.type_id] = ta
+    type_attrs = {}
+    for tt in DBSession.query(TemplateType.type_id, TemplateType.resource_type).filter(
+                                    TemplateType.template_id==template_id).all():
+        type_attrs[tt.type_id] = OrderedDict()
+        resource_type_defs[tt.resource_type][tt.type_id] = type_attrs[tt.type_id]
+
+    if len(type_attrs) > 0:
+        for ta in DBSession.query(TypeAttr.type_id,
+                                  TypeAttr.attr_id,
+                                  TypeAttr.unit,
+                                  Attr.attr_name,
+                                  Attr.attr_dimen).filter(
+                                    TypeAttr.type_id.in_(type_attrs.keys()),
+                                    Attr.attr_id==TypeAttr.attr_id).order_by(TypeAttr.attr_id).all():
+            type_attrs[ta.type_id][ta.attr_id] = ta
+
+    resource_types = _get_network_resource_types(network_id)
+    resource_attrs = _get_network_resource_attrs(network_id)
+    names          = _get_network_resource_names(network_id)
+
+    load_time = time.time()
 
     errors = []
-    #Only check if there are type definitions for a network in the template.
-    if resource_type_defs.get('NETWORK'):
-        net_types = resource_type_defs['NETWORK']
-        errors.extend(_validate_resource(network, net_types, resource_scenario_dict))
-
-    #check all nodes
-    if resource_type_defs.get('NODE'):
-        node_types = resource_type_defs['NODE']
-        for node in network.nodes:
-            errors.extend(_validate_resource(node, node_types, resource_scenario_dict))
-
-    #check all links
-    if resource_type_defs.get('LINK'):
-        link_types = resource_type_defs['LINK']
-        for link in network.links:
-            errors.extend(_validate_resource(link, link_types, resource_scenario_dict))
-
-    #check all groups
-    if resource_type_defs.get('GROUP'):
-        group_types = resource_type_defs['GROUP']
-        for group in network.resourcegroups:
-            errors.extend(_validate_resource(group, group_types, resource_scenario_dict))
+    #Only check the kinds of resource for which the template has types.
+    for ref_key in ('NETWORK', 'NODE', 'LINK', 'GROUP'):
+        tmpl_types = resource_type_defs[ref_key]
+        if not tmpl_types:
+            continue
+        for resource_id, resource_name in names[ref_key].items():
+            key = (ref_key, resource_id)
+            errors.extend(_validate_resource(ref_key,
+                                             resource_name,
+                                             resource_types.get(key, []),
+                                             resource_attrs.get(key, []),
+                                             tmpl_types,
+                                             resource_scenario_dict))
+
+    log.info("Validated network %s against template %s (%s errors). Loading: %.3fs, validation: %.3fs",
+             network_id, template_id, len(errors), load_time - start, time.time() - load_time)
 
     return errors
 
-def _validate_resource(resource, tmpl_types, resource_scenarios=[]):
+def _validate_resource(ref_key, resource_name, type_ids, resource_attrs, tmpl_types, resource_scenarios={}):
+    """
+        Check a resource against the type it has in a template.
+        type_ids are the IDs of the resource's types, resource_attrs its
+        (resource_attr_id, attr_id)s and tmpl_types a dictionary of
+        type_id -> {attr_id : type attribute} for the types in the template.
+    """
     errors = []
-    resource_type = None 
-    
+    ta_dict = None
+
     #No validation required if the link has no type.
-    if len(resource.types) == 0:
+    if len(type_ids) == 0:
         return []
 
-    for rt in resource.types:
-        if tmpl_types.get(rt.type_id) is not None:
-                resource_type = tmpl_types[rt.type_id]
-                break
+    for type_id in type_ids:
+        if tmpl_types.get(type_id) is not None:
+            ta_dict = tmpl_types[type_id]
+            break
         else:
             errors.append("Type %s not found on %s %s"%
-                          (tmpl_types, resource_type, resource.get_name()))
+                          (type_id, ref_key, resource_name))
 
-    ta_dict = {}
-    for ta in resource_type.typeattrs:
-        ta_dict[ta.attr_id] = ta
+    if ta_dict is None:
+        return errors
 
     #Make sure the resource has all the attributes specified in the tempalte
     #by checking whether the template attributes are a subset of the resource
     #attributes.
-    type_attrs = set([ta.attr_id for ta in resource_type.typeattrs])
-    
-    resource_attrs = set([ra.attr_id for ra in resource.attributes])
- 
-    if not type_attrs.issubset(resource_attrs):
-        for ta in type_attrs.difference(resource_attrs):
+    type_attrs = set(ta_dict.keys())
+
+    resource_attr_ids = set([ra[1] for ra in resource_attrs])
+
+    if not type_attrs.issubset(resource_attr_ids):
+        for ta in type_attrs.difference(resource_attr_ids):
             errors.append("Resource %s does not have attribute %s"%
-                          (resource.get_name(), ta_dict[ta].attr.attr_name))
+                          (resource_name, ta_dict[ta].attr_name))
 
-    resource_attr_ids = set([ra.resource_attr_id for ra in resource.attributes])
     #if data is included, check to make sure each dataset conforms
     #to the boundaries specified in the template: i.e. that it has
     #the correct dimension and (if specified) unit.
     if len(resource_scenarios) > 0:
-        for ra_id in resource_attr_ids:
+        for ra_id, attr_id in resource_attrs:
             rs = resource_scenarios.get(ra_id)
-            if rs is None:
+            ta = ta_dict.get(attr_id)
+            if rs is None or ta is None:
                 continue
-            attr_name = rs.resourceattr.attr.attr_name
-            rs_unit = rs.dataset.data_units
-            rs_dimension = rs.dataset.data_dimen
-            type_dimension = ta_dict[rs.resourceattr.attr_id].attr.attr_dimen
-            type_unit = ta_dict[rs.resourceattr.attr_id].unit
-            
+            attr_name = ta.attr_name
+            rs_unit = rs.data_units
+            rs_dimension = rs.data_dimen
+            type_dimension = ta.attr_dimen
+            type_unit = ta.unit
+
             if rs_dimension != type_dimension:
                 errors.append("Dimension mismatch on %s %s, attribute %s: "
                               "%s on attribute, %s on type"%
-                             ( resource.ref_key, resource.get_name(), attr_name,
+                             ( ref_key, resource_name, attr_name,
                               rs_dimension, type_dimension))
 
             if type_unit is not None:
@@ -22,6 +22,7 @@ from HydraLib.util import arr_to_vector
 from HydraLib.util import vector_to_arr
 from HydraServer.db.model import Dataset
 from HydraServer.db import DBSession
+import numpy as np
 import logging
 log = logging.getLogger(__name__)
 
@@ -113,6 +114,19 @@ def convert_units(values, unit1, unit2,**kwargs):
     float_values = [float(value) for value in values]
     return hydra_units.convert(float_values, unit1, unit2)
 
+def _convert_array(arr, unit1, unit2):
+    """Convert a (possibly multidimensional) array of values from one unit
+    to another.
+    """
+    try:
+        return hydra_units.convert(np.array(arr, dtype=float), unit1, unit2).tolist()
+    except ValueError:
+        #Arrays whose rows have different lengths can't be
+        #made into a numpy array.
+        dim = array_dim(arr)
+        vecdata = [float(v) for v in arr_to_vector(arr)]
+        return vector_to_arr(hydra_units.convert(vecdata, unit1, unit2), dim)
+
 def convert_dataset(dataset_id, to_unit,**kwargs):
     """Convert a whole dataset (specified by 'dataset_id' to new unit
     ('to_unit'). Conversion ALWAYS creates a NEW dataset, so function
@@ -130,18 +144,14 @@ def convert_dataset(dataset_id, to_unit,**kwargs):
         if dataset_type == 'scalar':
             new_val = hydra_units.convert(float(dsval), old_unit, to_unit)
         elif dataset_type == 'array':
-            dim = array_dim(dsval)
-            vecdata = arr_to_vector(dsval)
-            newvec = hydra_units.convert(vecdata, old_unit, to_unit)
-            new_val = vector_to_arr(newvec, dim)
+            new_val = _convert_array(dsval, old_unit, to_unit)
         elif dataset_type == 'timeseries':
-            new_val = []
-            for ts_time, ts_val in dsval.items():
-                dim = array_dim(ts_val)
-                vecdata = arr_to_vector(ts_val)
-                newvec = hydra_units.convert(vecdata, old_unit, to_unit)
-                newarr = vector_to_arr(newvec, dim)
-                new_val.append(ts_time, newarr)
+            #Numeric timeseries are converted in one go. Timeseries of
+            #arrays are converted an array at a time.
+            if all([np.issubdtype(t, np.number) for t in dsval.dtypes]):
+                new_val = hydra_units.convert(dsval.astype(float), old_unit, to_unit)
+            else:
+                new_val = dsval.applymap(lambda v: _convert_array(v, old_unit, to_unit))
         elif dataset_type == 'descriptor':
             raise HydraError('Cannot convert descriptor.')
         
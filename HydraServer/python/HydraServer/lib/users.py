@@ -16,10 +16,10 @@
 from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.orm.exc import NoResultFound
 
-from HydraServer.db.model import User, Role, Perm, RoleUser, RolePerm
+from HydraServer.db.model import User, Role, Perm, RoleUser, RolePerm, UserToken
 from HydraServer.db import DBSession
+from HydraServer.util.passwords import hash_password, generate_token, credential_cache
 
-import bcrypt
 
 from HydraLib.HydraException import ResourceNotFoundError, HydraError
 import logging
@@ -81,7 +81,7 @@ def add_user(user,**kwargs):
     if user_id is not None:
         raise HydraError("User %s already exists!"%user.username)
 
-    u.password = bcrypt.hashpw(user.password.encode('utf-8'), bcrypt.gensalt())
+    u.password = hash_password(user.password)
     
     DBSession.add(u)
     DBSession.flush()
@@ -105,11 +105,51 @@ def update_user_password(new_pwd_user_id, new_password,**kwargs):
     #check_perm(kwargs.get('user_id'), 'edit_user')
     try:
         user_i = DBSession.query(User).filter(User.user_id==new_pwd_user_id).one()
-        user_i.password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt())
+        user_i.password = hash_password(new_password)
+        credential_cache.invalidate(user_i.user_id)
         return user_i
     except NoResultFound:
         raise ResourceNotFoundError("User (id=%s) not found"%(new_pwd_user_id))
 
+def add_user_token(token_name, **kwargs):
+    """
+        Create an API token for the current user. The token itself
+        is returned, as only its hash is stored, so it can't be retrieved later.
+    """
+    token, token_hash = generate_token()
+
+    token_i = UserToken(user_id=kwargs.get('user_id'),
+                        token_hash=token_hash,
+                        token_name=token_name if token_name is not None else '')
+    DBSession.add(token_i)
+    DBSession.flush()
+
+    return token
+
+def get_user_tokens(**kwargs):
+    """
+        Get the IDs, names and last use of the current user's API tokens.
+    """
+    return DBSession.query(UserToken.token_id,
+                           UserToken.token_name,
+                           UserToken.last_used,
+                           UserToken.cr_date).filter(
+                               UserToken.user_id==kwargs.get('user_id')).all()
+
+def delete_user_token(token_id, **kwargs):
+    """
+        Delete one of the current user's API tokens.
+    """
+    try:
+        token_i = DBSession.query(UserToken).filter(UserToken.token_id==token_id,
+                                        UserToken.user_id==kwargs.get('user_id')).one()
+    except NoResultFound:
+        raise ResourceNotFoundError("Token (id=%s) not found"%(token_id))
+
+    DBSession.delete(token_i)
+
+    return 'OK'
+
 def get_user_by_name(uname,**kwargs):
     """
     """
@@ -15,18 +15,26 @@
 #
 from spyne.decorator import rpc
 from spyne.model.complex import Array as SpyneArray
-from spyne.model.primitive import Integer32
+from spyne.model.primitive import Integer32, Unicode
+from spyne.model.binary import ByteArray
 
 from HydraServer.soap_server.hydra_complexmodels import Dataset, HydraComplexModel
 from HydraServer.soap_server.hydra_base import HydraService
 
 from HydraServer.db import DBSession
 from HydraServer.db.model import ResourceAttr, ResourceScenario, Scenario, Node, Link, ResourceGroup
+from HydraServer.lib import data as hydra_data
+from HydraServer.lib import scenario as hydra_scenario
+from HydraServer.util import decompress_value
 
 from sqlalchemy.orm import joinedload
+from sqlalchemy import literal, Integer
 
 from HydraLib.HydraException import HydraError
 
+from cStringIO import StringIO
+import numpy
+
 import logging
 log = logging.getLogger(__name__)
 
@@ -45,6 +53,83 @@ def _get_data(ref_key, resource_ids, attribute_ids, scenario_ids):
 
     return qry.all()
 
+def _get_resource_column(ref_key):
+    if ref_key == 'NODE':
+        return ResourceAttr.node_id
+    elif ref_key == 'LINK':
+        return ResourceAttr.link_id
+    elif ref_key == 'GROUP':
+        return ResourceAttr.group_id
+    else:
+        raise HydraError("Ref key %s not recognised."%ref_key)
+
+def _get_data_cells(ref_key, resource_ids, attribute_ids, scenario_ids):
+    """
+        Get the (scenario_id, resource_id, attr_id, dataset_id) of every
+        piece of data in the matrix, as plain rows rather than ORM objects.
+        The resources are requested in chunks to keep the IN clauses small.
+        As in get_network, a child scenario includes the data it inherits
+        from its ancestors.
+    """
+    resource_col = _get_resource_column(ref_key)
+
+    scenario_ids = set(scenario_ids)
+    parent_ids = dict(DBSession.query(Scenario.scenario_id, Scenario.parent_id).filter(
+                                            Scenario.scenario_id.in_(scenario_ids)).all())
+
+    #Scenarios without a parent are queried together. The data of a child
+    #scenario is resolved from its ancestors, so each child is queried separately.
+    scenario_filters = []
+    root_ids = [s_id for s_id in scenario_ids if parent_ids.get(s_id) is None]
+    if len(root_ids) > 0:
+        scenario_filters.append((ResourceScenario.scenario_id,
+                                 ResourceScenario.scenario_id.in_(root_ids)))
+    for s_id in scenario_ids:
+        if parent_ids.get(s_id) is not None:
+            scenario_filters.append((literal(s_id, Integer),
+                                     hydra_scenario._get_resolved_rs_filter(s_id)))
+
+    cells = []
+    for scenario_col, scenario_filter in scenario_filters:
+        for i in range(0, len(resource_ids), hydra_data.qry_in_threshold):
+            resource_chunk = resource_ids[i:i+hydra_data.qry_in_threshold]
+            cells.extend(DBSession.query(scenario_col.label('scenario_id'),
+                                         resource_col.label('resource_id'),
+                                         ResourceAttr.attr_id,
+                                         ResourceScenario.dataset_id).filter(
+                        ResourceScenario.resource_attr_id==ResourceAttr.resource_attr_id,
+                        scenario_filter,
+                        ResourceAttr.attr_id.in_(attribute_ids),
+                        resource_col.in_(resource_chunk)).all())
+
+    cells.sort()
+
+    return cells
+
+def _pack_scalars(datasets, dataset_ids):
+    """
+        Make a float64 array, in .npy format, containing the value of
+        each cell's dataset. Cells whose dataset is not a scalar, whose value
+        cannot be seen, or whose value is not a number, are NaN.
+        Returns the array and the IDs of the datasets whose values it contains.
+    """
+    scalar_vals = {}
+    for d in datasets:
+        if d.data_type == 'scalar' and d.value is not None:
+            try:
+                scalar_vals[d.dataset_id] = float(decompress_value(d.value))
+            except ValueError:
+                log.info("Scalar dataset %s is not a number. Not packing it.", d.dataset_id)
+
+    nan = float('nan')
+    values = numpy.array([scalar_vals.get(d_id, nan) for d_id in dataset_ids],
+                         dtype=numpy.float64)
+
+    buf = StringIO()
+    numpy.save(buf, values)
+
+    return buf.getvalue(), set(scalar_vals)
+
 def _get_resource_attributes(ref_key, resource_ids, attribute_ids):
 
     qry = DBSession.query(ResourceAttr).filter(
@@ -165,6 +250,40 @@ class GroupDatasetMatrix(HydraComplexModel):
            group_data.append(group)
         self.groups = group_data
 
+class ColumnarDatasetMatrix(HydraComplexModel):
+    """
+        A (scenario x resource x attribute) matrix of data, as columns.
+        There is one entry in scenario_ids, resource_ids, attr_ids and dataset_ids
+        for each cell of the matrix which has data, sorted by scenario, resource
+        and attribute. Empty cells are left out.
+        Each dataset appears once in datasets, however many cells use it.
+        If the scalars are packed, scalar_values contains a float64 .npy array
+        with the value of each cell, and the datasets whose values it contains
+        are left out of datasets. A cell is NaN if its dataset is not a scalar,
+        cannot be seen by the user or is not a number. These datasets are
+        always in datasets, so a client can tell which is the case.
+    """
+    _type_info = [
+        ('ref_key',       Unicode),
+        ('scenario_ids',  SpyneArray(Integer32)),
+        ('resource_ids',  SpyneArray(Integer32)),
+        ('attr_ids',      SpyneArray(Integer32)),
+        ('dataset_ids',   SpyneArray(Integer32)),
+        ('datasets',      SpyneArray(Dataset)),
+        ('scalar_values', ByteArray(min_occurs=0, default=None)),
+    ]
+
+    def __init__(self, ref_key=None, cells=None, datasets=None, scalar_values=None):
+        super(ColumnarDatasetMatrix, self).__init__()
+        if ref_key is None:
+            return
+        self.ref_key = ref_key
+        self.scenario_ids = [c.scenario_id for c in cells]
+        self.resource_ids = [c.resource_id for c in cells]
+        self.attr_ids     = [c.attr_id for c in cells]
+        self.dataset_ids  = [c.dataset_id for c in cells]
+        self.datasets     = [Dataset(d, include_metadata=False) for d in datasets]
+        self.scalar_values = scalar_values
 
 def get_attr_dict(ref_key, scenario_ids, resource_ids, attribute_ids, resource_rs, resource_attr_rs, data_rs):
     scenario_data = {}
@@ -238,7 +357,7 @@ class Service(HydraService):
         #group the data by scenario
         node_attr_dict = get_attr_dict('NODE', scenario_ids, node_ids, attribute_ids, nodes, resource_attrs, data)
                 
-        returned_matrix = [NodeDatasetMatrix(scenario_id, data) for scenario_id, data in node_attr_dict.items()]
+        returned_matrix = [NodeDatasetMatrix(scenario_id, scenario_data) for scenario_id, scenario_data in node_attr_dict.items()]
 
         return returned_matrix 
 
@@ -269,7 +388,7 @@ class Service(HydraService):
        
         link_attr_dict = get_attr_dict('LINK', scenario_ids, link_ids, attribute_ids, links, resource_attrs, data)
         
-        returned_matrix = [LinkDatasetMatrix(scenario_id, data) for scenario_id, data in link_attr_dict.items()]
+        returned_matrix = [LinkDatasetMatrix(scenario_id, scenario_data) for scenario_id, scenario_data in link_attr_dict.items()]
 
         return returned_matrix 
 
@@ -299,6 +418,45 @@ class Service(HydraService):
 
         group_attr_dict = get_attr_dict('GROUP', scenario_ids, group_ids, attribute_ids, groups, resource_attrs, data)
 
-        returned_matrix = [GroupDatasetMatrix(scenario_id, data) for scenario_id, data in group_attr_dict.items()]
+        returned_matrix = [GroupDatasetMatrix(scenario_id, scenario_data) for scenario_id, scenario_data in group_attr_dict.items()]
 
         return returned_matrix
+
+    @rpc(Unicode(pattern="NODE|LINK|GROUP", min_occurs=1),
+         Integer32(min_occurs=1, max_occurs='unbounded'),
+         Integer32(min_occurs=1, max_occurs='unbounded'),
+         Integer32(min_occurs=1, max_occurs='unbounded'),
+         Unicode(pattern="[YN]", default='N'),
+         _returns=ColumnarDatasetMatrix)
+    def get_dataset_matrix_columns(ctx, ref_key, resource_ids, attribute_ids, scenario_ids, pack_scalars):
+        """
+            Given a type of resource (NODE, LINK or GROUP), a list of resources,
+            attributes and scenarios, return the matrix of data as parallel
+            lists of IDs, along with each dataset used in the matrix (once).
+            This is much smaller than the nested matrices returned by
+            get_node_dataset_matrix etc. for large requests.
+
+            If pack_scalars is 'Y', the values of scalar datasets are returned
+            as a single binary numpy (.npy) array instead of as datasets.
+            Scalars which the user cannot see, or which are not numbers,
+            are NaN in the array and are still returned as datasets.
+        """
+        if len(scenario_ids) == 0:
+            raise HydraError("No scenarios specified!")
+        if len(attribute_ids) == 0:
+            raise HydraError("No attributes specified!")
+        if len(resource_ids) == 0:
+            raise HydraError("No resources specified")
+
+        cells = _get_data_cells(ref_key, resource_ids, attribute_ids, scenario_ids)
+
+        dataset_ids = [c.dataset_id for c in cells]
+
+        datasets = hydra_data.get_datasets(sorted(set(dataset_ids)), **ctx.in_header.__dict__)
+
+        scalar_values = None
+        if pack_scalars == 'Y':
+            scalar_values, packed_ids = _pack_scalars(datasets, dataset_ids)
+            datasets = [d for d in datasets if d.dataset_id not in packed_ids]
+
+        return ColumnarDatasetMatrix(ref_key, cells, datasets, scalar_values)
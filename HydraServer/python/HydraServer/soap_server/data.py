@@ -17,7 +17,8 @@ from spyne.model.primitive import Integer, Integer32, Boolean, Unicode, AnyDict,
 from spyne.model.complex import Array as SpyneArray
 from spyne.decorator import rpc
 from hydra_complexmodels import Dataset,\
-        DatasetCollection
+        DatasetCollection,\
+        DatasetValueMatrix
 
 from HydraServer.lib import data
 
@@ -546,8 +547,43 @@ class DataService(HydraService):
                                     **ctx.in_header.__dict__)
         return result
 
-    @rpc(Integer,Unicode,Unicode,Unicode(values=['seconds', 'minutes', 'hours', 'days', 'months']), Decimal(default=1),_returns=AnyDict)
-    def get_vals_between_times(ctx, dataset_id, start_time, end_time, timestep, increment):
+    @rpc(_returns=AnyDict)
+    def get_value_cache_stats(ctx):
+        """
+        Get statistics about the server's cache of decoded array and timeseries values.
+
+        Returns:
+            dict: The number of entries, the memory they use (size) and the
+            maximum memory to be used (max_size), in bytes, and the number of hits,
+            misses and evictions.
+
+        """
+        return data.get_value_cache_stats(**ctx.in_header.__dict__)
+
+    @rpc(Integer32(min_occurs=1, max_occurs='unbounded'), Unicode(min_occurs=1, max_occurs='unbounded'), _returns=DatasetValueMatrix)
+    def get_vals_at_time_matrix(ctx, dataset_ids, timestamps):
+        """
+        Similar to get_multiple_vals_at_time, but return the values as a single
+        binary matrix, which is much smaller and faster to read for large requests.
+
+        Args:
+            dataset_ids (List(int)): The IDs of the timeseries datasets being searched
+            timestamps (List(timestamps)): A list of timestamps to get values for.
+
+        Returns:
+            DatasetValueMatrix: The dataset IDs and timestamps, with a float64
+            (dataset x timestamp) numpy (.npy) array of values. Values which can't be
+            found, such as times before the start of a timeseries, or datasets which
+            are not timeseries with one numeric column, are NaN.
+
+        """
+        values = data.get_vals_at_time_matrix(dataset_ids,
+                                              timestamps,
+                                              **ctx.in_header.__dict__)
+        return DatasetValueMatrix(dataset_ids, timestamps, values)
+
+    @rpc(Integer,Unicode,Unicode,Unicode(values=['seconds', 'minutes', 'hours', 'days', 'months', 'years']), Decimal(default=1), Unicode(pattern="[YN]", default='N'), _returns=AnyDict)
+    def get_vals_between_times(ctx, dataset_id, start_time, end_time, timestep, increment, binary):
         """
         Retrive data between two specified times within a timeseries. The times
         need not be specified in the timeseries. This function will 'fill in the blanks'.
@@ -568,9 +604,11 @@ class DataService(HydraService):
             dataset_id (int): The dataset being queried
             start_time (string): The date or value from which to start the query
             end_time   (string): The date or value that ends the query
-            timestep   Enum(string): 'seconds', 'minutes', 'hours', 'days', 'months':
+            timestep   Enum(string): 'seconds', 'minutes', 'hours', 'days', 'months', 'years':
                 The increment in time that the result will be in
             increment  (decimal): The increment that the result will be in if the timeseries is not timestamp-based.
+            binary     (char): 'Y' to return the data as a base64 encoded float64 (time x column)
+                numpy (.npy) array, with a row for every time. Only for numeric timeseries.
 
         Returns:
             (AnyDict): A dictionary, keyed on the newly created timestamps, which have been
@@ -582,6 +620,7 @@ class DataService(HydraService):
                                            end_time, 
                                            timestep,
                                            increment,
+                                           binary,
                                            **ctx.in_header.__dict__)
 
     @rpc(Unicode, _returns=Unicode)
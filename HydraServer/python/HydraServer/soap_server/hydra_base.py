@@ -19,14 +19,15 @@ from spyne.model.complex import ComplexModel
 from spyne.decorator import srpc, rpc
 from hydra_complexmodels import LoginResponse
 import logging
-from HydraServer.util.hdb import login_user
+from HydraServer.util.hdb import login_user, login_user_with_token
+from HydraServer.util.sessions import make_session_store, make_session_id
 from HydraLib.HydraException import HydraError
 from spyne.protocol.json import JsonDocument
 
 from spyne.service import ServiceBase
 
 log = logging.getLogger(__name__)
-_session_db = dict()
+_session_db = make_session_store()
 
 def get_session_db():
     return _session_db
@@ -35,6 +36,20 @@ def set_session_db(session_db):
     global _session_db
     _session_db = session_db
 
+def _add_session(sessionid, user_id, username):
+    """
+        Store a new session, never replacing an existing one.
+        Returns the session ID, which is a new one if sessionid was in use.
+    """
+    session_db = get_session_db()
+    if hasattr(session_db, 'add'):
+        return session_db.add(sessionid, (user_id, username))
+
+    while sessionid in session_db:
+        sessionid = make_session_id()
+    session_db[sessionid] = (user_id, username)
+    return sessionid
+
 class HydraDocument(JsonDocument):
     """An implementation of the json protocol
        with request headers working"""
@@ -122,7 +137,11 @@ class LogoutService(HydraService):
     @rpc(Mandatory.String, _returns=String,
                                                     _throws=AuthenticationError)
     def logout(ctx, username):
-        del(_session_db[ctx.in_header.sessionid])
+        try:
+            del(get_session_db()[ctx.in_header.sessionid])
+        except KeyError:
+            #The session has already expired.
+            pass
         return "OK"
 
 class AuthenticationService(ServiceBase):
@@ -145,9 +164,27 @@ class AuthenticationService(ServiceBase):
         except HydraError, e:
             raise AuthenticationError(e)
 
-        _session_db[sessionid] = (user_id, username)
+        sessionid = _add_session(sessionid, user_id, username)
         loginresponse = LoginResponse()
         loginresponse.sessionid = sessionid
         loginresponse.userid    = user_id
         print loginresponse
         return loginresponse
+
+    @srpc(Mandatory.Unicode, _returns=LoginResponse,
+                                                   _throws=AuthenticationError)
+    def login_with_token(token):
+        """
+            Log in using an API token, created with add_user_token.
+            This is much faster than logging in with a password.
+        """
+        try:
+            user_id, username, sessionid = login_user_with_token(token)
+        except HydraError, e:
+            raise AuthenticationError(e)
+
+        sessionid = _add_session(sessionid, user_id, username)
+        loginresponse = LoginResponse()
+        loginresponse.sessionid = sessionid
+        loginresponse.userid    = user_id
+        return loginresponse
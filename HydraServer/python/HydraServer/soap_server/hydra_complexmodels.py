@@ -19,11 +19,15 @@ from spyne.model.primitive import Integer
 from spyne.model.primitive import Decimal
 from spyne.model.primitive import AnyDict
 from spyne.model.primitive import Double
+from spyne.model.binary import ByteArray
 from decimal import Decimal as Dec
 from HydraLib.hydra_dateutil import ordinal_to_timestamp
 import pandas as pd
+import numpy
+from cStringIO import StringIO
 import logging
-from HydraServer.util import generate_data_hash
+from HydraServer.util import generate_data_hash, get_client_value,\
+        can_encode_timeseries, encode_timeseries
 import json
 import zlib
 from HydraLib import config
@@ -173,10 +177,7 @@ class ResourceData(HydraComplexModel):
         self.dataset_unit      = ra.data_units
         self.dataset_frequency = ra.frequency
         if include_value=='Y':
-            try:
-                self.dataset_value = zlib.decompress(ra.value)
-            except:
-                self.dataset_value = ra.value
+            self.dataset_value = get_client_value(ra.value, ra.data_type)
 
         if ra.metadata:
             self.metadata = {}
@@ -197,6 +198,7 @@ class Dataset(HydraComplexModel):
     - **created_by**       Integer(min_occurs=0, default=None)
     - **cr_date**          Unicode(min_occurs=0, default=None)
     - **metadata**         Unicode(min_occurs=0, default='{}')
+    - **hash**             Integer(min_occurs=0, default=None)
     """
     _type_info = [
         ('id',               Integer(min_occurs=0, default=None)),
@@ -209,6 +211,7 @@ class Dataset(HydraComplexModel):
         ('created_by',       Integer(min_occurs=0, default=None)),
         ('cr_date',          Unicode(min_occurs=0, default=None)),
         ('metadata',         Unicode(min_occurs=0, default='{}')),
+        ('hash',             Integer(min_occurs=0, default=None)),
     ]
 
     def __init__(self, parent=None, include_metadata=True):
@@ -225,13 +228,11 @@ class Dataset(HydraComplexModel):
 
         self.dimension = parent.data_dimen
         self.unit      = parent.data_units
-        self.value = None
+        self.hash      = getattr(parent, 'data_hash', None)
 
-        if parent.value is not None:
-            try:
-                self.value = zlib.decompress(parent.value)
-            except:
-                self.value = parent.value
+        #Values are stored compressed, and timeseries may be stored
+        #in the binary format, until they are sent.
+        self.value = get_client_value(parent.value, parent.data_type)
 
         if include_metadata is True:
             metadata = {}
@@ -266,6 +267,10 @@ class Dataset(HydraComplexModel):
             elif self.type == 'timeseries':
                 timeseries_pd = pd.read_json(data)
 
+                if config.get('db', 'timeseries_format', 'binary') == 'binary'\
+                   and can_encode_timeseries(timeseries_pd):
+                    return encode_timeseries(timeseries_pd)
+
                 #Epoch doesn't work here because dates before 1970 are not
                 # supported in read_json. Ridiculous.
                 ts = timeseries_pd.to_json(date_format='iso', date_unit='ns')
@@ -361,6 +366,29 @@ class DatasetCollection(HydraComplexModel):
         self.dataset_ids = [d.dataset_id for d in parent.items]
         self.cr_date = str(parent.cr_date)
 
+class DatasetValueMatrix(HydraComplexModel):
+    """
+    - **dataset_ids** SpyneArray(Integer)
+    - **timestamps** SpyneArray(Unicode)
+    - **values** ByteArray: A float64 (dataset x timestamp) array in numpy (.npy) format.
+    """
+    _type_info = [
+        ('dataset_ids', SpyneArray(Integer)),
+        ('timestamps',  SpyneArray(Unicode)),
+        ('values',      ByteArray),
+    ]
+
+    def __init__(self, dataset_ids=None, timestamps=None, values=None):
+        super(DatasetValueMatrix, self).__init__()
+        if dataset_ids is None:
+            return
+        self.dataset_ids = dataset_ids
+        self.timestamps  = timestamps
+
+        buf = StringIO()
+        numpy.save(buf, values)
+        self.values = buf.getvalue()
+
 class Attr(HydraComplexModel):
     """
        - **id** Integer(default=None)
@@ -976,6 +1004,7 @@ class Scenario(Resource):
        - **created_by**           Integer(default=None)
        - **cr_date**              Unicode(default=None)
        - **time_step**            Unicode(default=None)
+       - **parent_id**            Integer(default=None)
        - **resourcescenarios**    SpyneArray(ResourceScenario, default=None)
        - **resourcegroupitems**   SpyneArray(ResourceGroupItem, default=None)
     """
@@ -992,6 +1021,7 @@ class Scenario(Resource):
         ('created_by',           Integer(default=None)),
         ('cr_date',              Unicode(default=None)),
         ('time_step',            Unicode(default=None)),
+        ('parent_id',            Integer(default=None)),
         ('resourcescenarios',    SpyneArray(ResourceScenario, default=None)),
         ('resourcegroupitems',   SpyneArray(ResourceGroupItem, default=None)),
     ]
@@ -1011,6 +1041,7 @@ class Scenario(Resource):
         self.start_time = get_timestamp(parent.start_time)
         self.end_time = get_timestamp(parent.end_time)
         self.time_step = parent.time_step
+        self.parent_id = getattr(parent, 'parent_id', None)
         self.created_by = parent.created_by
         self.cr_date    = str(parent.cr_date)
         if summary is False:
@@ -1128,14 +1159,18 @@ class ResourceGroupDiff(HydraComplexModel):
 
 class ResourceScenarioDiff(HydraComplexModel):
     """
-       - **resource_attr_id**     Integer(default=None)
-       - **scenario_1_dataset**   Dataset
-       - **scenario_2_dataset**   Dataset
+       - **resource_attr_id**       Integer(default=None)
+       - **scenario_1_dataset_id**  Integer(default=None)
+       - **scenario_2_dataset_id**  Integer(default=None)
+       - **scenario_1_dataset**     Dataset
+       - **scenario_2_dataset**     Dataset
     """
     _type_info = [
-        ('resource_attr_id',     Integer(default=None)),
-        ('scenario_1_dataset',   Dataset),
-        ('scenario_2_dataset',   Dataset),
+        ('resource_attr_id',      Integer(default=None)),
+        ('scenario_1_dataset_id', Integer(default=None)),
+        ('scenario_2_dataset_id', Integer(default=None)),
+        ('scenario_1_dataset',    Dataset),
+        ('scenario_2_dataset',    Dataset),
     ]
 
     def __init__(self, parent=None):
@@ -1146,17 +1181,22 @@ class ResourceScenarioDiff(HydraComplexModel):
 
         self.resource_attr_id   = parent['resource_attr_id']
 
+        self.scenario_1_dataset_id = parent.get('scenario_1_dataset_id')
+        self.scenario_2_dataset_id = parent.get('scenario_2_dataset_id')
+
         self.scenario_1_dataset = Dataset(parent['scenario_1_dataset'])
         self.scenario_2_dataset = Dataset(parent['scenario_2_dataset'])
 
 class ScenarioDiff(HydraComplexModel):
     """
-       - **resourcescenarios**    SpyneArray(ResourceScenarioDiff)
-       - **groups**               ResourceGroupDiff
+       - **resourcescenarios**      SpyneArray(ResourceScenarioDiff)
+       - **num_resourcescenarios**  Integer(default=None)
+       - **groups**                 ResourceGroupDiff
     """
     _type_info = [
-        ('resourcescenarios',    SpyneArray(ResourceScenarioDiff)),
-        ('groups',               ResourceGroupDiff),
+        ('resourcescenarios',     SpyneArray(ResourceScenarioDiff)),
+        ('num_resourcescenarios', Integer(default=None)),
+        ('groups',                ResourceGroupDiff),
     ]
 
     def __init__(self, parent=None):
@@ -1166,8 +1206,55 @@ class ScenarioDiff(HydraComplexModel):
             return
 
         self.resourcescenarios = [ResourceScenarioDiff(rd) for rd in parent['resourcescenarios']]
+        self.num_resourcescenarios = parent.get('num_resourcescenarios')
         self.groups = ResourceGroupDiff(parent['groups'])
 
+class ScenarioMatrixRow(HydraComplexModel):
+    """
+       - **resource_attr_id**       Integer(default=None)
+       - **attr_id**                Integer(default=None)
+       - **dataset_ids**            SpyneArray(Integer)
+       - **distinct_dataset_ids**   SpyneArray(Integer)
+    """
+    _type_info = [
+        ('resource_attr_id',     Integer(default=None)),
+        ('attr_id',              Integer(default=None)),
+        ('dataset_ids',          SpyneArray(Integer)),
+        ('distinct_dataset_ids', SpyneArray(Integer)),
+    ]
+
+    def __init__(self, parent=None):
+        super(ScenarioMatrixRow, self).__init__()
+
+        if parent is None:
+            return
+
+        self.resource_attr_id     = parent['resource_attr_id']
+        self.attr_id              = parent['attr_id']
+        self.dataset_ids          = parent['dataset_ids']
+        self.distinct_dataset_ids = parent['distinct_dataset_ids']
+
+class ScenarioMatrix(HydraComplexModel):
+    """
+       - **scenario_ids**   SpyneArray(Integer)
+       - **rows**           SpyneArray(ScenarioMatrixRow)
+
+       The dataset_ids of each row are in the same order as scenario_ids.
+    """
+    _type_info = [
+        ('scenario_ids', SpyneArray(Integer)),
+        ('rows',         SpyneArray(ScenarioMatrixRow)),
+    ]
+
+    def __init__(self, parent=None):
+        super(ScenarioMatrix, self).__init__()
+
+        if parent is None:
+            return
+
+        self.scenario_ids = parent['scenario_ids']
+        self.rows = [ScenarioMatrixRow(r) for r in parent['rows']]
+
 class Network(Resource):
     """
        - **project_id**          Integer(default=None)
@@ -1227,6 +1314,52 @@ class Network(Resource):
         if summary is False:
             self.attributes  = [ResourceAttr(ra) for ra in parent.attributes]
 
+class NetworkChunk(HydraComplexModel):
+    """
+        A piece of a network, as returned by get_network_stream.
+        The chunk_type indicates which of the other fields are populated.
+
+       - **chunk_type**          Unicode(default=None): NETWORK, NODE, LINK, GROUP, SCENARIO or RESOURCESCENARIO
+       - **network**             Network (without nodes, links, groups or scenarios)
+       - **nodes**               SpyneArray(Node)
+       - **links**               SpyneArray(Link)
+       - **resourcegroups**      SpyneArray(ResourceGroup)
+       - **scenarios**           SpyneArray(Scenario) (without data)
+       - **scenario_id**         Integer(default=None): The scenario to which the resourcescenarios belong
+       - **resourcescenarios**   SpyneArray(ResourceScenario)
+    """
+    _type_info = [
+        ('chunk_type',          Unicode(default=None)),
+        ('network',             Network),
+        ('nodes',               SpyneArray(Node)),
+        ('links',               SpyneArray(Link)),
+        ('resourcegroups',      SpyneArray(ResourceGroup)),
+        ('scenarios',           SpyneArray(Scenario)),
+        ('scenario_id',         Integer(default=None)),
+        ('resourcescenarios',   SpyneArray(ResourceScenario)),
+    ]
+
+    def __init__(self, parent=None):
+        super(NetworkChunk, self).__init__()
+
+        if parent is None:
+            return
+
+        self.chunk_type = parent.chunk_type
+        if parent.chunk_type == 'NETWORK':
+            self.network = Network(parent.network)
+        elif parent.chunk_type == 'NODE':
+            self.nodes = [Node(n) for n in parent.nodes]
+        elif parent.chunk_type == 'LINK':
+            self.links = [Link(l) for l in parent.links]
+        elif parent.chunk_type == 'GROUP':
+            self.resourcegroups = [ResourceGroup(g) for g in parent.resourcegroups]
+        elif parent.chunk_type == 'SCENARIO':
+            self.scenarios = [Scenario(s) for s in parent.scenarios]
+        elif parent.chunk_type == 'RESOURCESCENARIO':
+            self.scenario_id = parent.scenario_id
+            self.resourcescenarios = [ResourceScenario(rs) for rs in parent.resourcescenarios]
+
 class NetworkExtents(HydraComplexModel):
     """
        - **network_id** Integer(default=None)
@@ -1348,6 +1481,31 @@ class User(HydraComplexModel):
         self.display_name = parent.display_name
         self.password     = parent.password
 
+class UserToken(HydraComplexModel):
+    """
+       - **id**        Integer
+       - **name**      Unicode(default=None)
+       - **last_used** Unicode(default=None)
+       - **cr_date**   Unicode(default=None)
+    """
+    _type_info = [
+        ('id',        Integer),
+        ('name',      Unicode(default=None)),
+        ('last_used', Unicode(default=None)),
+        ('cr_date',   Unicode(default=None)),
+    ]
+
+    def __init__(self, parent=None):
+        super(UserToken, self).__init__()
+
+        if parent is None:
+            return
+
+        self.id        = parent.token_id
+        self.name      = parent.token_name
+        self.last_used = str(parent.last_used) if parent.last_used is not None else None
+        self.cr_date   = str(parent.cr_date)
+
 class Perm(HydraComplexModel):
     """
        - **id**   Integer
@@ -14,7 +14,7 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 from spyne.model.primitive import Unicode, Integer
-from spyne.model.complex import Array as SpyneArray
+from spyne.model.complex import Array as SpyneArray, Iterable
 from spyne.decorator import rpc
 from hydra_complexmodels import Network,\
     Node,\
@@ -25,7 +25,8 @@ from hydra_complexmodels import Network,\
     ResourceSummary,\
     ResourceAttr,\
     ResourceScenario,\
-    ResourceData
+    ResourceData,\
+    NetworkChunk
 from HydraServer.lib import network, scenario
 from hydra_base import HydraService
 import datetime
@@ -70,8 +71,9 @@ class NetworkService(HydraService):
          Integer(),
          SpyneArray(Integer()),
          Unicode(pattern="[YN]", default='N'),
+         Unicode(pattern="[YN]", default='Y'),
          _returns=Network)
-    def get_network(ctx, network_id, include_data, template_id, scenario_ids, summary):
+    def get_network(ctx, network_id, include_data, template_id, scenario_ids, summary, include_values):
         """
         Return a whole network as a complex model.
 
@@ -81,6 +83,7 @@ class NetworkService(HydraService):
             template_id  (int)              : Optional parameter which will only return attributes on the resources that are in this template.
             scenario_ids (List(int))        : Optional parameter to indicate which scenarios to return with the network. If left unspecified, all scenarios are returned
             summary      (char) ('Y' or 'N'): Optional flag to indicate whether attributes are returned with the nodes & links. Seting to 'Y' has significant speed improvements at the cost of not retrieving attribute information.
+            include_values (char) ('Y' or 'N'): Optional flag to indicate whether dataset values are returned with the data. If 'N', each dataset is returned with its ID and hash only, and the values can be retrieved in batches using get_datasets. Defaults to 'Y'.
 
         Returns:
             hydra_complexmodels.Network: A network complex model
@@ -93,10 +96,45 @@ class NetworkService(HydraService):
                                    include_data,
                                    scenario_ids,
                                    template_id,
+                                   include_values,
                                    **ctx.in_header.__dict__)
         ret_net = Network(net, True if summary=='Y' else False)
         return ret_net
 
+    @rpc(Integer,
+         Unicode(pattern="[YN]", default='N'),
+         Integer(),
+         SpyneArray(Integer()),
+         Integer(),
+         _returns=Iterable(NetworkChunk))
+    def get_network_stream(ctx, network_id, include_data, template_id, scenario_ids, chunk_size):
+        """
+        Return a whole network as a sequence of chunks. The response is
+        streamed to the client as the chunks are read from the database, so
+        this should be used instead of get_network for very large networks.
+
+        Args:
+            network_id   (int)              : The ID of the network to retrieve
+            include_data (char) ('Y' or 'N'): Optional flag to indicate whether to return datasets with the network. Defaults to 'N'.
+            template_id  (int)              : Optional parameter which will only return attributes on the resources that are in this template.
+            scenario_ids (List(int))        : Optional parameter to indicate which scenarios to return with the network. If left unspecified, all scenarios are returned
+            chunk_size   (int)              : Optional maximum number of items in each chunk.
+
+        Returns:
+            List(hydra_complexmodels.NetworkChunk): The network, followed by chunks of its nodes, links, groups, scenarios and (if requested) data.
+
+        Raises:
+            ResourceNotFoundError: If the network is not found.
+        """
+        chunks = network.get_network_chunks(network_id,
+                                            include_data,
+                                            scenario_ids,
+                                            template_id,
+                                            chunk_size,
+                                            **ctx.in_header.__dict__)
+
+        return (NetworkChunk(c) for c in chunks)
+
     @rpc(Integer,
          _returns=Unicode)
     def get_network_as_json(ctx, network_id):
@@ -900,8 +938,8 @@ class NetworkService(HydraService):
 
         return return_ras
 
-    @rpc(Integer, Unicode(pattern="['YN']", default='N'), Unicode(pattern="['YN']", default='N'), Integer(min_occurs=0, max_occurs=1), Integer(min_occurs=0, max_occurs=1), _returns=SpyneArray(ResourceData))
-    def get_all_resource_data(ctx, scenario_id, include_values, include_metadata, page_start, page_end):
+    @rpc(Integer, Unicode(pattern="['YN']", default='N'), Unicode(pattern="['YN']", default='N'), Integer(min_occurs=0, max_occurs=1), Integer(min_occurs=0, max_occurs=1), Integer(min_occurs=0, max_occurs=1), Integer(min_occurs=0, max_occurs=1), _returns=SpyneArray(ResourceData))
+    def get_all_resource_data(ctx, scenario_id, include_values, include_metadata, page_start, page_end, last_resource_attr_id, page_size):
         """
         Return all the attributes for all the nodes in a given network and a
         given scenario.
@@ -973,6 +1011,8 @@ class NetworkService(HydraService):
             include_metadata: (string) ('Y' or 'N'): Default 'N'. Set to 'Y' to return metadata. This may vause a performance hit as metadata is BIG!
             page_start (int): The start of the search results (allows you to contol the nuber of results)
             page_end (int): The end of the search results
+            last_resource_attr_id (int): Return the results after this resource attribute. Results are ordered by resource attribute, so pass the last resource_attr_id of one page to get the next. This is faster than page_start for large scenarios.
+            page_size (int): The number of results to return after last_resource_attr_id
 
         Returns:
             List(ResourceData): A list of objects describing datasets specifically designed for efficiency
@@ -984,7 +1024,10 @@ class NetworkService(HydraService):
         node_resourcedata = network.get_all_resource_data(scenario_id,
                                                           include_metadata=include_metadata,
                                                           page_start=page_start,
-                                                          page_end=page_end)
+                                                          page_end=page_end,
+                                                          last_resource_attr_id=last_resource_attr_id,
+                                                          page_size=page_size,
+                                                          **ctx.in_header.__dict__)
 
         log.info("Qry done in %s", (datetime.datetime.now() - start))
 
@@ -999,6 +1042,29 @@ class NetworkService(HydraService):
 
         return return_ras
 
+    @rpc(Integer, Unicode(pattern="['YN']", default='N'), Unicode(pattern="['YN']", default='N'), Integer(min_occurs=0, max_occurs=1), _returns=Iterable(ResourceData))
+    def get_all_resource_data_stream(ctx, scenario_id, include_values, include_metadata, chunk_size):
+        """
+        Return all the data in a scenario, as get_all_resource_data does. The
+        response is streamed to the client as the data is read from the database,
+        so this should be used to export very large scenarios.
+
+        Args:
+            scenario_id (int): The scenario to search
+            include_values (string) ('Y' or 'N'): Default 'N'. Set to 'Y' to return the values.
+            include_metadata: (string) ('Y' or 'N'): Default 'N'. Set to 'Y' to return metadata.
+            chunk_size (int): The number of results read from the database at a time. Defaults to the 'stream_chunk_size' setting in the config.
+
+        Returns:
+            Iterable(ResourceData): The data in the scenario, ordered by resource attribute
+        """
+        resourcedata = network.get_all_resource_data_stream(scenario_id,
+                                                            include_metadata=include_metadata,
+                                                            chunk_size=chunk_size,
+                                                            **ctx.in_header.__dict__)
+
+        return (ResourceData(ra, include_values) for ra in resourcedata)
+
     @rpc(Integer, Integer, Integer(max_occurs="unbounded"), Unicode(pattern="['YN']", default='N'), _returns=SpyneArray(ResourceAttr))
     def get_all_link_data(ctx, network_id, scenario_id, link_ids, include_metadata):
         """
@@ -14,7 +14,7 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 from spyne.model.primitive import Integer, Integer32, Unicode
-from spyne.model.complex import Array as SpyneArray
+from spyne.model.complex import Array as SpyneArray, Iterable
 from spyne.decorator import rpc
 from hydra_complexmodels import Scenario,\
         ResourceScenario,\
@@ -22,7 +22,9 @@ from hydra_complexmodels import Scenario,\
         ResourceAttr,\
         AttributeData,\
         ResourceGroupItem,\
-        ScenarioDiff
+        ScenarioDiff,\
+        ResourceScenarioDiff,\
+        ScenarioMatrix
 
 import logging
 log = logging.getLogger(__name__)
@@ -114,14 +116,126 @@ class ScenarioService(HydraService):
 
         return Scenario(cloned_scen, summary=True)
 
-    @rpc(Integer, Integer, _returns=ScenarioDiff)
-    def compare_scenarios(ctx, scenario_id_1, scenario_id_2):
+    @rpc(Integer,
+         SpyneArray(Integer),
+         SpyneArray(Integer),
+         SpyneArray(Integer),
+         SpyneArray(Integer),
+         SpyneArray(Integer),
+         _returns=Scenario)
+    def clone_scenario_subset(ctx, scenario_id, attr_ids, type_ids, node_ids, link_ids, group_ids):
+        """
+            Clone a scenario with only some of its data: that of the given
+            attributes, of resources with the given types, or of the given
+            nodes, links and groups. Filters which are not specified are not used.
+        """
+        cloned_scen = scenario.clone_scenario_subset(scenario_id,
+                                                     attr_ids=attr_ids,
+                                                     type_ids=type_ids,
+                                                     node_ids=node_ids,
+                                                     link_ids=link_ids,
+                                                     group_ids=group_ids,
+                                                     **ctx.in_header.__dict__)
+
+        return Scenario(cloned_scen, summary=True)
+
+    @rpc(Integer, Unicode(default=None), Unicode(default=None), _returns=Scenario)
+    def add_child_scenario(ctx, scenario_id, name, description):
+        """
+            Create a scenario which inherits the data of another. Only data
+            which is set on the child scenario is stored in it. All other
+            data is read from the parent.
+        """
+        child_scen = scenario.add_child_scenario(scenario_id,
+                                                 name=name,
+                                                 description=description,
+                                                 **ctx.in_header.__dict__)
+
+        return Scenario(child_scen, summary=True)
+
+    @rpc(Integer, Integer, Unicode(pattern="['YN']", default='N'), Integer(min_occurs=0, max_occurs=1), Integer(min_occurs=0, max_occurs=1), _returns=ScenarioDiff)
+    def compare_scenarios(ctx, scenario_id_1, scenario_id_2, summary, last_resource_attr_id, page_size):
+        """
+            Compare the data and resource group items of two scenarios
+            in the same network.
+
+            Args:
+                scenario_id_1 (int): The first scenario
+                scenario_id_2 (int): The second scenario
+                summary (string) ('Y' or 'N'): Default 'N'. Set to 'Y' to return only the IDs of the datasets which differ.
+                last_resource_attr_id (int) (optional): Return the differences after this resource attribute.
+                page_size (int) (optional): The maximum number of differences to return.
+
+            Returns:
+                ScenarioDiff: The differences, ordered by resource attribute. If summary or page_size is set, num_resourcescenarios is the total number of differences.
+
+            Raises:
+                HydraError: If the scenarios are not in the same network
+        """
         scenariodiff = scenario.compare_scenarios(scenario_id_1,
                                                   scenario_id_2,
+                                                  summary=summary,
+                                                  last_resource_attr_id=last_resource_attr_id,
+                                                  page_size=page_size,
                                                   **ctx.in_header.__dict__)
 
         return ScenarioDiff(scenariodiff)
 
+    @rpc(Integer, Integer, Unicode(pattern="['YN']", default='N'), Integer(min_occurs=0, max_occurs=1), _returns=Iterable(ResourceScenarioDiff))
+    def compare_scenarios_stream(ctx, scenario_id_1, scenario_id_2, summary, chunk_size):
+        """
+            Return the differences between the data of two scenarios, as
+            compare_scenarios does. The response is streamed to the client
+            as the differences are found, so this should be used to compare
+            very large scenarios.
+
+            Args:
+                scenario_id_1 (int): The first scenario
+                scenario_id_2 (int): The second scenario
+                summary (string) ('Y' or 'N'): Default 'N'. Set to 'Y' to return only the IDs of the datasets which differ.
+                chunk_size (int): The number of differences read from the database at a time. Defaults to the 'stream_chunk_size' setting in the config.
+
+            Returns:
+                Iterable(ResourceScenarioDiff): The differences, ordered by resource attribute
+        """
+        resource_diffs = scenario.compare_scenarios_stream(scenario_id_1,
+                                                           scenario_id_2,
+                                                           summary=summary,
+                                                           chunk_size=chunk_size,
+                                                           **ctx.in_header.__dict__)
+
+        return (ResourceScenarioDiff(rd) for rd in resource_diffs)
+
+
+    @rpc(SpyneArray(Integer),
+         SpyneArray(Integer),
+         SpyneArray(Integer),
+         Unicode(pattern="['YN']", default='N'),
+         _returns=ScenarioMatrix)
+    def get_scenario_matrix(ctx, scenario_ids, attr_ids, type_ids, only_differences):
+        """
+            Compare the data of several scenarios in the same network at once.
+
+            Args:
+                scenario_ids (List(int)): The scenarios to compare
+                attr_ids (List(int)) (optional): Only compare the data of these attributes
+                type_ids (List(int)) (optional): Only compare the data of resources with these types
+                only_differences (string) ('Y' or 'N'): Default 'N'. Set to 'Y' to return only the resource attributes whose data is not the same in all the scenarios.
+
+            Returns:
+                ScenarioMatrix: For each resource attribute, the ID of its dataset in each scenario, in the order of scenario_ids, and its distinct dataset IDs.
+
+            Raises:
+                ResourceNotFoundError: If a scenario is not found
+                HydraError: If the scenarios are not in the same network
+        """
+        matrix = scenario.get_scenario_matrix(scenario_ids,
+                                              attr_ids=attr_ids,
+                                              type_ids=type_ids,
+                                              only_differences=only_differences,
+                                              **ctx.in_header.__dict__)
+
+        return ScenarioMatrix(matrix)
 
     @rpc(Integer, _returns=Unicode)
     def lock_scenario(ctx, scenario_id):
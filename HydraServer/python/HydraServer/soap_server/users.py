@@ -18,7 +18,8 @@ from spyne.model.complex import Array as SpyneArray
 from spyne.decorator import rpc
 from hydra_complexmodels import User,\
         Role,\
-        Perm
+        Perm,\
+        UserToken
 
 from hydra_base import HydraService
 from HydraServer.lib import users
@@ -113,6 +114,53 @@ class UserService(HydraService):
 
         return User(user_i)
 
+    @rpc(Unicode, _returns=Unicode)
+    def add_user_token(ctx, token_name):
+        """
+        Create an API token for the current user, which can be used to
+        log in (using login_with_token) instead of a username and password.
+
+        Args:
+            token_name (string): A name to identify the token.
+
+        Returns:
+            string: The token. This can't be retrieved again, so must be kept safe.
+        """
+        token = users.add_user_token(token_name, **ctx.in_header.__dict__)
+
+        return token
+
+    @rpc(_returns=SpyneArray(UserToken))
+    def get_user_tokens(ctx):
+        """
+        Get the API tokens of the current user. The tokens themselves
+        are not returned.
+
+        Returns:
+            List(hydra_complexmodels.UserToken): The user's tokens.
+        """
+        tokens = users.get_user_tokens(**ctx.in_header.__dict__)
+
+        return [UserToken(t) for t in tokens]
+
+    @rpc(Integer, _returns=Unicode)
+    def delete_user_token(ctx, token_id):
+        """
+        Delete one of the current user's API tokens, so it can no longer be used.
+
+        Args:
+            token_id (int): The ID of the token to delete.
+
+        Returns:
+            string: 'OK'
+
+        Raises:
+            ResourceNotFoundError: If the token is not found
+        """
+        success = users.delete_user_token(token_id, **ctx.in_header.__dict__)
+
+        return success
+
     @rpc(Unicode, _returns=User)
     def get_user_by_name(ctx, username):
         """
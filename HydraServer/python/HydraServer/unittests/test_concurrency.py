@@ -17,6 +17,9 @@
 # -*- coding: utf-8 -*-
 import unittest
 import logging
+import sys
+import time
+import threading
 
 from multiprocessing import Process
 import server
@@ -62,8 +65,115 @@ class ConcurrencyTest(server.SoapServerTest):
 
         client.service.logout(user)
 
+def _percentile(sorted_times, percent):
+    if len(sorted_times) == 0:
+        return 0.0
+    idx = int(round((percent / 100.0) * (len(sorted_times) - 1)))
+    return sorted_times[idx]
+
+def run_load_test(url, operation, users=10, requests_per_user=10):
+    """
+        Call operation(client) requests_per_user times from each of a number
+        of threads, each of which has its own client and login session.
+        Returns the throughput (requests / second), latency percentiles (seconds)
+        and number of failed requests.
+    """
+    times  = []
+    errors = []
+    lock = threading.Lock()
+
+    def do_requests():
+        client = util.connect(url)
+        util.login(client, 'root', '')
+        for i in range(requests_per_user):
+            start = time.time()
+            try:
+                operation(client)
+            except Exception, e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                times.append(time.time() - start)
+
+    threads = [threading.Thread(target=do_requests) for i in range(users)]
+
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    times.sort()
+    stats = dict(
+        requests   = len(times),
+        errors     = len(errors),
+        throughput = len(times) / elapsed,
+        p50        = _percentile(times, 50),
+        p90        = _percentile(times, 90),
+        p99        = _percentile(times, 99),
+        max        = _percentile(times, 100),
+    )
+
+    for e in errors[:5]:
+        log.critical("Request failed: %s", e)
+
+    return stats
+
+def format_stats(stats):
+    return ("%(requests)s requests, %(errors)s errors, %(throughput).1f requests/s. "
+            "Latency: p50 %(p50).3fs, p90 %(p90).3fs, p99 %(p99).3fs, max %(max).3fs"%stats)
+
+class LoadTest(server.SoapServerTest):
+    """
+        Measure the throughput and latency of the local server
+        when several users make requests at once.
+    """
+    users = 10
+    requests_per_user = 5
+
+    def test_concurrent_get_network(self):
+        net = self.create_network_with_data(ret_full_net=False)
+
+        stats = run_load_test(self.url,
+                              lambda client: client.service.get_network(net.id, 'Y'),
+                              self.users, self.requests_per_user)
+
+        log.info("get_network: %s", format_stats(stats))
+
+        assert stats['errors'] == 0
+        assert stats['requests'] == self.users * self.requests_per_user
+
+    def test_concurrent_reads_and_writes(self):
+        net = self.create_network_with_data(ret_full_net=False)
+        scenario_id = net.scenarios.Scenario[0].id
+
+        def operation(client):
+            client.service.get_network(net.id, 'N')
+            client.service.clone_scenario(scenario_id)
+
+        stats = run_load_test(self.url, operation, self.users, self.requests_per_user)
+
+        log.info("get_network and clone_scenario: %s", format_stats(stats))
+
+        assert stats['errors'] == 0
+
 def run():
     unittest.main()
 
 if __name__ == '__main__':
-    run()  # all tests
+    #To run a load test against a server:
+    #python test_concurrency.py load <network_id> [users] [requests per user] [url]
+    if len(sys.argv) > 2 and sys.argv[1] == 'load':
+        logging.basicConfig(level='INFO')
+        network_id = int(sys.argv[2])
+        users = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+        requests_per_user = int(sys.argv[4]) if len(sys.argv) > 4 else 10
+        load_url = sys.argv[5] if len(sys.argv) > 5 else None
+        stats = run_load_test(load_url,
+                              lambda client: client.service.get_network(network_id, 'Y'),
+                              users, requests_per_user)
+        print format_stats(stats)
+    else:
+        run()  # all tests
@@ -21,6 +21,17 @@ import datetime
 import logging
 from suds import WebFault
 import json
+import unittest
+import base64
+import numpy
+from cStringIO import StringIO
+import threading
+import transaction
+from HydraServer.util.cache import ValueCache
+from HydraServer.util import generate_data_hash
+from HydraServer.db import DBSession
+from HydraServer.db.model import Dataset, Metadata
+from HydraServer.lib import data
 log = logging.getLogger(__name__)
 
 class TimeSeriesTest(server.SoapServerTest):
@@ -228,6 +239,84 @@ class TimeSeriesTest(server.SoapServerTest):
         for val in data:
             assert original_val == val
 
+    def test_vals_at_time_matrix(self):
+        """
+            Test that get_vals_at_time_matrix returns the same values
+            as get_multiple_vals_at_time, as a (dataset x timestamp) array.
+        """
+        datasets = self.client.factory.create('ns1:DatasetArray')
+        for i in range(3):
+            ts_val = {0: {'2014-01-01T00:00:00.000000000Z': i,
+                          '2014-02-01T00:00:00.000000000Z': i + 0.5}}
+            datasets.Dataset.append(dict(
+                id=None,
+                type = 'timeseries',
+                name = 'Matrix timeseries %s %s'%(i, datetime.datetime.now()),
+                unit = 'm^3',
+                dimension = 'Volume',
+                hidden = 'N',
+                value = json.dumps(ts_val),
+            ))
+        datasets.Dataset.append(dict(
+            id=None,
+            type = 'scalar',
+            name = 'Matrix scalar',
+            unit = 'm^3',
+            dimension = 'Volume',
+            hidden = 'N',
+            value = 1,
+        ))
+
+        dataset_ids = self.client.service.bulk_insert_data(datasets).integer
+
+        qry_times = [
+            datetime.datetime(2013, 12, 01, 00, 00, 00),
+            datetime.datetime(2014, 01, 10, 00, 00, 00),
+            datetime.datetime(2014, 03, 10, 00, 00, 00),
+        ]
+
+        matrix = self.client.service.get_vals_at_time_matrix(dataset_ids, qry_times)
+        values = numpy.load(StringIO(base64.b64decode(matrix.values)))
+
+        assert values.shape == (4, 3)
+        for i in range(3):
+            assert numpy.isnan(values[i][0])
+            assert values[i][1] == i
+            assert values[i][2] == i + 0.5
+        assert numpy.isnan(values[3]).all()
+
+        multiple_vals = self.client.service.get_multiple_vals_at_time(dataset_ids, qry_times)
+        for i in range(3):
+            vals = json.loads(multiple_vals['dataset_%s'%dataset_ids[i]])
+            assert vals[str(qry_times[0])] is None
+            assert vals[str(qry_times[1])] == values[i][1]
+            assert vals[str(qry_times[2])] == values[i][2]
+
+    def test_value_cache(self):
+        """
+            Test that a timeseries is only parsed the first time
+            values are retrieved from it.
+        """
+        net = self.create_network_with_data()
+        scenario = net.scenarios.Scenario[0]
+        val_to_query = None
+        for d in scenario.resourcescenarios.ResourceScenario:
+            if d.value.type == 'timeseries':
+                val_to_query = d.value
+                break
+
+        query_time = datetime.datetime.now()
+
+        self.client.service.get_val_at_time(val_to_query.id, query_time)
+        before = self.client.service.get_value_cache_stats()
+
+        self.client.service.get_val_at_time(val_to_query.id, query_time)
+        after = self.client.service.get_value_cache_stats()
+
+        assert int(after['hits']) == int(before['hits']) + 1
+        assert int(after['misses']) == int(before['misses'])
+        assert int(after['size']) > 0
+
     def test_get_data_between_times(self):
         net = self.create_network_with_data()
         scenario = net.scenarios.Scenario[0]
@@ -259,6 +348,50 @@ class TimeSeriesTest(server.SoapServerTest):
             x = val_a
             assert x == val_a
 
+    def test_get_data_between_times_in_months(self):
+        """
+            Test that monthly steps are added one after the other,
+            and that the data can be returned as a binary array.
+        """
+        datasets = self.client.factory.create('ns1:DatasetArray')
+        ts_val = {0: {'2014-01-01T00:00:00.000000000Z': 1.0,
+                      '2014-02-15T00:00:00.000000000Z': 2.0,
+                      '2014-04-01T00:00:00.000000000Z': 3.0}}
+        datasets.Dataset.append(dict(
+            id=None,
+            type = 'timeseries',
+            name = 'Monthly timeseries %s'%(datetime.datetime.now()),
+            unit = 'm^3',
+            dimension = 'Volume',
+            hidden = 'N',
+            value = json.dumps(ts_val),
+        ))
+        dataset_id = self.client.service.bulk_insert_data(datasets).integer[0]
+
+        #31 Jan, 28 Feb, 28 Mar, 28 Apr, 28 May
+        vals = self.client.service.get_vals_between_times(
+            dataset_id,
+            datetime.datetime(2014, 01, 31),
+            datetime.datetime(2014, 05, 01),
+            'months',
+            1,
+            )
+        assert json.loads(vals.data) == [1.0, 2.0, 2.0, 3.0, 3.0]
+
+        #31 Dec, 31 Jan, 28 Feb, 28 Mar
+        binary_vals = self.client.service.get_vals_between_times(
+            dataset_id,
+            datetime.datetime(2013, 12, 31),
+            datetime.datetime(2014, 03, 01),
+            'months',
+            1,
+            'Y',
+            )
+        values = numpy.load(StringIO(base64.b64decode(binary_vals.data)))
+        assert values.shape == (4, 1)
+        assert numpy.isnan(values[0][0])
+        assert values[1:, 0].tolist() == [1.0, 2.0, 2.0]
+
     def test_descriptor_get_data_between_times(self):
         net = self.create_network_with_data()
         scenario = net.scenarios.Scenario[0]
@@ -357,6 +490,136 @@ class TimeSeriesTest(server.SoapServerTest):
 #                #Get one of the datasets, make it uneven and update it.
 #                self.assertRaises(WebFault, self.client.service.update_dataset,rs)
 
+class ValueCacheTest(unittest.TestCase):
+    """
+        Test the memory accounting of the cache of decoded values.
+    """
+    def test_eviction(self):
+        value = [float(i) for i in range(1000)]
+        cache = ValueCache()
+
+        cache.set(1, 100, value)
+        #Make room for two values.
+        cache.max_bytes = cache.size * 2
+
+        cache.set(2, 200, value)
+        assert cache.get(1, 100) is value
+
+        #Dataset 2 is now the least recently used, so is removed.
+        cache.set(3, 300, value)
+        assert cache.get(2, 200) is None
+        assert cache.get(1, 100) is value
+        assert cache.get(3, 300) is value
+
+        #A changed dataset has a different hash.
+        assert cache.get(1, 101) is None
+
+        stats = cache.stats()
+        assert stats['entries'] == 2
+        assert stats['evictions'] == 1
+        assert stats['hits'] == 3
+        assert stats['misses'] == 2
+        assert stats['size'] <= stats['max_size']
+
+    def test_value_too_large(self):
+        cache = ValueCache(max_bytes=100)
+        cache.set(1, 100, [float(i) for i in range(1000)])
+        assert cache.get(1, 100) is None
+        assert cache.stats()['size'] == 0
+
+class ConcurrentInsertTest(unittest.TestCase):
+    """
+        Test inserting data which another request inserts at the same time.
+        This uses the library directly, so that the other request can insert
+        the data after this one has checked that it is not in the DB.
+    """
+    user_id = 1
+
+    def setUp(self):
+        self.get_existing_data = data._get_existing_data
+
+    def tearDown(self):
+        data._get_existing_data = self.get_existing_data
+        transaction.abort()
+        DBSession.remove()
+
+    def _make_data(self):
+        dataset_dict = dict(
+            data_type  = 'descriptor',
+            data_name  = 'Concurrent insert',
+            data_units = None,
+            data_dimen = None,
+            created_by = self.user_id,
+            frequency  = None,
+            start_time = None,
+            value      = 'concurrent %s'%(datetime.datetime.now()),
+            metadata   = {u'source' : u'concurrent insert test'},
+        )
+        dataset_dict['data_hash'] = generate_data_hash(dataset_dict)
+
+        class IncomingData(object):
+            data_hash = dataset_dict['data_hash']
+
+        return IncomingData(), dataset_dict
+
+    def _insert_in_other_request(self, incoming, dataset_dict, hidden):
+        try:
+            inserted = data._insert_processed_data([incoming],
+                        {dataset_dict['data_hash'] : dataset_dict}, self.user_id)
+            self.other_dataset_id = inserted[0].dataset_id
+            if hidden == 'Y':
+                DBSession.query(Dataset).filter(
+                    Dataset.dataset_id==self.other_dataset_id).update(
+                    {Dataset.hidden : 'Y'}, synchronize_session=False)
+            transaction.commit()
+        finally:
+            DBSession.remove()
+
+    def _insert_during_race(self, hidden='N'):
+        """
+            Insert a dataset, having another request insert the
+            same dataset just after the check for existing data.
+        """
+        incoming, dataset_dict = self._make_data()
+
+        def get_existing_data(hashes, user_id=None, lock=False):
+            existing_data = self.get_existing_data(hashes, user_id, lock)
+            data._get_existing_data = self.get_existing_data
+
+            other_request = threading.Thread(target=self._insert_in_other_request,
+                                             args=(incoming, dict(dataset_dict), hidden))
+            other_request.start()
+            other_request.join()
+
+            return existing_data
+
+        data._get_existing_data = get_existing_data
+        inserted = data._insert_processed_data([incoming],
+                    {dataset_dict['data_hash'] : dataset_dict}, self.user_id)
+        dataset_id = inserted[0].dataset_id
+        transaction.commit()
+        DBSession.remove()
+
+        return dataset_id, dataset_dict
+
+    def test_insert_race(self):
+        dataset_id, dataset_dict = self._insert_during_race()
+
+        assert dataset_id == self.other_dataset_id, \
+                "The dataset inserted by the other request should be used"
+
+        num_metadata = DBSession.query(Metadata).filter(
+                            Metadata.dataset_id==dataset_id).count()
+        assert num_metadata == len(dataset_dict['metadata']), \
+                "Metadata should only be inserted once"
+
+    def test_insert_race_hidden(self):
+        dataset_id, dataset_dict = self._insert_during_race(hidden='Y')
+
+        assert dataset_id is not None
+        assert dataset_id != self.other_dataset_id, \
+                "A hidden dataset of another user should not be used"
+
 class DataCollectionTest(server.SoapServerTest):
 
     def test_get_collections_like_name(self):
@@ -1031,6 +1294,30 @@ class RetrievalTest(server.SoapServerTest):
         for rs in res_scenarios:
             assert rs.resource_attr_id in ra_ids
 
+    def test_bulk_insert_duplicate_data(self):
+        """
+            Test that data which appears more than once in a bulk insert,
+            or which is already in the DB, is only inserted once.
+        """
+        datasets = self.client.factory.create('ns1:DatasetArray')
+        scalar = self._create_scalar()
+        scalar['value'] = datetime.datetime.now().microsecond
+        descriptor = self._create_descriptor()
+        descriptor['value'] = 'bulk insert %s'%(datetime.datetime.now())
+        datasets.Dataset.append(scalar)
+        datasets.Dataset.append(descriptor)
+        datasets.Dataset.append(scalar)
+
+        dataset_ids = self.client.service.bulk_insert_data(datasets).integer
+
+        assert len(dataset_ids) == 3
+        assert dataset_ids[0] == dataset_ids[2]
+        assert dataset_ids[0] != dataset_ids[1]
+
+        repeated_ids = self.client.service.bulk_insert_data(datasets).integer
+
+        assert repeated_ids == dataset_ids
+
     def _create_scalar(self):
 
         scalar = dict(
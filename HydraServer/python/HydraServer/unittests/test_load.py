@@ -19,9 +19,24 @@
 
 import server
 import timeit
+import unittest
+import sys
+import datetime
 import logging
 log = logging.getLogger(__name__)
 import cProfile, pstats, StringIO
+import json
+import zlib
+import subprocess
+
+from HydraServer.lib.network import dictobj, NodeRecord, ResourceScenarioRecord,\
+        ResourceAttrRecord, DatasetRecord
+from HydraServer.util import generate_data_hash, encode_timeseries, decode_timeseries,\
+        TIMESERIES_MAGIC, TIMESERIES_VERSION
+from HydraLib.units import Units
+import pandas as pd
+import numpy
+from test_concurrency import run_load_test, format_stats
 
 class NetworkTest(server.SoapServerTest):
     """
@@ -36,10 +51,382 @@ class NetworkTest(server.SoapServerTest):
         log.debug(time)
         assert time < 50
 
+    def test_get_network_scenario_filter(self):
+        """
+            Compare the time taken to retrieve a network with data
+            in one scenario against retrieving it with data in all scenarios.
+            Filtering by scenario should be faster, as only the data
+            for the requested scenario is queried.
+        """
+        net = self.create_network_with_data(num_nodes=100, ret_full_net=False)
+        scenario_id = net.scenarios.Scenario[0].id
+
+        for i in range(10):
+            self.client.service.clone_scenario(scenario_id)
+
+        scen_ids = self.client.factory.create("integerArray")
+        scen_ids.integer.append(scenario_id)
+
+        get_one = lambda: self.client.service.get_network(net.id, 'Y', None, scen_ids)
+        get_all = lambda: self.client.service.get_network(net.id, 'Y')
+
+        one_time = timeit.Timer(get_one).timeit(number=3)
+        all_time = timeit.Timer(get_all).timeit(number=3)
+        log.info("One scenario: %s, all scenarios: %s (%.1fx faster)",
+                 one_time, all_time, all_time / one_time)
+
+        partial_network = get_one()
+        assert len(partial_network.scenarios.Scenario) == 1
+        #One scenario of eleven should be quicker. The margin allows for noise.
+        assert one_time < all_time * 2
+
+    def test_validate_large_network(self):
+        """
+            Validate the scenario and the network structure of a network
+            with 1000 nodes against its template.
+        """
+        net = self.create_network_with_data(num_nodes=1000, ret_full_net=False)
+        scenario_id = net.scenarios.Scenario[0].id
+        template_id = self.client.service.get_network(net.id, 'N').types.TypeSummary[0].template_id
+
+        validate_scenario = lambda: self.client.service.validate_scenario(scenario_id, template_id)
+        validate_network  = lambda: self.client.service.validate_network(net.id, template_id, scenario_id)
+
+        scenario_time = timeit.Timer(validate_scenario).timeit(number=1)
+        network_time  = timeit.Timer(validate_network).timeit(number=1)
+        log.info("Validate scenario: %s, validate network: %s", scenario_time, network_time)
+
+        assert scenario_time < 10
+        assert network_time < 10
+
+    def test_update_resourcedata(self):
+        """
+            Time writing new values to every resource attribute of
+            a network, as a model does when it saves its results.
+        """
+        net = self.create_network_with_data(num_nodes=1000)
+        scenario_id = net.scenarios.Scenario[0].id
+
+        def make_values(offset):
+            rs_array = self.client.factory.create('ns1:ResourceScenarioArray')
+            for node in net.nodes.Node:
+                for ra in node.attributes.ResourceAttr:
+                    rs_array.ResourceScenario.append(self.create_scalar(ra, offset + ra.id))
+            return rs_array
+
+        values = make_values(0.5)
+        update = lambda: self.client.service.update_resourcedata(scenario_id, values)
+        update_time = timeit.Timer(update).timeit(number=1)
+
+        scen_ids = self.client.factory.create("integerArray")
+        scen_ids.integer.append(scenario_id)
+        values = make_values(1.5)
+        bulk_update = lambda: self.client.service.bulk_update_resourcedata(scen_ids, values)
+        bulk_time = timeit.Timer(bulk_update).timeit(number=1)
+
+        num_values = len(values.ResourceScenario)
+        log.info("%s values. update_resourcedata: %.0f writes/s, bulk_update_resourcedata: %.0f writes/s",
+                 num_values, num_values / update_time, num_values / bulk_time)
+
+        scenario = self.client.service.get_scenario(scenario_id)
+        new_values = dict((rs.resource_attr_id, float(rs.value.value))
+                          for rs in scenario.resourcescenarios.ResourceScenario)
+        for rs in values.ResourceScenario:
+            assert new_values[rs['resource_attr_id']] == rs['value']['value']
+
     #def test_get_network(self):
     #    n = self.client.service.get_network(1000)
     #    log.info(n)
 
+class _Row(dict):
+    """
+        Stands in for a database row, which can be accessed
+        by attribute or by key.
+    """
+    def __getattr__(self, name):
+        return self[name]
+
+def _size_of(obj, seen=None):
+    """
+        Approximate the memory used by an object and everything it refers to.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size = size + _size_of(k, seen) + _size_of(v, seen)
+    elif isinstance(obj, (list, tuple)):
+        for v in obj:
+            size = size + _size_of(v, seen)
+    elif hasattr(obj, '__slots__'):
+        for k, v in obj.items():
+            size = size + _size_of(v, seen)
+    return size
+
+class NetworkAssemblyTest(unittest.TestCase):
+    """
+        Compare the memory and time used to assemble a large network
+        (10000 nodes, each with data) using dictobj and using records.
+    """
+    num_nodes = 10000
+    rs_per_node = 5
+
+    def setUp(self):
+        cr_date = datetime.datetime.now()
+        self.node_rows = []
+        self.rs_rows = []
+        for i in range(self.num_nodes):
+            self.node_rows.append(_Row(
+                node_id=i, network_id=1, node_description="Node %s"%i,
+                node_name="Node %s"%i, status='A', node_x=i, node_y=i,
+                layout=None, cr_date=cr_date))
+            for j in range(self.rs_per_node):
+                self.rs_rows.append(_Row(
+                    resource_attr_id=i*self.rs_per_node+j, scenario_id=1,
+                    dataset_id=i*self.rs_per_node+j, source='test',
+                    cr_date=cr_date, attr_id=j, data_type='scalar',
+                    data_units='m', data_dimen='Length', data_name='Dataset',
+                    data_hash=i, created_by=1, hidden='N', start_time=None,
+                    frequency=None, value=str(i)))
+
+    def assemble_with_dictobj(self):
+        extras = {'types':[], 'attributes':[]}
+        nodes = [dictobj(n, extras) for n in self.node_rows]
+        rs = []
+        for r in self.rs_rows:
+            rs_obj = dictobj(r)
+            rs_obj.resourceattr = dictobj({'attr_id':r.attr_id})
+            rs_obj.dataset = dictobj({
+                'dataset_id':r.dataset_id, 'data_type':r.data_type,
+                'data_units':r.data_units, 'data_dimen':r.data_dimen,
+                'data_name':r.data_name, 'data_hash':r.data_hash,
+                'cr_date':r.cr_date, 'created_by':r.created_by,
+                'hidden':r.hidden, 'start_time':r.start_time,
+                'frequency':r.frequency, 'value':r.value, 'metadata':[]})
+            rs.append(rs_obj)
+        return nodes, rs
+
+    def assemble_with_records(self):
+        nodes = [NodeRecord.from_row(n, types=[], attributes=[]) for n in self.node_rows]
+        rs = []
+        for r in self.rs_rows:
+            dataset = DatasetRecord.from_row(r, metadata=[])
+            rs.append(ResourceScenarioRecord.from_row(r,
+                                    resourceattr=ResourceAttrRecord(r.attr_id),
+                                    dataset=dataset))
+        return nodes, rs
+
+    def test_record_assembly(self):
+        dictobj_time = timeit.Timer(self.assemble_with_dictobj).timeit(number=3)
+        record_time  = timeit.Timer(self.assemble_with_records).timeit(number=3)
+
+        #Only count the objects built during assembly, not the rows.
+        seen = set()
+        _size_of(self.node_rows, seen)
+        _size_of(self.rs_rows, seen)
+
+        dictobj_size = _size_of(self.assemble_with_dictobj(), set(seen))
+        record_size  = _size_of(self.assemble_with_records(), set(seen))
+
+        log.info("dictobj: %s bytes in %ss. records: %s bytes in %ss",
+                 dictobj_size, dictobj_time, record_size, record_time)
+
+        assert record_size < dictobj_size / 2
+
+class LoginLoadTest(server.SoapServerTest):
+    """
+        Measure login throughput when several plugins log in at once,
+        with passwords and with API tokens.
+    """
+    plugins = 5
+    logins_per_plugin = 10
+
+    def test_concurrent_logins(self):
+        password_stats = run_load_test(self.url,
+                                       lambda client: client.service.login('root', ''),
+                                       self.plugins, self.logins_per_plugin)
+        log.info("Password logins: %s", format_stats(password_stats))
+
+        token = self.client.service.add_user_token("Load test")
+        token_stats = run_load_test(self.url,
+                                    lambda client: client.service.login_with_token(token),
+                                    self.plugins, self.logins_per_plugin)
+        log.info("Token logins: %s", format_stats(token_stats))
+
+        assert password_stats['errors'] == 0
+        assert token_stats['errors'] == 0
+
+class DataHashTest(unittest.TestCase):
+    """
+        Measure how fast large timeseries are hashed, and check that
+        the hash is the same in a different process.
+    """
+    num_timesteps = 200000
+
+    def setUp(self):
+        start = datetime.datetime(2000, 1, 1)
+        ts = {}
+        for i in range(self.num_timesteps):
+            ts[(start + datetime.timedelta(hours=i)).isoformat()] = i * 1.5
+        self.value = json.dumps({'0': ts})
+        self.dataset = dict(data_name  = 'Large timeseries',
+                            data_units = 'm^3',
+                            data_dimen = 'Volume',
+                            data_type  = 'timeseries',
+                            value      = self.value,
+                            metadata   = {'source':'test', 'user_id':'1'})
+
+    def hash_dataset(self):
+        return generate_data_hash(dict(self.dataset))
+
+    def test_hash_throughput(self):
+        hash_time = timeit.Timer(self.hash_dataset).timeit(number=5) / 5
+        size_mb = len(self.value) / (1024.0 * 1024.0)
+        log.info("Hashed %.1fMB in %.3fs (%.1fMB/s)",
+                 size_mb, hash_time, size_mb / hash_time)
+
+        assert size_mb / hash_time > 20
+
+    def test_hash_is_stable(self):
+        data_hash = self.hash_dataset()
+
+        compressed = dict(self.dataset)
+        compressed['value'] = zlib.compress(self.value)
+        assert generate_data_hash(compressed) == data_hash
+
+        reordered = dict(self.dataset)
+        reordered['metadata'] = {'user_id':'1', 'source':'test'}
+        assert generate_data_hash(reordered) == data_hash
+
+        #The payload of a binary timeseries is compressed, but the
+        #hash must not depend on how zlib compressed it.
+        payload = self.value * 2
+        fast = dict(self.dataset)
+        fast['value'] = TIMESERIES_MAGIC + chr(TIMESERIES_VERSION) + zlib.compress(payload, 1)
+        best = dict(self.dataset)
+        best['value'] = TIMESERIES_MAGIC + chr(TIMESERIES_VERSION) + zlib.compress(payload, 9)
+        assert fast['value'] != best['value']
+        assert generate_data_hash(fast) == generate_data_hash(best)
+
+        small = dict(data_name='a', data_units='b', data_dimen='c',
+                     data_type='scalar', value='1', metadata={})
+        code = "from HydraServer.util import generate_data_hash; print generate_data_hash(%r)"%small
+        other_process_hash = subprocess.check_output([sys.executable, '-c', code])
+        assert int(other_process_hash.strip().split()[-1]) == generate_data_hash(dict(small))
+
+class MultipleValsAtTimeTest(server.SoapServerTest):
+    """
+        Time retrieving the values of increasing numbers of timeseries at a
+        single time, as a simulation model does at each timestep.
+    """
+    def add_timeseries(self, num_datasets):
+        index = pd.date_range('2000-01-01', periods=365*24, freq='H')
+        now = datetime.datetime.now()
+        datasets = self.client.factory.create('ns1:DatasetArray')
+        for i in range(num_datasets):
+            ts = pd.DataFrame({0: numpy.random.rand(len(index))}, index=index)
+            datasets.Dataset.append(dict(
+                id=None,
+                type = 'timeseries',
+                name = 'Load timeseries %s %s'%(i, now),
+                unit = 'm^3',
+                dimension = 'Volume',
+                hidden = 'N',
+                value = ts.to_json(date_format='iso', date_unit='ns'),
+            ))
+        return self.client.service.bulk_insert_data(datasets).integer
+
+    def test_multiple_vals_at_time(self):
+        dataset_ids = self.add_timeseries(1000)
+        qry_times = [datetime.datetime(2000, 06, 01, 12, 30)]
+
+        for num_datasets in (10, 100, 1000):
+            ids = dataset_ids[:num_datasets]
+
+            get_json   = lambda: self.client.service.get_multiple_vals_at_time(ids, qry_times)
+            get_matrix = lambda: self.client.service.get_vals_at_time_matrix(ids, qry_times)
+
+            #The first call parses the timeseries, later ones use the cache.
+            first_time = timeit.Timer(get_matrix).timeit(number=1)
+            json_time   = timeit.Timer(get_json).timeit(number=3) / 3
+            matrix_time = timeit.Timer(get_matrix).timeit(number=3) / 3
+
+            log.info("%s datasets: first call %.3fs, JSON %.3fs per call, matrix %.3fs per call "
+                     "(%.1fx faster than the first call)",
+                     num_datasets, first_time, json_time, matrix_time, first_time / matrix_time)
+
+            #Later calls don't parse the timeseries again, so they should not be
+            #much slower than the first, even for 10 datasets where parsing is cheap.
+            assert matrix_time < first_time * 2
+
+class TimeseriesFormatTest(unittest.TestCase):
+    """
+        Compare the size and parse time of a 10-year hourly timeseries
+        stored as compressed JSON and in the binary format.
+    """
+    def setUp(self):
+        index = pd.date_range('2000-01-01', periods=10*365*24, freq='H')
+        self.timeseries = pd.DataFrame({0: numpy.random.rand(len(index)) * 100}, index=index)
+
+        self.json_value   = zlib.compress(self.timeseries.to_json(date_format='iso', date_unit='ns'))
+        self.binary_value = encode_timeseries(self.timeseries)
+
+    def parse_json(self):
+        return pd.read_json(zlib.decompress(self.json_value))
+
+    def parse_binary(self):
+        return decode_timeseries(self.binary_value)
+
+    def test_timeseries_format(self):
+        json_time   = timeit.Timer(self.parse_json).timeit(number=3) / 3
+        binary_time = timeit.Timer(self.parse_binary).timeit(number=3) / 3
+
+        log.info("JSON: %s bytes, parsed in %.3fs. Binary: %s bytes, parsed in %.3fs (%.1fx faster)",
+                 len(self.json_value), json_time, len(self.binary_value), binary_time,
+                 json_time / binary_time)
+
+        decoded = self.parse_binary()
+        assert (decoded.index == self.timeseries.index).all()
+        assert (decoded[0].values == self.timeseries[0].values).all()
+
+        assert len(self.binary_value) < len(self.json_value)
+        #Typically over ten times faster. Allow a wide margin for timing noise.
+        assert binary_time * 2 < json_time
+
+class UnitConversionTest(unittest.TestCase):
+    """
+        Time converting a timeseries of 1 million values, compared
+        with converting the values one at a time.
+    """
+    def setUp(self):
+        self.units = Units()
+        index = pd.date_range('2000-01-01', periods=1000000, freq='T')
+        self.timeseries = pd.DataFrame({0: numpy.random.rand(len(index)) * 100}, index=index)
+        self.values = self.timeseries[0].tolist()
+
+    def convert_timeseries(self):
+        return self.units.convert(self.timeseries, 'm^3', '1e6 m^3')
+
+    def convert_values(self):
+        return [self.units.convert(v, 'm^3', '1e6 m^3') for v in self.values]
+
+    def test_convert_timeseries(self):
+        timeseries_time = timeit.Timer(self.convert_timeseries).timeit(number=1)
+        values_time     = timeit.Timer(self.convert_values).timeit(number=1)
+
+        log.info("Timeseries: %.3fs, one value at a time: %.3fs (%.1fx faster)",
+                 timeseries_time, values_time, values_time / timeseries_time)
+
+        assert self.convert_timeseries()[0].tolist() == self.convert_values()
+        #Converting a million values one at a time is far slower, so a
+        #factor of ten still leaves plenty of margin.
+        assert timeseries_time * 10 < values_time
+
 if __name__ == '__main__':
   #  pr = cProfile.Profile()
   #  pr.enable()
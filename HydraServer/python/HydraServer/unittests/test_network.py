@@ -135,6 +135,142 @@ class NetworkTest(server.SoapServerTest):
         assert net_exists == 'Y'
         assert full_network.projection == 'EPSG:21781'
 
+    def test_get_network_stream(self):
+        """
+            Test that streaming a network in chunks returns the same
+            nodes, links and data as retrieving it in one go.
+        """
+        net = self.create_network_with_data()
+        full_network = self.client.service.get_network(net.id, 'Y')
+
+        chunks = self.client.service.get_network_stream(net.id, 'Y', None, None, 3)
+
+        chunk_types = [c.chunk_type for c in chunks.NetworkChunk]
+        assert chunk_types[0] == 'NETWORK'
+        assert chunks.NetworkChunk[0].network.id == net.id
+
+        node_ids = []
+        link_ids = []
+        rs_count = 0
+        for c in chunks.NetworkChunk:
+            if c.chunk_type == 'NODE':
+                assert len(c.nodes.Node) <= 3
+                node_ids.extend([n.id for n in c.nodes.Node])
+            elif c.chunk_type == 'LINK':
+                assert len(c.links.Link) <= 3
+                link_ids.extend([l.id for l in c.links.Link])
+            elif c.chunk_type == 'RESOURCESCENARIO':
+                assert len(c.resourcescenarios.ResourceScenario) <= 3
+                rs_count = rs_count + len(c.resourcescenarios.ResourceScenario)
+
+        assert sorted(node_ids) == sorted([n.id for n in full_network.nodes.Node])
+        assert sorted(link_ids) == sorted([l.id for l in full_network.links.Link])
+
+        full_rs_count = 0
+        for s in full_network.scenarios.Scenario:
+            full_rs_count = full_rs_count + len(s.resourcescenarios.ResourceScenario)
+        assert rs_count == full_rs_count
+
+    def test_get_network_stream_child(self):
+        """
+            Test that streaming a network includes the data which
+            a child scenario inherits, as get_network does.
+        """
+        net = self.create_network_with_data()
+        scenario = net.scenarios.Scenario[0]
+
+        child = self.client.service.add_child_scenario(scenario.id)
+
+        parent_data = self.client.service.get_all_resource_data(scenario.id)
+        overridden = parent_data.ResourceData[0]
+        rs_to_update = self.client.factory.create('ns1:ResourceScenarioArray')
+        rs_to_update.ResourceScenario.append(self.create_descriptor(
+            dict(id=overridden.resource_attr_id, attr_id=overridden.attr_id), "child value"))
+        self.client.service.update_resourcedata(child.id, rs_to_update)
+
+        scen_ids = self.client.factory.create("integerArray")
+        scen_ids.integer.append(child.id)
+
+        full_network = self.client.service.get_network(net.id, 'Y', None, scen_ids)
+        full_values = dict((rs.resource_attr_id, rs.value.id) for rs in
+                    full_network.scenarios.Scenario[0].resourcescenarios.ResourceScenario)
+
+        chunks = self.client.service.get_network_stream(net.id, 'Y', None, scen_ids, 3)
+        streamed_values = {}
+        for c in chunks.NetworkChunk:
+            if c.chunk_type == 'RESOURCESCENARIO':
+                assert c.scenario_id == child.id
+                for rs in c.resourcescenarios.ResourceScenario:
+                    streamed_values[rs.resource_attr_id] = rs.value.id
+
+        assert len(streamed_values) == len(parent_data.ResourceData)
+        assert streamed_values == full_values
+
+    def test_get_network_without_values(self):
+        """
+            Test that a network can be retrieved with dataset IDS and hashes
+            only, and that the values can then be retrieved using get_datasets.
+        """
+        net = self.create_network_with_data()
+        scenario_id = net.scenarios.Scenario[0].id
+
+        scen_ids = self.client.factory.create("integerArray")
+        scen_ids.integer.append(scenario_id)
+
+        full_network = self.client.service.get_network(net.id, 'Y', None, scen_ids)
+        ref_network  = self.client.service.get_network(net.id, 'Y', None, scen_ids, 'N', 'N')
+
+        full_rs = full_network.scenarios.Scenario[0].resourcescenarios.ResourceScenario
+        ref_rs  = ref_network.scenarios.Scenario[0].resourcescenarios.ResourceScenario
+
+        assert len(full_rs) == len(ref_rs)
+
+        dataset_ids = self.client.factory.create('intArray')
+        for rs in ref_rs:
+            assert rs.value.value is None
+            assert rs.value.hash is not None
+            dataset_ids.int.append(rs.value.id)
+
+        datasets = self.client.service.get_datasets(dataset_ids)
+        values = dict([(d.id, d.value) for d in datasets.Dataset])
+
+        for rs in full_rs:
+            assert str(values[rs.value.id]) == str(rs.value.value)
+
+    def test_get_network_after_update(self):
+        """
+            Test that a network retrieved a second time reflects the
+            changes made since it was first retrieved (and so cached).
+        """
+        net = self.create_network_with_data()
+
+        network = self.client.service.get_network(net.id, 'Y')
+        #Retrieve it again, so the second request can be served from the cache.
+        network = self.client.service.get_network(net.id, 'Y')
+
+        scenario = network.scenarios.Scenario[0]
+        node = network.nodes.Node[0]
+
+        descriptor = self.create_descriptor(node.attributes.ResourceAttr[0],
+                                                "cached_descriptor")
+
+        rs_to_update = self.client.factory.create('ns1:ResourceScenarioArray')
+        for resourcescenario in scenario.resourcescenarios.ResourceScenario:
+            if resourcescenario.resource_attr_id == descriptor['resource_attr_id']:
+                resourcescenario.value = descriptor['value']
+                rs_to_update.ResourceScenario.append(resourcescenario)
+
+        assert len(rs_to_update.ResourceScenario) == 1
+
+        self.client.service.update_resourcedata(scenario.id, rs_to_update)
+
+        updated_network = self.client.service.get_network(net.id, 'Y')
+
+        updated_scenario = updated_network.scenarios.Scenario[0]
+        for rs in updated_scenario.resourcescenarios.ResourceScenario:
+            if rs.resource_attr_id == descriptor['resource_attr_id']:
+                assert rs.value.value == descriptor['value']['value']
+
     def test_get_extents(self):
         """
         Extents test: Test that the min X, max X, min Y and max Y of a
@@ -967,6 +1103,44 @@ class NetworkTest(server.SoapServerTest):
         truncated_resource_data = self.client.service.get_all_resource_data(s.id, include_values='Y', include_metadata='Y', page_start=0, page_end=1)
         assert len(truncated_resource_data.ResourceData) == 1
 
+    def test_get_resource_data_pages(self):
+        """
+            Test that walking through the data in a scenario a page at a time,
+            or streaming it, returns the same data as retrieving it all at once.
+        """
+        net = self.create_network_with_data()
+        s = net.scenarios.Scenario[0]
+
+        all_resource_data = self.client.service.get_all_resource_data(s.id, include_values='Y')
+        all_ra_ids = [int(ra.resource_attr_id) for ra in all_resource_data.ResourceData]
+
+        assert all_ra_ids == sorted(all_ra_ids)
+
+        paged_ra_ids = []
+        last_resource_attr_id = None
+        while True:
+            page = self.client.service.get_all_resource_data(s.id, include_values='Y',
+                                            last_resource_attr_id=last_resource_attr_id,
+                                            page_size=3)
+            if page is None or len(page) == 0:
+                break
+            assert len(page.ResourceData) <= 3
+            paged_ra_ids.extend([int(ra.resource_attr_id) for ra in page.ResourceData])
+            last_resource_attr_id = page.ResourceData[-1].resource_attr_id
+
+        assert paged_ra_ids == all_ra_ids
+
+        offset_page = self.client.service.get_all_resource_data(s.id, page_start=2, page_end=5)
+        assert [int(ra.resource_attr_id) for ra in offset_page.ResourceData] == all_ra_ids[2:5]
+
+        empty_page = self.client.service.get_all_resource_data(s.id, page_start=5, page_end=2)
+        assert empty_page is None or len(empty_page) == 0
+
+        streamed_data = self.client.service.get_all_resource_data_stream(s.id, 'Y', 'Y', 3)
+        streamed_ra_ids = [int(ra.resource_attr_id) for ra in streamed_data.ResourceData]
+
+        assert streamed_ra_ids == all_ra_ids
+
 
 
 
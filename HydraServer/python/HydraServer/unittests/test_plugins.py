@@ -21,6 +21,12 @@ from lxml import etree
 from subprocess import Popen, PIPE
 import logging
 import os
+import base64
+import numpy
+import unittest
+from collections import namedtuple
+from cStringIO import StringIO
+from HydraServer.plugins.advanced_dataset_retrieval import _pack_scalars
 log = logging.getLogger(__name__)
 
 
@@ -73,6 +79,116 @@ class ServerPluginsTest(server.SoapServerTest):
                     if not hasattr(a,  'dataset'):
                         print a
 
+    def test_get_dataset_matrix_columns(self):
+        """
+            Test that the columnar matrix contains the same data
+            as the network, and that scalars can be packed into an array.
+        """
+
+        network = self.create_network_with_data()
+
+        scenario = network.scenarios.Scenario[0]
+        node_ids = [n.id for n in network.nodes.Node]
+        attr_ids = [a.attr_id for a in network.nodes.Node[0].attributes.ResourceAttr]
+
+        node_ras = {}
+        for n in network.nodes.Node:
+            for ra in n.attributes.ResourceAttr:
+                node_ras[ra.id] = (n.id, ra.attr_id)
+
+        expected_cells = {}
+        for rs in scenario.resourcescenarios.ResourceScenario:
+            if rs.resource_attr_id in node_ras and node_ras[rs.resource_attr_id][1] in attr_ids:
+                expected_cells[node_ras[rs.resource_attr_id]] = rs.value
+
+        matrix = self.client.service.get_dataset_matrix_columns('NODE',
+                                                                node_ids,
+                                                                attr_ids,
+                                                                [scenario.id],
+                                                                'N')
+
+        cell_count = len(matrix.dataset_ids.integer)
+        assert cell_count == len(expected_cells)
+        assert len(matrix.scenario_ids.integer) == cell_count
+        assert len(matrix.resource_ids.integer) == cell_count
+        assert len(matrix.attr_ids.integer) == cell_count
+
+        datasets = dict([(d.id, d) for d in matrix.datasets.Dataset])
+        #Each dataset is only returned once.
+        assert len(datasets) == len(matrix.datasets.Dataset)
+
+        for i in range(cell_count):
+            cell = (matrix.resource_ids.integer[i], matrix.attr_ids.integer[i])
+            dataset = datasets[matrix.dataset_ids.integer[i]]
+            assert dataset.value == expected_cells[cell].value
+
+        packed_matrix = self.client.service.get_dataset_matrix_columns('NODE',
+                                                                node_ids,
+                                                                attr_ids,
+                                                                [scenario.id],
+                                                                'Y')
+
+        scalar_values = numpy.load(StringIO(base64.b64decode(packed_matrix.scalar_values)))
+        assert len(scalar_values) == cell_count
+
+        packed_datasets = set([d.id for d in packed_matrix.datasets.Dataset])
+        for i in range(cell_count):
+            dataset = datasets[matrix.dataset_ids.integer[i]]
+            if dataset.type == 'scalar':
+                assert scalar_values[i] == float(dataset.value)
+                assert dataset.id not in packed_datasets
+            else:
+                assert numpy.isnan(scalar_values[i])
+                #Cells which are not packed keep their dataset.
+                assert dataset.id in packed_datasets
+
+    def test_get_dataset_matrix_columns_child(self):
+        """
+            Test that the columnar matrix of a child scenario
+            includes the data it inherits from its parent.
+        """
+        network = self.create_network_with_data()
+        scenario = network.scenarios.Scenario[0]
+        child = self.client.service.add_child_scenario(scenario.id)
+
+        node_ids = [n.id for n in network.nodes.Node]
+        attr_ids = [a.attr_id for a in network.nodes.Node[0].attributes.ResourceAttr]
+
+        parent_matrix = self.client.service.get_dataset_matrix_columns('NODE',
+                                                                node_ids,
+                                                                attr_ids,
+                                                                [scenario.id],
+                                                                'N')
+        child_matrix = self.client.service.get_dataset_matrix_columns('NODE',
+                                                                node_ids,
+                                                                attr_ids,
+                                                                [child.id],
+                                                                'N')
+
+        assert len(child_matrix.dataset_ids.integer) > 0
+        assert child_matrix.dataset_ids.integer == parent_matrix.dataset_ids.integer
+        assert set(child_matrix.scenario_ids.integer) == set([child.id])
+
+class PackScalarsTest(unittest.TestCase):
+    """
+        Tests for packing scalar values into an array.
+    """
+
+    def test_pack_scalars(self):
+        Dataset = namedtuple('Dataset', ['dataset_id', 'data_type', 'value'])
+        datasets = [Dataset(1, 'scalar', '1.5'),
+                    #A hidden dataset which the user cannot see
+                    Dataset(2, 'scalar', None),
+                    Dataset(3, 'scalar', 'not a number'),
+                    Dataset(4, 'descriptor', 'text')]
+
+        packed, packed_ids = _pack_scalars(datasets, [1, 2, 3, 4, 1])
+        values = numpy.load(StringIO(packed))
+
+        assert values[0] == 1.5
+        assert values[4] == 1.5
+        assert all(numpy.isnan(values[1:4]))
+        assert packed_ids == set([1])
 
 class PluginsTest(server.SoapServerTest):
     """
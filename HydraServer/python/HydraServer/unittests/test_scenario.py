@@ -516,6 +516,115 @@ class ScenarioTest(server.SoapServerTest):
 
         return updated_network
 
+    def test_clone_subset(self):
+
+        network =  self.create_network_with_data()
+
+        scenario = network.scenarios.Scenario[0]
+        node = network.nodes.Node[0]
+
+        node_ids = self.client.factory.create("integerArray")
+        node_ids.integer.append(node.id)
+
+        clone = self.client.service.clone_scenario_subset(scenario.id, None, None, node_ids)
+        new_scenario = self.client.service.get_scenario(clone.id)
+
+        node_ra_ids = [ra.id for ra in node.attributes.ResourceAttr]
+        expected = dict((rs.resource_attr_id, rs.value.id)
+                        for rs in scenario.resourcescenarios.ResourceScenario
+                        if rs.resource_attr_id in node_ra_ids)
+        cloned = dict((rs.resource_attr_id, rs.value.id)
+                      for rs in new_scenario.resourcescenarios.ResourceScenario)
+
+        assert len(expected) > 0
+        assert cloned == expected, "Only the data of the node should be cloned"
+
+        attr_ids = self.client.factory.create("integerArray")
+        attr_ids.integer.append(node.attributes.ResourceAttr[0].attr_id)
+
+        clone = self.client.service.clone_scenario_subset(scenario.id, attr_ids)
+        new_scenario = self.client.service.get_scenario(clone.id)
+
+        for rs in new_scenario.resourcescenarios.ResourceScenario:
+            assert rs.attr_id == node.attributes.ResourceAttr[0].attr_id
+
+    def test_child_scenario(self):
+
+        network =  self.create_network_with_data()
+        scenario = network.scenarios.Scenario[0]
+
+        child = self.client.service.add_child_scenario(scenario.id)
+        assert child.parent_id == scenario.id
+
+        parent_data = self.client.service.get_all_resource_data(scenario.id, include_values='Y')
+        child_data  = self.client.service.get_all_resource_data(child.id, include_values='Y')
+
+        parent_values = dict((rd.resource_attr_id, rd.dataset_id) for rd in parent_data.ResourceData)
+        child_values  = dict((rd.resource_attr_id, rd.dataset_id) for rd in child_data.ResourceData)
+        assert child_values == parent_values, "The child should inherit all the parent's data"
+
+        #Override one value in the child
+        inherited = parent_data.ResourceData[0]
+        descriptor = self.create_descriptor(dict(id=inherited.resource_attr_id,
+                                                 attr_id=inherited.attr_id), "child value")
+        rs_to_update = self.client.factory.create('ns1:ResourceScenarioArray')
+        rs_to_update.ResourceScenario.append(descriptor)
+        self.client.service.update_resourcedata(child.id, rs_to_update)
+
+        ra_id = descriptor['resource_attr_id']
+        child_data = self.client.service.get_all_resource_data(child.id, include_values='Y')
+        for rd in child_data.ResourceData:
+            if rd.resource_attr_id == ra_id:
+                assert rd.dataset_value == "child value"
+            else:
+                assert rd.dataset_id == parent_values[rd.resource_attr_id]
+
+        parent_data = self.client.service.get_all_resource_data(scenario.id, include_values='Y')
+        for rd in parent_data.ResourceData:
+            assert rd.dataset_id == parent_values[rd.resource_attr_id], "The parent should not change"
+
+        updated_network = self.client.service.get_network(network.id, 'Y')
+        for s in updated_network.scenarios.Scenario:
+            if s.id == child.id:
+                assert len(s.resourcescenarios.ResourceScenario) == len(parent_values)
+
+        scenario_diff = self.client.service.compare_scenarios(scenario.id, child.id)
+        assert len(scenario_diff.resourcescenarios.ResourceScenarioDiff) == 1
+
+    def test_clone_child(self):
+        """
+            Test that cloning a child scenario copies the data it inherits.
+        """
+        network =  self.create_network_with_data()
+        scenario = network.scenarios.Scenario[0]
+
+        child = self.client.service.add_child_scenario(scenario.id)
+
+        parent_data = self.client.service.get_all_resource_data(scenario.id)
+        overridden = parent_data.ResourceData[0]
+        rs_to_update = self.client.factory.create('ns1:ResourceScenarioArray')
+        rs_to_update.ResourceScenario.append(self.create_descriptor(
+            dict(id=overridden.resource_attr_id, attr_id=overridden.attr_id), "child value"))
+        self.client.service.update_resourcedata(child.id, rs_to_update)
+
+        child_values = dict((rd.resource_attr_id, rd.dataset_id) for rd in
+                self.client.service.get_all_resource_data(child.id).ResourceData)
+
+        clone = self.client.service.clone_scenario(child.id)
+        new_scenario = self.client.service.get_scenario(clone.id)
+
+        cloned_values = dict((rs.resource_attr_id, rs.value.id)
+                        for rs in new_scenario.resourcescenarios.ResourceScenario)
+        assert cloned_values == child_values, "The clone should have all the child's data"
+
+        node_ids = self.client.factory.create("integerArray")
+        node_ids.integer.extend([n.id for n in network.nodes.Node])
+        subset = self.client.service.clone_scenario_subset(child.id, None, None, node_ids)
+        subset_scenario = self.client.service.get_scenario(subset.id)
+        for rs in subset_scenario.resourcescenarios.ResourceScenario:
+            assert rs.value.id == child_values[rs.resource_attr_id]
+        assert len(subset_scenario.resourcescenarios.ResourceScenario) > 0
+
     def test_compare(self):
 
         network =  self.create_network_with_data()
@@ -580,6 +689,123 @@ class ScenarioTest(server.SoapServerTest):
 
         return updated_network
 
+    def test_compare_pages(self):
+        """
+            Test that comparing scenarios a page at a time, summarised or
+            streamed, finds the same differences as comparing them all at once.
+        """
+        network =  self.create_network_with_data()
+        scenario = network.scenarios.Scenario[0]
+
+        clone = self.client.service.clone_scenario(scenario.id)
+        new_scenario = self.client.service.get_scenario(clone.id)
+
+        rs_to_update = self.client.factory.create('ns1:ResourceScenarioArray')
+        for rs in new_scenario.resourcescenarios.ResourceScenario[0:3]:
+            descriptor = self.create_descriptor(dict(id=rs.resource_attr_id,
+                                                     attr_id=rs.attr_id),
+                                                "compare %s"%rs.resource_attr_id)
+            rs_to_update.ResourceScenario.append(descriptor)
+        self.client.service.update_resourcedata(clone.id, rs_to_update)
+
+        scenario_diff = self.client.service.compare_scenarios(scenario.id, clone.id)
+        all_ra_ids = [rd.resource_attr_id for rd in scenario_diff.resourcescenarios.ResourceScenarioDiff]
+        assert len(all_ra_ids) == 3
+        assert all_ra_ids == sorted(all_ra_ids)
+        for rd in scenario_diff.resourcescenarios.ResourceScenarioDiff:
+            assert rd.scenario_2_dataset.id == rd.scenario_2_dataset_id
+            assert rd.scenario_2_dataset.value == "compare %s"%rd.resource_attr_id
+
+        summary = self.client.service.compare_scenarios(scenario.id, clone.id, 'Y')
+        assert summary.num_resourcescenarios == 3
+        for rd in summary.resourcescenarios.ResourceScenarioDiff:
+            assert rd.scenario_1_dataset_id is not None
+            assert rd.scenario_2_dataset.value is None
+
+        paged_ra_ids = []
+        last_resource_attr_id = None
+        while True:
+            page = self.client.service.compare_scenarios(scenario.id, clone.id, 'N',
+                                                         last_resource_attr_id, 2)
+            assert page.num_resourcescenarios == 3
+            if page.resourcescenarios is None:
+                break
+            assert len(page.resourcescenarios.ResourceScenarioDiff) <= 2
+            paged_ra_ids.extend([rd.resource_attr_id for rd in page.resourcescenarios.ResourceScenarioDiff])
+            last_resource_attr_id = paged_ra_ids[-1]
+        assert paged_ra_ids == all_ra_ids
+
+        streamed_diff = self.client.service.compare_scenarios_stream(scenario.id, clone.id, 'N', 2)
+        assert [rd.resource_attr_id for rd in streamed_diff.ResourceScenarioDiff] == all_ra_ids
+
+        #A user who cannot read the network cannot compare its scenarios.
+        old_client = self.client
+        self.client = server.connect()
+        self.login("UserB", 'password')
+        try:
+            self.assertRaises(suds.WebFault, self.client.service.compare_scenarios,
+                              scenario.id, clone.id)
+            self.assertRaises(suds.WebFault, self.client.service.compare_scenarios_stream,
+                              scenario.id, clone.id)
+        finally:
+            self.client.service.logout("UserB")
+            self.client = old_client
+
+    def test_scenario_matrix(self):
+
+        network =  self.create_network_with_data()
+        scenario = network.scenarios.Scenario[0]
+
+        clone = self.client.service.clone_scenario(scenario.id)
+        child = self.client.service.add_child_scenario(scenario.id)
+
+        changed_rs = scenario.resourcescenarios.ResourceScenario[0]
+        rs_to_update = self.client.factory.create('ns1:ResourceScenarioArray')
+        rs_to_update.ResourceScenario.append(self.create_descriptor(
+            dict(id=changed_rs.resource_attr_id, attr_id=changed_rs.attr_id), "matrix value"))
+        self.client.service.update_resourcedata(clone.id, rs_to_update)
+
+        scenario_ids = self.client.factory.create("integerArray")
+        scenario_ids.integer.extend([scenario.id, clone.id, child.id])
+
+        matrix = self.client.service.get_scenario_matrix(scenario_ids)
+        assert matrix.scenario_ids.integer == [scenario.id, clone.id, child.id]
+
+        expected = dict((rs.resource_attr_id, rs.value.id)
+                        for rs in scenario.resourcescenarios.ResourceScenario)
+        assert len(matrix.rows.ScenarioMatrixRow) == len(expected)
+        for row in matrix.rows.ScenarioMatrixRow:
+            dataset_ids = row.dataset_ids.integer
+            assert dataset_ids[0] == expected[row.resource_attr_id]
+            assert dataset_ids[2] == dataset_ids[0], "The child should inherit the parent's data"
+            if row.resource_attr_id == changed_rs.resource_attr_id:
+                assert dataset_ids[1] != dataset_ids[0]
+                assert len(row.distinct_dataset_ids.integer) == 2
+            else:
+                assert dataset_ids[1] == dataset_ids[0]
+                assert len(row.distinct_dataset_ids.integer) == 1
+
+        differences = self.client.service.get_scenario_matrix(scenario_ids, None, None, 'Y')
+        assert len(differences.rows.ScenarioMatrixRow) == 1
+        assert differences.rows.ScenarioMatrixRow[0].resource_attr_id == changed_rs.resource_attr_id
+
+        attr_ids = self.client.factory.create("integerArray")
+        attr_ids.integer.append(changed_rs.attr_id)
+        attr_matrix = self.client.service.get_scenario_matrix(scenario_ids, attr_ids)
+        for row in attr_matrix.rows.ScenarioMatrixRow:
+            assert row.attr_id == changed_rs.attr_id
+
+        #A user who cannot read the network cannot compare its scenarios.
+        old_client = self.client
+        self.client = server.connect()
+        self.login("UserB", 'password')
+        try:
+            self.assertRaises(suds.WebFault, self.client.service.get_scenario_matrix,
+                              scenario_ids)
+        finally:
+            self.client.service.logout("UserB")
+            self.client = old_client
+
     def test_purge_scenario(self):
         net = self.test_clone()
 
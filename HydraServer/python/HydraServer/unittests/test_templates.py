@@ -23,8 +23,113 @@ from HydraLib import config
 import logging
 from suds import WebFault
 from util import update_template
+import unittest
+import json
+import pandas as pd
+from HydraLib.util import CompiledRestriction, validation_func_map, ValidationError
+from HydraLib.HydraException import HydraError
+from HydraServer.util import validation
 log = logging.getLogger(__name__)
 
+class RestrictionTest(unittest.TestCase):
+    """
+        Test that compiled restrictions give the same results as
+        the individual validation functions.
+    """
+    values = [
+        [1, 2, 3, 4],
+        [[1.5, 2.5], [3.5, 4.5]],
+        ["1.0", "2.0", "5.0"],
+        [4, 3, 2, 1],
+        pd.DataFrame({0: [1.0, 2.0, 3.0, 4.0]},
+                     index=pd.date_range('2014-01-01', periods=4, freq='D')),
+        pd.DataFrame({0: [2.0, 1.0, 0.5, 0.5]},
+                     index=pd.date_range('2014-01-01', periods=4, freq='D')),
+    ]
+
+    restrictions = [
+        {'VALUERANGE': [1, 4]},
+        {'GREATERTHAN': 1},
+        {'LESSTHANEQ': [4]},
+        {'EQUALTO': 1},
+        {'NOTEQUALTO': 3},
+        {'MULTIPLEOF': 0.5},
+        {'SUMTO': 10},
+        {'INCREASING': None},
+        {'DECREASING': None},
+        {'ENUM': [1, 2, 3, 4]},
+        {'BOOL10': None},
+    ]
+
+    def is_valid(self, func, value, restriction):
+        try:
+            func(value, restriction)
+            return True
+        except ValidationError:
+            return False
+
+    def test_compiled_restrictions(self):
+        for restriction_dict in self.restrictions:
+            compiled = CompiledRestriction(restriction_dict)
+            restriction_type, restriction = restriction_dict.items()[0]
+            func = validation_func_map[restriction_type]
+            for value in self.values:
+                expected = self.is_valid(func, value, restriction)
+                try:
+                    compiled.validate(value)
+                    valid = True
+                except HydraError:
+                    valid = False
+                assert valid == expected, "%s gave %s for %s"%(restriction_dict, valid, value)
+
+    def test_unknown_restriction(self):
+        compiled = CompiledRestriction({'NOTARULE': 1})
+        self.assertRaises(HydraError, compiled.validate, [1, 2])
+
+class ValidationPoolTest(unittest.TestCase):
+    """
+        Test that checks run in worker processes give the
+        same errors as checks run in this process.
+    """
+    def setUp(self):
+        restrictions = [
+            ((1, 1), "{'VALUERANGE': [1, 4]}"),
+            ((1, 2), "{'SUMTO': 10}"),
+        ]
+        self.checks = []
+        for i in range(20):
+            value = json.dumps(range(1, i % 6 + 2))
+            self.checks.append((i, 'array', value, None, restrictions))
+
+    def test_shard(self):
+        shards = validation._shard(self.checks, 3)
+        assert len(shards) == 3
+        assert sorted([c[0] for s in shards for c in s]) == range(20)
+
+    def test_check_in_pool(self):
+        expected = validation.check_datasets(self.checks)
+        assert len(expected) > 0
+
+        #Without a pool, everything is checked in the request thread.
+        assert validation.use_pool(len(self.checks)) is False
+
+        config.get('validation', 'workers')
+        if not config.CONFIG.has_section('validation'):
+            config.CONFIG.add_section('validation')
+        config.CONFIG.set('validation', 'workers', '2')
+        config.CONFIG.set('validation', 'parallel_threshold', '10')
+        try:
+            assert validation.start_pool() is not None
+            assert validation.use_pool(len(self.checks)) is True
+            assert validation.use_pool(5) is False
+
+            errors = validation.check_datasets_in_pool(self.checks)
+        finally:
+            validation.close_pool()
+            config.load_config()
+
+        assert errors == expected
+
 class TemplatesTest(server.SoapServerTest):
     """
         Test for templates
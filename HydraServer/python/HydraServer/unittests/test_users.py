@@ -20,6 +20,13 @@ import server
 import suds
 import bcrypt
 import datetime
+import unittest
+import tempfile
+import time
+import os
+
+from HydraServer.util.sessions import MemorySessionStore, SqliteSessionStore,\
+        make_session_id
 
 class UsersTest(server.SoapServerTest):
     """
@@ -74,6 +81,26 @@ class UsersTest(server.SoapServerTest):
 
         self.client = old_client
 
+    def test_login_with_token(self):
+        token = self.client.service.add_user_token("Test token")
+        assert len(token) == 64
+
+        tokens = self.client.service.get_user_tokens()
+        new_token = [t for t in tokens.UserToken if t.name == "Test token"][-1]
+        assert new_token.last_used is None
+
+        new_client = server.connect()
+        login_response = new_client.service.login_with_token(token)
+        assert login_response.userid == 1
+
+        header = new_client.factory.create('RequestHeader')
+        header.sessionid = login_response.sessionid
+        new_client.set_options(cache=None, soapheaders=header)
+        assert new_client.service.get_username(1) == 'root'
+
+        self.client.service.delete_user_token(new_token.id)
+        self.assertRaises(suds.WebFault, new_client.service.login_with_token, token)
+
     def test_add_role(self):
         role = self.client.factory.create('hyd:Role')
         role.name = "Test Role"
@@ -221,6 +248,71 @@ class UsersTest(server.SoapServerTest):
 
         assert len(permissions.Perm) == len(role.roleperms.RolePerm)
 
+class SessionStoreTest(unittest.TestCase):
+    """
+        Tests for the stores of login sessions.
+    """
+
+    def test_memory_store_expiry(self):
+        store = MemorySessionStore(ttl=1, max_size=2)
+        store['session_a'] = (1, 'UserA')
+        store['session_b'] = (2, 'UserB')
+
+        #Use session_a, so session_b is the least recently used.
+        assert store.get('session_a') == (1, 'UserA')
+        store['session_c'] = (3, 'UserC')
+
+        assert store.get('session_b') is None
+        assert len(store) == 2
+
+        time.sleep(1.1)
+        assert store.get('session_a') is None
+        assert 'session_c' not in store
+
+    def test_sqlite_store_is_shared(self):
+        path = os.path.join(tempfile.mkdtemp(), 'sessions.db')
+        #Two stores using the same file, as two server processes would.
+        store_1 = SqliteSessionStore(path)
+        store_2 = SqliteSessionStore(path)
+
+        store_1['session_a'] = (1, 'UserA')
+        assert store_2['session_a'] == (1, 'UserA')
+
+        del(store_2['session_a'])
+        assert store_1.get('session_a') is None
+
+        self.assertRaises(KeyError, store_1.__getitem__, 'session_a')
+
+    def test_sessions_are_not_replaced(self):
+        path = os.path.join(tempfile.mkdtemp(), 'sessions.db')
+        for store in (MemorySessionStore(), SqliteSessionStore(path)):
+            store['session_a'] = (1, 'UserA')
+
+            self.assertRaises(KeyError, store.__setitem__, 'session_a', (2, 'UserB'))
+
+            session_id = store.add('session_a', (2, 'UserB'))
+            assert session_id != 'session_a'
+            assert store['session_a'] == (1, 'UserA')
+            assert store[session_id] == (2, 'UserB')
+
+    def test_session_ids_differ_after_fork(self):
+        #Forked server processes must not hand out the same session IDs.
+        session_ids = set()
+        for i in range(3):
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                os.write(write_fd, make_session_id())
+                os._exit(0)
+            os.close(write_fd)
+            session_ids.add(os.read(read_fd, 64))
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+
+        session_ids.add(make_session_id())
+        assert len(session_ids) == 4
+
 def setup():
     server.connect()
 
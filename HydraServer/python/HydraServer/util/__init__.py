@@ -3,11 +3,16 @@ log = logging.getLogger(__name__)
 
 from decimal import Decimal
 import pandas as pd
+import numpy
 import zlib
 import json
+import struct
+import hashlib
 from HydraLib import config
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+
+from HydraServer.util.cache import value_cache
 
 def to_named_tuple(keys, values):
     """
@@ -24,28 +29,271 @@ def to_named_tuple(keys, values):
 
     
 
+#The first two bytes of a zlib stream, for each compression level.
+ZLIB_HEADERS = ('\x78\x01', '\x78\x5e', '\x78\x9c', '\x78\xda')
+
+def is_compressed(value):
+    """
+        Check whether a dataset value has been compressed, by looking
+        for the zlib header at the start of it.
+    """
+    if value is None:
+        return False
+    return str(value[:2]) in ZLIB_HEADERS
+
+def decompress_value(value):
+    """
+        Decompress a dataset value if it is compressed.
+        Otherwise return it as it is.
+    """
+    if is_compressed(value):
+        try:
+            return zlib.decompress(value)
+        except zlib.error:
+            #An uncompressed value which happens to start with a zlib header.
+            pass
+    return value
+
+#Timeseries stored in the binary format start with this, followed by a version byte.
+TIMESERIES_MAGIC   = 'HTS\x00'
+TIMESERIES_VERSION = 1
+
+def is_binary_timeseries(value):
+    """
+        Check whether a (decompressed) timeseries value is in
+        the binary format rather than JSON.
+    """
+    if value is None:
+        return False
+    return str(value[:len(TIMESERIES_MAGIC)]) == TIMESERIES_MAGIC
+
+def can_encode_timeseries(timeseries):
+    """
+        Only timeseries with a (timezone-naive) datetime index
+        and numeric columns can be stored in the binary format.
+        Others, such as seasonal or relative timeseries, are stored as JSON.
+    """
+    if not isinstance(timeseries.index, pd.DatetimeIndex) or timeseries.index.tz is not None:
+        return False
+    for dtype in timeseries.dtypes:
+        if dtype.kind not in ('i', 'f'):
+            return False
+    return True
+
+def encode_timeseries(timeseries):
+    """
+        Encode a pandas dataframe as a binary timeseries, consisting of:
+            * TIMESERIES_MAGIC
+            * A version byte
+            * zlib compressed:
+                * The length of the header (unsigned 32-bit int)
+                * The header, as JSON: the number of rows, the column names
+                  and the type of each column ('i' for int64, 'f' for float64)
+                * The index, as int64 nanoseconds since the epoch
+                * Each column in turn, as int64 or float64
+        All numbers are little-endian.
+    """
+    columns = [c.item() if hasattr(c, 'item') else c for c in timeseries.columns]
+    kinds   = [dtype.kind for dtype in timeseries.dtypes]
+    header  = json.dumps({'rows':len(timeseries), 'columns':columns, 'kinds':kinds})
+
+    parts = [struct.pack('<I', len(header)),
+             header,
+             timeseries.index.asi8.astype('<i8').tostring()]
+
+    for i, kind in enumerate(kinds):
+        col_type = '<i8' if kind == 'i' else '<f8'
+        parts.append(timeseries.iloc[:, i].values.astype(col_type).tostring())
+
+    return TIMESERIES_MAGIC + chr(TIMESERIES_VERSION) + zlib.compress(''.join(parts))
+
+def decode_timeseries(value):
+    """
+        Turn a binary timeseries back into a pandas dataframe.
+    """
+    value = str(value)
+
+    version = ord(value[len(TIMESERIES_MAGIC)])
+    if version != TIMESERIES_VERSION:
+        raise ValueError("Unknown timeseries format version %s"%version)
+
+    payload = zlib.decompress(value[len(TIMESERIES_MAGIC)+1:])
+
+    header_len = struct.unpack('<I', payload[:4])[0]
+    header = json.loads(payload[4:4+header_len])
+    rows = header['rows']
+    offset = 4 + header_len
+
+    index = numpy.frombuffer(payload, dtype='<i8', count=rows, offset=offset)
+    offset = offset + rows * 8
+
+    data = OrderedDict()
+    for name, kind in zip(header['columns'], header['kinds']):
+        col_type = '<i8' if kind == 'i' else '<f8'
+        data[name] = numpy.frombuffer(payload, dtype=col_type, count=rows, offset=offset)
+        offset = offset + rows * 8
+
+    return pd.DataFrame(data, index=pd.DatetimeIndex(index), columns=header['columns'])
+
+def parse_timeseries(value):
+    """
+        Turn the (possibly compressed) value of a timeseries dataset into
+        a pandas dataframe. Seasonal timeseries are put into the seasonal year.
+    """
+    val = decompress_value(value)
+
+    if is_binary_timeseries(val):
+        return decode_timeseries(val)
+
+    seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
+    seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+
+    return pd.read_json(val.replace(seasonal_key, seasonal_year))
+
+def is_seasonal_timeseries(timeseries):
+    """
+        Check whether all the times in a timeseries dataframe
+        are in the seasonal year. The index must be sorted.
+    """
+    idx = timeseries.index
+    if type(idx) != pd.DatetimeIndex or len(idx) == 0:
+        return False
+    seasonal_year = int(config.get('DEFAULT','seasonal_year', '1678'))
+    return idx[0].year == seasonal_year and idx[-1].year == seasonal_year
+
+def get_timeseries_positions(timeseries, timestamps):
+    """
+        For each of a list of timestamps (a DatetimeIndex), find the position
+        of the row of a timeseries dataframe which applies at that time:
+        the last one at or before it, as with reindex(method='ffill').
+        Timestamps before the start of the timeseries get -1.
+        If the timeseries is seasonal, the year of the timestamps is ignored.
+
+        The index of the timeseries must be a sorted DatetimeIndex.
+    """
+    if is_seasonal_timeseries(timeseries):
+        seasonal_year = int(config.get('DEFAULT','seasonal_year', '1678'))
+        timestamps = pd.DatetimeIndex([t.replace(year=seasonal_year) for t in timestamps])
+
+    return timeseries.index.asi8.searchsorted(timestamps.asi8, side='right') - 1
+
+def get_client_value(value, data_type):
+    """
+        Get a dataset value in the form in which it is sent to clients:
+        decompressed, with binary timeseries converted to JSON.
+    """
+    value = decompress_value(value)
+    if data_type == 'timeseries' and is_binary_timeseries(value):
+        return decode_timeseries(value).to_json(date_format='iso', date_unit='ns')
+    return value
+
+def _get_hashed_value(value):
+    """
+        Get the form of a dataset value which is hashed. This is the
+        decompressed value, with the payload of a binary timeseries also
+        decompressed, as different versions of zlib can compress the
+        same data differently.
+    """
+    value = decompress_value(value)
+    if is_binary_timeseries(value):
+        value = str(value)
+        prefix_len = len(TIMESERIES_MAGIC) + 1
+        return value[:prefix_len] + zlib.decompress(value[prefix_len:])
+    return value
+
+def _hash_bytes(val):
+    """
+        Turn part of a dataset into the bytes which are hashed.
+    """
+    if isinstance(val, unicode):
+        return val.encode('utf-8')
+    elif isinstance(val, str):
+        return val
+    return str(val)
+
+def _update_hash(hasher, val):
+    """
+        Add a value to a hash, preceded by its length, so that the
+        boundaries between values are part of the hash. ('ab', 'c') and
+        ('a', 'bc') therefore hash differently.
+    """
+    val = _hash_bytes(val)
+    hasher.update(struct.pack('>Q', len(val)))
+    hasher.update(val)
+
 def generate_data_hash(dataset_dict):
+    """
+        Generate the hash used to identify a dataset from its name, units,
+        dimension, type, value and metadata. The hash is the first 8 bytes
+        of a SHA-256 digest, as a signed integer so it fits in a BIGINT.
+
+        Unlike the builtin hash(), this is the same on every platform
+        and in every process. Compressed values, and the payloads of binary
+        timeseries, are hashed decompressed, so a value has the same hash
+        however it has been compressed.
+    """
 
     d = dataset_dict
     if d.get('metadata') is None:
         d['metadata'] = {}
 
-    hash_string = "%s %s %s %s %s %s"%(
-                                str(d['data_name']),
-                                str(d['data_units']),
-                                str(d['data_dimen']),
-                                str(d['data_type']),
-                                d['value'],
-                                d['metadata'])
+    hasher = hashlib.sha256()
 
-    log.debug("Generating data hash from: %s", hash_string)
+    _update_hash(hasher, d['data_name'])
+    _update_hash(hasher, d['data_units'])
+    _update_hash(hasher, d['data_dimen'])
+    _update_hash(hasher, d['data_type'])
+    _update_hash(hasher, _get_hashed_value(d['value']))
 
-    data_hash  = hash(hash_string)
+    metadata = sorted((_hash_bytes(k), _hash_bytes(v)) for k, v in d['metadata'].items())
+    hasher.update(struct.pack('>Q', len(metadata)))
+    for k, v in metadata:
+        _update_hash(hasher, k)
+        _update_hash(hasher, v)
+
+    data_hash = struct.unpack('>q', hasher.digest()[:8])[0]
 
     log.debug("Data hash: %s", data_hash)
 
     return data_hash
 
+def decode_value(data_type, value):
+    """
+        Turn the value of an array or timeseries dataset into a list
+        or a dataframe (with a sorted index) respectively.
+    """
+    if data_type == 'array':
+        return json.loads(decompress_value(value))
+    elif data_type == 'timeseries':
+        timeseries = parse_timeseries(value)
+        if not timeseries.index.is_monotonic:
+            timeseries = timeseries.sort_index()
+        return timeseries
+    else:
+        raise ValueError("Cannot decode a dataset of type %s"%data_type)
+
+def get_decoded_value(dataset):
+    """
+        Get the decoded value of an array or timeseries dataset (see decode_value).
+
+        Decoded values are kept in the value cache, so the value returned
+        may be shared and must not be modified.
+    """
+    dataset_id = getattr(dataset, 'dataset_id', None)
+    data_hash  = getattr(dataset, 'data_hash', None)
+
+    #Values which have been hidden from the user are None, so
+    #must not be looked up in the cache.
+    if dataset.value is None or dataset_id is None or data_hash is None:
+        return decode_value(dataset.data_type, dataset.value)
+
+    value = value_cache.get(dataset_id, data_hash)
+    if value is None:
+        value = decode_value(dataset.data_type, dataset.value)
+        value_cache.set(dataset_id, data_hash, value)
+
+    return value
+
 def get_val(dataset, timestamp=None):
     """
         Turn the string value of a dataset into an appropriate
@@ -62,31 +310,20 @@ def get_val(dataset, timestamp=None):
         as they are in the DB (a timeseries being a list of timeseries data objects,
         for example) or as a single python dictionary
 
+        Arrays and timeseries (with no timestamp) may be shared with
+        the value cache, so must not be modified.
     """
     if dataset.data_type == 'array':
-        try:
-            return json.loads(dataset.value)
-        except ValueError:
-            #Didn't work? Maybe because it was compressed.
-            val = zlib.decompress(dataset.value)
-            return json.loads(val)
+        return get_decoded_value(dataset)
     elif dataset.data_type == 'descriptor':
         return str(dataset.value)
     elif dataset.data_type == 'scalar':
         return Decimal(str(dataset.value))
     elif dataset.data_type == 'timeseries':
 
-        try:
-            #The data might be compressed.
-            val = zlib.decompress(dataset.value)
-        except Exception, e:
-            val = dataset.value
-
         seasonal_year = config.get('DEFAULT','seasonal_year', '1678')
-        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
-        val = dataset.value.replace(seasonal_key, seasonal_year)
-        
-        timeseries = pd.read_json(val)
+
+        timeseries = get_decoded_value(dataset)
 
         if timestamp is None:
             return timeseries
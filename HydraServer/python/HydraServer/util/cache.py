@@ -0,0 +1,351 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Caches of assembled networks and of decoded dataset values.
+
+    NetworkCache holds networks, as built by lib.network.get_network.
+
+    Each network has a version. Every function which changes a network
+    (or anything which appears in a network, such as its data or templates)
+    must call invalidate (or invalidate_all if the affected networks are
+    not known), which changes the version and so stops old entries from
+    being used. The version is changed again once the transaction has been
+    committed, so that entries built by other requests while the change was
+    in progress are not used either.
+
+    Entries are held in memory, with the least recently used entries being
+    removed once there are more than max_size. If a cache_dir is specified,
+    entries and versions are also written to disk so that they can be shared
+    between server processes.
+
+    ValueCache holds the decoded values of array and timeseries datasets
+    (lists and dataframes), keyed on (dataset_id, data_hash). As a dataset's
+    hash changes whenever its value does, entries never need to be invalidated.
+    The least recently used entries are removed once the approximate memory
+    used by the values is more than max_bytes.
+"""
+import logging
+import os
+import sys
+import glob
+import uuid
+import hashlib
+import threading
+import cPickle as pickle
+from collections import OrderedDict
+
+import transaction
+from HydraLib import config
+
+log = logging.getLogger(__name__)
+
+class NetworkCache(object):
+
+    def __init__(self, max_size=20, cache_dir=None):
+        self.max_size  = max_size
+        self.cache_dir = cache_dir
+
+        self.hits   = 0
+        self.misses = 0
+
+        self._entries        = OrderedDict()
+        self._versions       = {}
+        self._global_version = 0
+        self._lock  = threading.RLock()
+        #Keeps track of the networks changed in each thread's current transaction
+        self._local = threading.local()
+
+        if self.cache_dir is not None and not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def get_version(self, network_id):
+        """
+            Get the current version of a network. This should be retrieved
+            *before* the network is assembled and passed to set.
+        """
+        with self._lock:
+            version = (self._global_version, self._versions.get(network_id, 0))
+
+        if self.cache_dir is not None:
+            version = version + (self._read_disk_version('all'),
+                                 self._read_disk_version(network_id))
+
+        return version
+
+    def get(self, network_id, key, version):
+        """
+            Get a network from the cache. Returns None if the network is
+            not in the cache, or if it has been changed in the current transaction.
+        """
+        if not self.enabled or self._is_dirty(network_id):
+            return None
+
+        entry_key = (network_id, key, version)
+
+        with self._lock:
+            net = self._entries.get(entry_key)
+            if net is not None:
+                #Move to the end, so it is the most recently used.
+                del(self._entries[entry_key])
+                self._entries[entry_key] = net
+
+        if net is None and self.cache_dir is not None:
+            net = self._read_disk_entry(entry_key)
+            if net is not None:
+                self._add_entry(entry_key, net)
+
+        with self._lock:
+            if net is None:
+                self.misses = self.misses + 1
+            else:
+                self.hits = self.hits + 1
+
+        return net
+
+    def set(self, network_id, key, version, net):
+        """
+            Add a network to the cache. The network will not be added
+            if it has been changed in the current transaction.
+        """
+        if not self.enabled or self._is_dirty(network_id):
+            return
+
+        entry_key = (network_id, key, version)
+
+        self._add_entry(entry_key, net)
+
+        if self.cache_dir is not None:
+            self._write_disk_entry(entry_key, net)
+
+    def invalidate(self, network_id):
+        """
+            Indicate that a network has changed, so
+            its entries in the cache can no longer be used.
+        """
+        self._bump_version(network_id)
+        self._mark_dirty(network_id)
+
+    def invalidate_all(self):
+        """
+            Indicate that all networks may have changed. Used when
+            something shared between networks, such as a dataset or
+            a template, is changed.
+        """
+        self._bump_version(None)
+        self._mark_dirty(None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits   = 0
+            self.misses = 0
+
+    def _add_entry(self, entry_key, net):
+        with self._lock:
+            self._entries[entry_key] = net
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _bump_version(self, network_id):
+        with self._lock:
+            if network_id is None:
+                self._global_version = self._global_version + 1
+                self._entries.clear()
+            else:
+                self._versions[network_id] = self._versions.get(network_id, 0) + 1
+                for entry_key in self._entries.keys():
+                    if entry_key[0] == network_id:
+                        del(self._entries[entry_key])
+
+        if self.cache_dir is not None:
+            self._write_disk_version('all' if network_id is None else network_id)
+            self._remove_disk_entries(network_id)
+
+    def _is_dirty(self, network_id):
+        """
+            Has this network been changed in the current transaction?
+        """
+        if getattr(self._local, 'txn', None) is not transaction.get():
+            return False
+        dirty = self._local.dirty
+        return None in dirty or network_id in dirty
+
+    def _mark_dirty(self, network_id):
+        txn = transaction.get()
+        if getattr(self._local, 'txn', None) is not txn:
+            self._local.txn   = txn
+            self._local.dirty = set()
+            txn.addAfterCommitHook(self._after_commit, args=(self._local.dirty,))
+        self._local.dirty.add(network_id)
+
+    def _after_commit(self, status, dirty):
+        for network_id in dirty:
+            self._bump_version(network_id)
+
+    def _disk_path(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    def _read_disk_version(self, network_id):
+        try:
+            with open(self._disk_path('version_%s'%network_id)) as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def _write_disk_version(self, network_id):
+        #A random version, rather than an incremented one, so that
+        #processes changing the version at the same time do not clash.
+        try:
+            with open(self._disk_path('version_%s'%network_id), 'w') as f:
+                f.write(uuid.uuid4().hex)
+        except IOError, e:
+            log.critical("Unable to write network cache version: %s", e)
+
+    def _entry_file(self, entry_key):
+        entry_hash = hashlib.sha1(repr(entry_key)).hexdigest()
+        return self._disk_path('network_%s_%s.pickle'%(entry_key[0], entry_hash))
+
+    def _read_disk_entry(self, entry_key):
+        try:
+            with open(self._entry_file(entry_key), 'rb') as f:
+                return pickle.load(f)
+        except IOError:
+            return None
+        except Exception, e:
+            log.warn("Unable to read cached network: %s", e)
+            return None
+
+    def _write_disk_entry(self, entry_key, net):
+        path = self._entry_file(entry_key)
+        tmp_path = "%s.%s"%(path, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(net, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except Exception, e:
+            log.warn("Unable to write cached network to disk: %s", e)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_disk_entries(self, network_id):
+        pattern = 'network_*.pickle' if network_id is None else 'network_%s_*.pickle'%network_id
+        for path in glob.glob(self._disk_path(pattern)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def _make_network_cache():
+    max_size  = config.getint('cache', 'network_cache_size', 20)
+    cache_dir = config.get('cache', 'network_cache_dir', None)
+    if cache_dir in (None, ''):
+        cache_dir = None
+    return NetworkCache(max_size, cache_dir)
+
+network_cache = _make_network_cache()
+
+def _value_size(value):
+    """
+        Approximate the memory used by a decoded dataset value.
+    """
+    if hasattr(value, 'index') and hasattr(value, 'values'):
+        size = value.index.nbytes + value.values.nbytes
+        if value.values.dtype == object:
+            size = size + sum(sys.getsizeof(v) for v in value.values.flat)
+        return size
+    elif isinstance(value, list):
+        return sys.getsizeof(value) + sum(_value_size(v) for v in value)
+    else:
+        return sys.getsizeof(value)
+
+class ValueCache(object):
+
+    def __init__(self, max_bytes=256*1024*1024):
+        self.max_bytes = max_bytes
+
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.size      = 0
+
+        #(dataset_id, data_hash) -> (value, size), least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, dataset_id, data_hash):
+        """
+            Get a value from the cache, or None if it is not there.
+            The value returned is shared, so must not be modified.
+        """
+        key = (dataset_id, data_hash)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            #Put it back at the end, so it is the most recently used.
+            self._entries[key] = entry
+            self.hits = self.hits + 1
+        return entry[0]
+
+    def set(self, dataset_id, data_hash, value):
+        if not self.enabled:
+            return
+
+        size = _value_size(value)
+        if size > self.max_bytes:
+            return
+
+        key = (dataset_id, data_hash)
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+            if old_entry is not None:
+                self.size = self.size - old_entry[1]
+
+            self._entries[key] = (value, size)
+            self.size = self.size + size
+
+            while self.size > self.max_bytes:
+                old_key, old_entry = self._entries.popitem(last=False)
+                self.size = self.size - old_entry[1]
+                self.evictions = self.evictions + 1
+
+    def stats(self):
+        with self._lock:
+            return dict(entries   = len(self._entries),
+                        size      = self.size,
+                        max_size  = self.max_bytes,
+                        hits      = self.hits,
+                        misses    = self.misses,
+                        evictions = self.evictions)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size      = 0
+            self.hits      = 0
+            self.misses    = 0
+            self.evictions = 0
+
+value_cache = ValueCache(config.getint('cache', 'value_cache_mb', 256) * 1024 * 1024)
@@ -1,9 +1,10 @@
-from HydraServer.db.model import Network, Scenario, Project, User, Role, Perm, RolePerm, RoleUser, ResourceAttr, ResourceType
+from HydraServer.db.model import Network, Scenario, Project, User, Role, Perm, RolePerm, RoleUser, ResourceAttr, ResourceType, UserToken
+from HydraServer.util.passwords import hash_password, check_password, hash_token,\
+        get_hash_rounds, get_bcrypt_rounds
 from sqlalchemy.orm.exc import NoResultFound
 from HydraServer.db import DBSession
+from HydraServer.util.sessions import make_session_id
 import datetime
-import random
-import bcrypt
 from HydraLib.HydraException import HydraError
 import transaction
 import logging
@@ -69,7 +70,7 @@ def make_root_user():
         user = DBSession.query(User).filter(User.username=='root').one()
     except NoResultFound:
         user = User(username='root',
-                    password=bcrypt.hashpw('', bcrypt.gensalt()),
+                    password=hash_password(''),
                     display_name='Root User')
         DBSession.add(user)
 
@@ -95,14 +96,39 @@ def login_user(username, password):
     except NoResultFound:
        raise HydraError(username)
 
-    if bcrypt.hashpw(password.encode('utf-8'), user_i.password.encode('utf-8')) == user_i.password.encode('utf-8'):
-        session_id = '%x' % random.randint(1<<124, (1<<128)-1)
+    if check_password(user_i.user_id, username, password, user_i.password):
+        session_id = make_session_id()
     else:
        raise HydraError(username)
 
+    #Rehash the password if the work factor has been changed since it was set.
+    if get_hash_rounds(user_i.password) != get_bcrypt_rounds():
+        user_i.password = hash_password(password)
+
     user_i.last_login = datetime.datetime.now()
     return user_i.user_id, session_id
 
+def login_user_with_token(token):
+    """
+        Log in using an API token instead of a username and password.
+        Returns the user_id, username and a new session ID.
+    """
+    if token is None:
+        raise HydraError("No token specified")
+
+    try:
+        token_i = DBSession.query(UserToken).filter(UserToken.token_hash==hash_token(token)).one()
+    except NoResultFound:
+        raise HydraError("Invalid token")
+
+    session_id = make_session_id()
+
+    now = datetime.datetime.now()
+    token_i.last_used = now
+    token_i.user.last_login = now
+
+    return token_i.user_id, token_i.user.username, session_id
+
 
 def create_default_net():
     try:
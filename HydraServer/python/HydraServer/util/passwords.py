@@ -0,0 +1,137 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Password hashing and checking, and API tokens.
+
+    Checking a password with bcrypt is deliberately slow. Once a password has
+    been checked, an HMAC of the username, password and stored hash is kept for
+    a short time (credential_cache_ttl), so that logging in again with the same
+    password does not need bcrypt. The HMAC key is random and only held
+    in memory, so the cache does not contain anything which can be used to
+    recover the password. As the stored hash is part of the HMAC,
+    changing a password stops the cached entry from matching.
+
+    API tokens are long random strings, so unlike passwords they do not need
+    a slow hash. Only their SHA-256 is stored.
+"""
+import hmac
+import hashlib
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import bcrypt
+from HydraLib import config
+
+import logging
+log = logging.getLogger(__name__)
+
+def _encode(val):
+    if isinstance(val, unicode):
+        return val.encode('utf-8')
+    return val
+
+def get_bcrypt_rounds():
+    return config.getint('security', 'bcrypt_rounds', 12)
+
+def hash_password(password):
+    """
+        Hash a password using bcrypt, with the configured work factor.
+    """
+    return bcrypt.hashpw(_encode(password), bcrypt.gensalt(get_bcrypt_rounds()))
+
+def get_hash_rounds(password_hash):
+    """
+        Get the work factor from a bcrypt hash ($2b$<rounds>$<salt and hash>)
+    """
+    try:
+        return int(password_hash.split('$')[2])
+    except (IndexError, ValueError):
+        return None
+
+class CredentialCache(object):
+
+    def __init__(self, ttl=300, max_size=1000):
+        self.ttl      = ttl
+        self.max_size = max_size
+
+        self._key     = os.urandom(32)
+        #user_id -> (digest, expiry)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, username, password, password_hash):
+        return hmac.new(self._key,
+                        "\0".join((_encode(username), _encode(password), _encode(password_hash))),
+                        hashlib.sha256).digest()
+
+    def check(self, user_id, username, password, password_hash):
+        if self.ttl <= 0:
+            return False
+        digest = self._digest(username, password, password_hash)
+        with self._lock:
+            entry = self._entries.get(user_id)
+        if entry is None or entry[1] < time.time():
+            return False
+        return hmac.compare_digest(entry[0], digest)
+
+    def add(self, user_id, username, password, password_hash):
+        if self.ttl <= 0:
+            return
+        digest = self._digest(username, password, password_hash)
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (digest, time.time() + self.ttl)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+credential_cache = CredentialCache(config.getint('security', 'credential_cache_ttl', 300))
+
+def check_password(user_id, username, password, password_hash):
+    """
+        Check a password against the hash stored for a user, using the
+        credential cache if the password has been checked recently.
+    """
+    password_hash = _encode(password_hash)
+
+    if credential_cache.check(user_id, username, password, password_hash):
+        return True
+
+    if bcrypt.hashpw(_encode(password), password_hash) == password_hash:
+        credential_cache.add(user_id, username, password, password_hash)
+        return True
+
+    return False
+
+def generate_token():
+    """
+        Generate a new API token. Returns the token, which is given to the
+        user, and its hash, which is stored.
+    """
+    token = os.urandom(32).encode('hex')
+    return token, hash_token(token)
+
+def hash_token(token):
+    return hashlib.sha256(_encode(token)).hexdigest()
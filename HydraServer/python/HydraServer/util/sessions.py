@@ -0,0 +1,242 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Stores of login sessions, mapping a session ID to (user_id, username).
+
+    The stores behave like a dictionary, so a plain dict can still be
+    passed to soap_server.hydra_base.set_session_db. Unlike a dictionary,
+    they never replace an existing session: setting a session ID which is
+    already in use raises a KeyError, and add() makes a new ID instead.
+
+    Sessions expire once they have not been used for ttl seconds.
+
+    MemorySessionStore keeps the sessions in this process, and also removes the
+    least recently used sessions once there are more than max_size.
+
+    SqliteSessionStore keeps the sessions in a sqlite file, so they survive
+    restarts and are shared by all the processes using the same file.
+"""
+import logging
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from HydraLib import config
+
+log = logging.getLogger(__name__)
+
+def make_session_id():
+    """
+        Create a new, unguessable session ID. This uses os.urandom rather
+        than the random module, whose state is copied into every forked
+        server process.
+    """
+    return os.urandom(16).encode('hex')
+
+class MemorySessionStore(object):
+
+    #Whether sessions are visible to other processes
+    shared = False
+
+    def __init__(self, ttl=86400, max_size=10000):
+        self.ttl      = ttl
+        self.max_size = max_size
+
+        #session_id -> (user_id, username, last_access), least recently used first.
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, default=None):
+        now = time.time()
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return default
+            if now - session[2] > self.ttl:
+                return default
+            #Put it back at the end, so it is the most recently used.
+            self._sessions[session_id] = (session[0], session[1], now)
+        return (session[0], session[1])
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        if self._insert(session_id, session) is False:
+            raise KeyError("Session %s already exists" % session_id)
+
+    def add(self, session_id, session):
+        """
+            Add a session without replacing an existing one. If the ID is
+            already in use, a new one is made. Returns the session ID used.
+        """
+        while self._insert(session_id, session) is False:
+            log.warning("Session ID already in use. Making a new one.")
+            session_id = make_session_id()
+        return session_id
+
+    def _insert(self, session_id, session):
+        user_id, username = session
+        with self._lock:
+            if session_id in self._sessions:
+                return False
+            self._sessions[session_id] = (user_id, username, time.time())
+            self._remove_expired()
+            while len(self._sessions) > self.max_size:
+                self._sessions.popitem(last=False)
+        return True
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            del(self._sessions[session_id])
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _remove_expired(self):
+        """
+            Remove the expired sessions. As the sessions are in order
+            of last access, this stops at the first one which has not expired.
+        """
+        cutoff = time.time() - self.ttl
+        while len(self._sessions) > 0:
+            session_id, session = next(self._sessions.iteritems())
+            if session[2] >= cutoff:
+                break
+            del(self._sessions[session_id])
+
+class SqliteSessionStore(object):
+
+    shared = True
+
+    def __init__(self, path, ttl=86400):
+        self.path = path
+        self.ttl  = ttl
+
+        #Only record a session being used if its last access is older than
+        #this, so that every request doesn't have to write to the file.
+        self.touch_interval = max(1, ttl / 100)
+
+        #sqlite connections can't be shared between threads
+        self._local = threading.local()
+
+        session_dir = os.path.dirname(path)
+        if session_dir and not os.path.exists(session_dir):
+            os.makedirs(session_dir)
+
+        with self._connection() as conn:
+            conn.execute("create table if not exists tSession ("
+                         " session_id text primary key,"
+                         " user_id integer not null,"
+                         " username text,"
+                         " last_access real not null)")
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id, default=None):
+        now = time.time()
+        conn = self._connection()
+        row = conn.execute("select user_id, username, last_access from tSession"
+                           " where session_id = ?", (session_id,)).fetchone()
+        if row is None or now - row[2] > self.ttl:
+            return default
+
+        if now - row[2] > self.touch_interval:
+            with conn:
+                conn.execute("update tSession set last_access = ? where session_id = ?",
+                             (now, session_id))
+
+        username = row[1].encode('utf-8') if row[1] is not None else None
+        return (row[0], username)
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        if self._insert(session_id, session) is False:
+            raise KeyError("Session %s already exists" % session_id)
+
+    def add(self, session_id, session):
+        """
+            Add a session without replacing an existing one. If the ID is
+            already in use, a new one is made. Returns the session ID used.
+        """
+        while self._insert(session_id, session) is False:
+            log.warning("Session ID already in use. Making a new one.")
+            session_id = make_session_id()
+        return session_id
+
+    def _insert(self, session_id, session):
+        user_id, username = session
+        if isinstance(username, str):
+            username = username.decode('utf-8')
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute("delete from tSession where last_access < ?", (now - self.ttl,))
+        try:
+            with conn:
+                conn.execute("insert into tSession"
+                             " (session_id, user_id, username, last_access)"
+                             " values (?, ?, ?, ?)", (session_id, user_id, username, now))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def __delitem__(self, session_id):
+        with self._connection() as conn:
+            cursor = conn.execute("delete from tSession where session_id = ?", (session_id,))
+            if cursor.rowcount == 0:
+                raise KeyError(session_id)
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def __len__(self):
+        return self._connection().execute("select count(*) from tSession").fetchone()[0]
+
+def make_session_store():
+    """
+        Create the session store specified in the [sessions] section of the config.
+    """
+    store = config.get('sessions', 'store', 'memory')
+    ttl   = config.getint('sessions', 'ttl', 86400)
+
+    if store == 'memory':
+        return MemorySessionStore(ttl, config.getint('sessions', 'max_sessions', 10000))
+    elif store == 'sqlite':
+        path = config.get('sessions', 'sqlite_path',
+                os.path.join(config.get('DEFAULT', 'hydra_aux_dir', '.'), 'sessions.db'))
+        return SqliteSessionStore(path, ttl)
+    else:
+        log.critical("Unknown session store %s. Using memory.", store)
+        return MemorySessionStore(ttl, config.getint('sessions', 'max_sessions', 10000))
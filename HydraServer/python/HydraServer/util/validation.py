@@ -0,0 +1,136 @@
+# (c) Copyright 2013, 2014, University of Manchester
+#
+# HydraPlatform is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# HydraPlatform is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
+#
+"""
+    Checking datasets against data restrictions in a pool of worker processes.
+
+    Checking large numbers of timeseries is CPU bound, so one request can
+    only use one core. If [validation] workers is more than 0, the server
+    starts that many processes when it starts, and checks of at least
+    [validation] parallel_threshold datasets are split between them. Smaller
+    checks are done in the request thread, as sending the values to the
+    workers takes longer than checking them.
+
+    A check is a (dataset_id, data_type, value, data_hash, restrictions)
+    tuple, where restrictions is a list of (key, data_restriction) and
+    data_restriction is the text stored on the type attribute. The
+    workers return {(dataset_id, key) : error_text} for the checks which fail.
+"""
+import logging
+import multiprocessing
+
+from HydraLib import config, util
+from HydraLib.HydraException import HydraError
+
+from HydraServer.util import get_val
+
+log = logging.getLogger(__name__)
+
+_pool = None
+
+#Compiled restrictions in each worker, keyed on the restriction text.
+_compiled = {}
+
+class _DatasetValue(object):
+    """
+        The parts of a dataset needed by get_val.
+    """
+    def __init__(self, dataset_id, data_type, value, data_hash):
+        self.dataset_id = dataset_id
+        self.data_type  = data_type
+        self.value      = value
+        self.data_hash  = data_hash
+
+def get_num_workers():
+    return config.getint('validation', 'workers', 0)
+
+def use_pool(num_datasets):
+    """
+        Whether checking this many datasets should be done in the worker pool.
+    """
+    return _pool is not None and \
+            num_datasets >= config.getint('validation', 'parallel_threshold', 500)
+
+def start_pool():
+    """
+        Start the worker pool, if [validation] workers is more than 0.
+
+        The workers are forked from this process, so this must be called
+        while the process has only one thread, before the server starts its
+        request threads, and after the database engine's connections have
+        been disposed of, so that the workers do not inherit held locks or
+        open connections. If no pool is started, all checks are done in
+        the request thread.
+    """
+    global _pool
+    num_workers = get_num_workers()
+    if _pool is None and num_workers > 0:
+        log.info("Starting %s validation workers", num_workers)
+        _pool = multiprocessing.Pool(num_workers)
+    return _pool
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+def _get_compiled(data_restriction):
+    validator = _compiled.get(data_restriction)
+    if validator is None:
+        validator = util.CompiledRestriction(eval(data_restriction))
+        _compiled[data_restriction] = validator
+    return validator
+
+def check_datasets(checks):
+    """
+        Run a list of checks (see above) in this process.
+    """
+    errors = {}
+    for dataset_id, data_type, value, data_hash, restrictions in checks:
+        val = get_val(_DatasetValue(dataset_id, data_type, value, data_hash))
+        for key, data_restriction in restrictions:
+            try:
+                _get_compiled(data_restriction).validate(val)
+            except HydraError, e:
+                errors[(dataset_id, key)] = e.message
+    return errors
+
+def _shard(checks, num_shards):
+    """
+        Split the checks into shards with roughly the same amount
+        of data in each, by dealing them out largest first.
+    """
+    shards = [[] for i in range(num_shards)]
+    sizes  = [0] * num_shards
+    for check in sorted(checks, key=lambda c: len(c[2] or ''), reverse=True):
+        i = sizes.index(min(sizes))
+        shards[i].append(check)
+        sizes[i] = sizes[i] + len(check[2] or '')
+    return [s for s in shards if len(s) > 0]
+
+def check_datasets_in_pool(checks):
+    """
+        Run a list of checks (see above) in the worker pool,
+        returning the errors of all the workers.
+    """
+    if _pool is None:
+        raise HydraError("The validation worker pool has not been started.")
+
+    errors = {}
+    for shard_errors in _pool.map(check_datasets, _shard(checks, get_num_workers())):
+        errors.update(shard_errors)
+    return errors
@@ -16,10 +16,6 @@
 # along with HydraPlatform.  If not, see <http://www.gnu.org/licenses/>
 #
 
-import bcrypt
-bcrypt.hashpw('', bcrypt.gensalt())
-
-
 import sys
 import spyne.service #Needed for build script.
 #if "./python" not in sys.path:
@@ -100,12 +96,18 @@ import datetime
 import traceback
 
 from cherrypy.wsgiserver import CherryPyWSGIServer
-from HydraServer.db import commit_transaction, rollback_transaction 
+from HydraServer.db import commit_transaction, rollback_transaction, close_session, engine
+from HydraServer.util.cache import network_cache
+from HydraServer.util import validation
+import os
+import signal
+import random
 
 log = logging.getLogger(__name__)
 
 def _on_method_call(ctx):
-    if ctx.function == AuthenticationService.login:
+    if ctx.function in (AuthenticationService.login,
+                        AuthenticationService.login_with_token):
         return
 
     if ctx.in_body_doc.get('sessionid'):
@@ -213,7 +215,7 @@ class HydraServer():
         return app
 
     def run_server(self):
-        
+
         log.info("home_dir %s",config.get('DEFAULT', 'home_dir'))
         log.info("hydra_base_dir %s",config.get('DEFAULT', 'hydra_base_dir'))
         log.info("common_app_data_folder %s",config.get('DEFAULT', 'common_app_data_folder'))
@@ -228,18 +230,103 @@ class HydraServer():
         port = config.getint('hydra_server', 'port', 8080)
         domain = config.get('hydra_server', 'domain', '127.0.0.1')
        
+        numthreads = config.getint('hydra_server', 'numthreads', 10)
+        processes  = config.getint('hydra_server', 'processes', 1)
+        request_queue_size = config.getint('hydra_server', 'request_queue_size', 5)
+
         check_port_available(domain, port)
 
         spyne.const.xml_ns.DEFAULT_NS = 'soap_server.hydra_complexmodels'
-        cp_wsgi_application = CherryPyWSGIServer((domain,port), application, numthreads=1)
 
         log.info("listening to http://%s:%s", domain, port)
         log.info("wsdl is at: http://%s:%s/soap/?wsdl", domain, port)
+        log.info("Serving with %s threads in %s processes", numthreads, processes)
+
+        if processes > 1:
+            run_forked_server(domain, port, processes, numthreads, request_queue_size)
+            return
+
+        #The validation workers are forked from this process, so they are
+        #started before the request threads, without any open DB connections.
+        engine.dispose()
+        validation.start_pool()
+
+        cp_wsgi_application = CherryPyWSGIServer((domain,port), application,
+                                                 numthreads=numthreads,
+                                                 request_queue_size=request_queue_size)
         try:
             cp_wsgi_application.start()
         except KeyboardInterrupt:
             cp_wsgi_application.stop()
 
+class PreforkWSGIServer(CherryPyWSGIServer):
+    """
+        A CherryPy server which accepts connections on a socket which
+        has already been bound, so that several processes can share it.
+    """
+    def __init__(self, listening_socket, *args, **kwargs):
+        self.listening_socket = listening_socket
+        CherryPyWSGIServer.__init__(self, *args, **kwargs)
+
+    def bind(self, family, type, proto=0):
+        self.socket = self.listening_socket
+
+def run_forked_server(domain, port, processes, numthreads, request_queue_size):
+    """
+        Bind to the port, then fork a number of processes, each of which
+        serves requests from the port using its own pool of threads.
+    """
+    if not hasattr(os, 'fork'):
+        raise HydraError("Running in multiple processes is not supported on this platform.")
+
+    listening_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listening_socket.bind((domain, port))
+    listening_socket.listen(request_queue_size)
+
+    #Database connections must not be shared between processes.
+    engine.dispose()
+
+    if network_cache.enabled and network_cache.cache_dir is None:
+        log.warning("No network_cache_dir is set, so networks can't be "
+                    "cached when serving in multiple processes.")
+        network_cache.max_size = 0
+
+    if getattr(get_session_db(), 'shared', False) is False:
+        log.warning("Login sessions are held in memory, so a session is only "
+                    "recognised by the process in which the user logged in. "
+                    "Set store = sqlite in [sessions] to share them.")
+
+    children = []
+    for i in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            #Each process must not repeat the random numbers of the others.
+            random.seed()
+            validation.start_pool()
+            server = PreforkWSGIServer(listening_socket, (domain, port), application,
+                                       numthreads=numthreads,
+                                       request_queue_size=request_queue_size)
+            signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+            try:
+                server.start()
+            except KeyboardInterrupt:
+                server.stop()
+            os._exit(0)
+        children.append(pid)
+
+    log.info("Started server processes: %s", children)
+
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
 def check_port_available(domain, port):
     """
         Given a domain and port, check to see whether that combination is available
@@ -258,15 +345,31 @@ soap_application = s.create_soap_application()
 json_application = s.create_json_application()
 http_application = s.create_http_application()
 
-application = WsgiMounter({
+mounter = WsgiMounter({
     config.get('hydra_server', 'soap_path', 'soap'): soap_application,
     config.get('hydra_server', 'json_path', 'json'): json_application,
     config.get('hydra_server', 'http_path', 'http'): http_application,
 })
 
-for server in application.mounts.values():
+for server in mounter.mounts.values():
     server.max_content_length = 100 * 0x100000 # 10 MB
 
+def application(environ, start_response):
+    """
+        Serve a request, then make sure the thread's DB session is removed,
+        even if the request failed before reaching a service method. The threads
+        are reused, so a session left behind would be used by the next request.
+    """
+    response = None
+    try:
+        response = mounter(environ, start_response)
+        for chunk in response:
+            yield chunk
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+        close_session()
+
 #To kill this process, use this command:
 #ps -ef | grep 'server.py' | grep 'python' | awk '{print $2}' | xargs kill
 if __name__ == '__main__':